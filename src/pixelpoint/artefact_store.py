@@ -0,0 +1,282 @@
+import contextlib
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+from typing import ContextManager
+from typing import Iterator
+from typing import Optional
+
+from pixelpoint.artefact_writer import FSYNC_POLICIES
+from pixelpoint.artefact_writer import write_file_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+"""
+Artefact stores shared by all server workers and nodes.
+
+Uploads and other inputs are stored under content-addressed keys `<namespace>/<hash[:2]>/<hash><suffix>`, so
+concurrent requests with files of the same name never overwrite each other and identical files are stored once.
+Results are stored under keys of their unique operation id. Objects are written atomically, so readers see either no
+object or the complete one. Uploads and results are never overwritten, so their local copies can be cached; keys that
+change, e.g. the progress of an operation, are read with `get`.
+
+Backends:
+
+- `LocalArtefactStore`: a directory, shared by the workers of a node or by nodes through a network filesystem;
+- `S3ArtefactStore`: an S3 bucket through a boto3 compatible client, e.g. `boto3.client("s3")` for S3 or MinIO, or
+  `LocalS3Client`, a stand-in that keeps the bucket in a local directory for development and tests.
+
+"""
+
+ARTEFACT_STORES = ("local", "s3", "s3-local")
+KEY_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+(/[A-Za-z0-9_.-]+)*$")
+SUFFIX_PATTERN = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+
+class ArtefactNotFound(KeyError):
+    pass
+
+
+def content_key(data: bytes, namespace: str, suffix: str = "") -> str:
+    """Content-addressed key of `data`: SHA-256 of the content under `namespace`, with the `suffix` if it's safe."""
+    digest = hashlib.sha256(data).hexdigest()
+    suffix = suffix.lower() if SUFFIX_PATTERN.match(suffix.lower()) else ""
+    return check_key(f"{namespace}/{digest[:2]}/{digest}{suffix}")
+
+
+def check_key(key: str) -> str:
+    """Check that the key is a relative path of safe names, so it can't escape the store."""
+    if KEY_PATTERN.match(key) is None or any(part in (".", "..") for part in key.split("/")):
+        raise ValueError(f"Invalid artefact key: {key}")
+    return key
+
+
+class ArtefactStore:
+    """
+    Interface of artefact stores.
+
+    `put` stores content under its content-addressed key, `write` stores it under a given key. Both are atomic.
+    `local_path` returns a local file with the content, e.g. to serve it or to pass it to OpenCV or Blender.
+
+    """
+
+    def put(self, data: bytes, namespace: str, suffix: str = "") -> str:
+        """Store `data` under its content-addressed key and return the key. Identical content is stored once."""
+        key = content_key(data, namespace, suffix)
+        if not self.exists(key):
+            self.write(key, data)
+        return key
+
+    def write(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Path:
+        raise NotImplementedError
+
+    def lock(self, key: str) -> ContextManager[None]:
+        """Exclusive lock of `key`, e.g. so only one worker encodes a derived artefact and the others reuse it."""
+        raise NotImplementedError
+
+
+class LocalArtefactStore(ArtefactStore):
+    """
+    Artefacts in a local directory.
+
+    Objects are written to a temporary file and renamed, locks are `fcntl` locks of files in `<root>/.locks`, so they
+    work across processes, and across nodes on network filesystems supporting them (e.g. NFSv4).
+
+    """
+
+    def __init__(self, root: Path, fsync: str = "never"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync}, use one of {FSYNC_POLICIES}")
+        self.root = Path(root)
+        self.fsync = fsync
+        self.root.mkdir(exist_ok=True, parents=True)
+
+    def write(self, key: str, data: bytes):
+        write_file_atomic(self.root / check_key(key), data, fsync=self.fsync)
+
+    def get(self, key: str) -> bytes:
+        return self.local_path(key).read_bytes()
+
+    def exists(self, key: str) -> bool:
+        return (self.root / check_key(key)).is_file()
+
+    def local_path(self, key: str) -> Path:
+        path = self.root / check_key(key)
+        if not path.is_file():
+            raise ArtefactNotFound(key)
+        return path
+
+    @contextlib.contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        with _file_lock(self.root / ".locks" / (check_key(key).replace("/", "%") + ".lock")):
+            yield
+
+
+class LocalS3Client:
+    """
+    Stand-in of a boto3 S3 client keeping the buckets in subdirectories of `root`.
+
+    Implements the subset of the client API used by `S3ArtefactStore`: `put_object`, `get_object` and `head_object`.
+    Missing objects raise `LocalS3Error` with the response structure of `botocore.exceptions.ClientError`.
+
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes):  # pylint: disable=invalid-name
+        write_file_atomic(self._path(Bucket, Key), Body)
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def get_object(self, Bucket: str, Key: str):  # pylint: disable=invalid-name
+        path = self._path(Bucket, Key)
+        try:
+            # pylint: disable-next=consider-using-with
+            return {"Body": open(path, "rb"), "ContentLength": path.stat().st_size}
+        except FileNotFoundError as exc:
+            raise LocalS3Error("NoSuchKey", Key) from exc
+
+    def head_object(self, Bucket: str, Key: str):  # pylint: disable=invalid-name
+        path = self._path(Bucket, Key)
+        if not path.is_file():
+            raise LocalS3Error("404", Key)
+        return {"ContentLength": path.stat().st_size}
+
+    def _path(self, bucket: str, key: str) -> Path:
+        return self.root / check_key(bucket) / check_key(key)
+
+
+class LocalS3Error(Exception):
+    def __init__(self, code: str, key: str):
+        super().__init__(f"{code}: {key}")
+        self.response = {"Error": {"Code": code, "Key": key}}
+
+
+class S3ArtefactStore(ArtefactStore):
+    """
+    Artefacts in an S3 bucket.
+
+    Objects are downloaded to `cache_dir` for `local_path`, so it must be used only for keys that are never overwritten.
+    S3 has no locks, `lock` serializes only the workers of one node; on different nodes the same derived artefact may be
+    computed twice, which is harmless because it has the same content.
+
+    """
+
+    def __init__(self, client, bucket: str, cache_dir: Path, prefix: str = ""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+
+    def write(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def get(self, key: str) -> bytes:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as exc:  # pylint: disable=broad-except
+            if _is_not_found(exc):
+                raise ArtefactNotFound(key) from exc
+            raise
+        with contextlib.closing(response["Body"]) as body:
+            return body.read()
+
+    def exists(self, key: str) -> bool:
+        if (self.cache_dir / check_key(key)).is_file():
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as exc:  # pylint: disable=broad-except
+            if _is_not_found(exc):
+                return False
+            raise
+        return True
+
+    def local_path(self, key: str) -> Path:
+        path = self.cache_dir / check_key(key)
+        if not path.is_file():
+            write_file_atomic(path, self.get(key))
+        return path
+
+    @contextlib.contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        with _file_lock(self.cache_dir / ".locks" / (check_key(key).replace("/", "%") + ".lock")):
+            yield
+
+    def _object_key(self, key: str) -> str:
+        check_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+
+def create_artefact_store(
+    kind: str,
+    root: Path,
+    fsync: str = "never",
+    bucket: str = "pixelpoint",
+    prefix: str = "",
+    endpoint_url: Optional[str] = None,
+) -> ArtefactStore:
+    """
+    Create an artefact store from `ARTEFACT_STORES`.
+
+    "local" keeps the artefacts in `root`; "s3" uses the S3 `bucket` at `endpoint_url` (default AWS) and needs boto3;
+    "s3-local" keeps the bucket in `root`/s3 with `LocalS3Client`. S3 stores cache the downloaded objects in
+    `root`/s3_cache.
+
+    """
+    root = Path(root)
+    if kind == "local":
+        return LocalArtefactStore(root, fsync=fsync)
+    if kind == "s3-local":
+        return S3ArtefactStore(LocalS3Client(root / "s3"), bucket, cache_dir=root / "s3_cache", prefix=prefix)
+    if kind == "s3":
+        try:
+            import boto3  # pylint: disable=import-outside-toplevel
+        except ImportError as exc:
+            raise ImportError("The s3 artefact store requires boto3: pip install boto3") from exc
+        client = boto3.client("s3", endpoint_url=endpoint_url)
+        return S3ArtefactStore(client, bucket, cache_dir=root / "s3_cache", prefix=prefix)
+    raise ValueError(f"Unknown artefact store {kind}, use one of {ARTEFACT_STORES}")
+
+
+# A fixed number of striped locks, so the locks don't grow with the number of locked keys
+_THREAD_LOCK_STRIPES = 64
+_thread_locks = tuple(threading.Lock() for _ in range(_THREAD_LOCK_STRIPES))
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path: Path) -> Iterator[None]:
+    # fcntl locks belong to the process, threads of one process are serialized by the stripe lock of the file. Keys
+    # sharing a stripe wait for each other, so the locks must not be nested
+    with _thread_locks[hash(lock_path.as_posix()) % _THREAD_LOCK_STRIPES]:
+        if fcntl is None:
+            yield
+            return
+        lock_path.parent.mkdir(exist_ok=True, parents=True)
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+def _is_not_found(exc: Exception) -> bool:
+    code = getattr(exc, "response", {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
@@ -0,0 +1,270 @@
+import io
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from pixelpoint.artefact_store import ArtefactStore
+
+"""
+Background writer of artefacts: images, arrays and JSON files.
+
+Encoding a 5120x4096 PNG costs from hundreds of milliseconds to seconds, so the processing paths hand their results to
+the writer and continue, the writer threads encode and write them. The queue is bounded: when the disk or the encoder
+can't keep up, `write` blocks instead of keeping an unbounded number of images in memory.
+
+Files are written to a temporary name and renamed, so readers never see a partially written artefact. The fsync
+policy trades durability for throughput: "never" leaves flushing to the OS, "file" syncs the file before the rename,
+"directory" also syncs the directory so the rename survives a power loss.
+
+"""
+
+ENCODERS = ("png", "jpg", "npy")
+FSYNC_POLICIES = ("never", "file", "directory")
+SUFFIXES = (".png", ".jpg", ".jpeg", ".webp", ".npy", ".json")
+
+
+def encode_artefact(data: Any, suffix: str, png_compression: int = 3, quality: int = 95) -> bytes:
+    """
+    Encode an artefact by the file suffix.
+
+    Parameters
+    ----------
+    data : Any
+        Image in the OpenCV channel order for ".png", ".jpg", ".jpeg" and ".webp", any array for ".npy", JSON
+        serializable object for ".json".
+    suffix : str
+        File suffix from `SUFFIXES`.
+    png_compression : int
+        zlib compression level of PNG from 0 (fastest) to 9.
+    quality : int
+        JPEG and WebP quality from 0 to 100.
+
+    """
+    if suffix == ".npy":
+        buffer = io.BytesIO()
+        np.save(buffer, data)
+        return buffer.getvalue()
+    if suffix == ".json":
+        return json.dumps(data, indent=4).encode()
+
+    # OpenCV is imported only for images, Blender writes arrays and JSON files without it
+    import cv2  # pylint: disable=import-outside-toplevel
+
+    params = {
+        ".png": [cv2.IMWRITE_PNG_COMPRESSION, png_compression],
+        ".jpg": [cv2.IMWRITE_JPEG_QUALITY, quality],
+        ".jpeg": [cv2.IMWRITE_JPEG_QUALITY, quality],
+        ".webp": [cv2.IMWRITE_WEBP_QUALITY, quality],
+    }
+    if suffix not in params:
+        raise ValueError(f"Unknown artefact format {suffix}, use one of {SUFFIXES}")
+    ok, encoded = cv2.imencode(suffix, data, params[suffix])
+    if not ok:
+        raise ValueError(f"Image can not be encoded to {suffix}")
+    return encoded.tobytes()
+
+
+def write_file_atomic(path: Path, data: bytes, fsync: str = "never"):
+    """Write `data` to a temporary file and rename it to `path`, syncing to disk according to the `fsync` policy."""
+    path.parent.mkdir(exist_ok=True, parents=True)
+    # Concurrent writers of the same file don't share the temporary file, the last rename wins
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            if fsync != "never":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    if fsync == "directory":
+        directory_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+
+def write_artefact(path: Path, data: Any, writer: Optional["ArtefactWriter"] = None):
+    """Write an artefact in the background with `writer`, or synchronously with the default encoder settings."""
+    if writer is not None:
+        writer.write(path, data)
+    else:
+        write_file_atomic(Path(path), encode_artefact(data, Path(path).suffix.lower()))
+
+
+class ArtefactWriter:
+    """
+    Encode and write artefacts in background threads.
+
+    The format is chosen by the file suffix, see `encode_artefact`. Arrays are written as they are when the write
+    is executed, so the caller must not modify them after `write`.
+
+    Parameters
+    ----------
+    max_queue : int
+        Maximal number of artefacts waiting to be written, `write` blocks when the queue is full.
+    workers : int
+        Number of writer threads. PNG encoding releases the GIL, so several threads encode in parallel.
+    png_compression : int
+        zlib compression level of PNG from 0 (fastest) to 9.
+    quality : int
+        JPEG and WebP quality from 0 to 100.
+    fsync : str
+        Fsync policy from `FSYNC_POLICIES`.
+    store : ArtefactStore
+        Store to write the artefacts to, the paths are its keys then. Files are written directly if None.
+
+    """
+
+    def __init__(
+        self,
+        max_queue: int = 8,
+        workers: int = 1,
+        png_compression: int = 3,
+        quality: int = 95,
+        fsync: str = "never",
+        store: Optional["ArtefactStore"] = None,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync}, use one of {FSYNC_POLICIES}")
+        if max_queue < 1 or workers < 1:
+            raise ValueError("Queue size and number of workers must be positive")
+        self.max_queue = max_queue
+        self.png_compression = png_compression
+        self.quality = quality
+        self.fsync = fsync
+        self.store = store
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._pending: Dict[Path, Future] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {
+            "written": 0,
+            "failed": 0,
+            "bytes_written": 0,
+            "encode_time": 0.0,
+            "encode_time_max": 0.0,
+            "write_time": 0.0,
+            "queue_wait": 0.0,
+            "last_error": None,
+        }
+        self._threads = [
+            threading.Thread(target=self._run, name=f"artefact-writer-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def write(self, path: Path, data: Any) -> Future:
+        """Queue an artefact and return a future with its path, which is set when the file is written."""
+        path = Path(path)
+        suffix = path.suffix.lower()
+        if suffix not in SUFFIXES:
+            raise ValueError(f"Unknown artefact format {suffix}, use one of {SUFFIXES}")
+
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Artefact writer is closed")
+            self._pending[path] = future
+        self._queue.put((path, data, suffix, future, time.perf_counter()))
+        return future
+
+    def wait(self, path: Path, timeout: Optional[float] = None):
+        """Wait until the queued write of `path` is finished and re-raise its error, returns if none is queued."""
+        with self._lock:
+            future = self._pending.get(Path(path))
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def flush(self):
+        """Wait until all queued artefacts are written."""
+        self._queue.join()
+
+    def close(self):
+        """Write all queued artefacts and stop the threads, e.g. on shutdown. Later writes raise RuntimeError."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self) -> "ArtefactWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            pending = len(self._pending)
+        done = max(stats["written"] + stats["failed"], 1)
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "pending": pending,
+            "written": stats["written"],
+            "failed": stats["failed"],
+            "bytes_written": stats["bytes_written"],
+            "encode_time_mean": stats["encode_time"] / done,
+            "encode_time_max": stats["encode_time_max"],
+            "write_time_mean": stats["write_time"] / done,
+            "queue_wait_mean": stats["queue_wait"] / done,
+            "last_error": stats["last_error"],
+        }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+
+            path, data, suffix, future, queued = item
+            start = time.perf_counter()
+            try:
+                encoded = encode_artefact(data, suffix, png_compression=self.png_compression, quality=self.quality)
+                encoded_time = time.perf_counter()
+                if self.store is not None:
+                    self.store.write(path.as_posix(), encoded)
+                else:
+                    write_file_atomic(path, encoded, fsync=self.fsync)
+                end = time.perf_counter()
+                with self._lock:
+                    self._stats["written"] += 1
+                    self._stats["bytes_written"] += len(encoded)
+                    self._stats["encode_time"] += encoded_time - start
+                    self._stats["encode_time_max"] = max(self._stats["encode_time_max"], encoded_time - start)
+                    self._stats["write_time"] += end - encoded_time
+                    self._stats["queue_wait"] += start - queued
+                future.set_result(path)
+            except Exception as exc:  # pylint: disable=broad-except
+                with self._lock:
+                    self._stats["failed"] += 1
+                    self._stats["queue_wait"] += start - queued
+                    self._stats["last_error"] = f"{path}: {type(exc).__name__}: {exc}"
+                future.set_exception(exc)
+            finally:
+                with self._lock:
+                    if self._pending.get(path) is future:
+                        del self._pending[path]
+                self._queue.task_done()
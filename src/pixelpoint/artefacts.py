@@ -0,0 +1,143 @@
+import hashlib
+import re
+from pathlib import Path
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+import cv2
+import numpy as np
+from starlette.requests import Request
+from starlette.responses import FileResponse
+from starlette.responses import Response
+from starlette.responses import StreamingResponse
+
+from pixelpoint.artefact_store import ArtefactStore
+from pixelpoint.artefact_writer import encode_artefact
+
+"""
+Result images of the web app and their HTTP delivery.
+
+Results are saved to the artefact store as raw `.npy` arrays by the artefact writer, which costs no encoding on the
+processing path. The full resolution PNG and the downscaled JPEG/WebP previews are encoded on the first request and
+stored next to the raw array, so the same file is served to all later requests, by any server worker, with ETag
+validation and byte ranges.
+
+"""
+
+PREVIEW_FORMATS = {"jpg": (".jpg", "image/jpeg"), "webp": (".webp", "image/webp")}
+SAFE_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+CHUNK_SIZE = 1 << 20
+
+
+def encode_png(store: ArtefactStore, raw_key: str, compression: int = 3) -> str:
+    """Encode the raw image as PNG with zlib `compression` level 0-9 once and return the key of the stored file."""
+    png_key = raw_key[: -len(".npy")] + f"_c{compression}.png"
+    # Workers requesting the same image wait for the first one instead of encoding it again
+    with store.lock(png_key):
+        if not store.exists(png_key):
+            image = np.load(store.local_path(raw_key))
+            store.write(png_key, encode_artefact(image, ".png", png_compression=compression))
+    return png_key
+
+
+def encode_preview(
+    store: ArtefactStore, raw_key: str, max_size: int = 1024, image_format: str = "jpg", quality: int = 85
+) -> str:
+    """Downscale the raw image to fit `max_size` pixels, encode it as JPEG or WebP once and return the stored key."""
+    suffix, _ = PREVIEW_FORMATS[image_format]
+    preview_key = raw_key[: -len(".npy")] + f"_preview{max_size}_q{quality}{suffix}"
+    with store.lock(preview_key):
+        if not store.exists(preview_key):
+            image = np.load(store.local_path(raw_key), mmap_mode="r")
+            scale = min(max_size / max(image.shape[:2]), 1.0)
+            preview = cv2.resize(np.asarray(image), None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            store.write(preview_key, encode_artefact(preview, suffix, quality=quality))
+    return preview_key
+
+
+def result_image_key(op_id: str, name: str) -> Optional[str]:
+    """Store key of the raw image `name` of the operation `op_id`, None if the names are not safe."""
+    if SAFE_NAME.match(op_id) is None or SAFE_NAME.match(name) is None:
+        return None
+    return f"results/{op_id}/{name}.npy"
+
+
+def key_etag(key: str) -> str:
+    """ETag of a stored object that is never overwritten, the same on all workers and nodes."""
+    return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+def file_etag(path: Path) -> str:
+    stat = path.stat()
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=start-end" range into inclusive (start, end) offsets.
+
+    Returns None if the header isn't a single byte range, in that case the whole file is sent. Raises ValueError if
+    the range is not satisfiable.
+
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    start, end = match.groups()
+    if start == "":
+        # Suffix range: the last `end` bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {range_header} is not satisfiable for {size} bytes.")
+    return start, end
+
+
+def artefact_response(
+    request: Request, path: Path, media_type: str, max_age: int = 86400, etag: Optional[str] = None
+) -> Response:
+    """
+    File response with ETag, Cache-Control and single byte range support.
+
+    Artefacts never change after they are written, so clients may cache them for `max_age` seconds and revalidate
+    with If-None-Match; a matching ETag gets 304 Not Modified without a body. The ETag is computed from the file
+    modification time and size if `etag` is None.
+
+    """
+    etag = file_etag(path) if etag is None else etag
+    size = path.stat().st_size
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}, immutable", "Accept-Ranges": "bytes"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header is not None and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+            return StreamingResponse(
+                _read_range(path, start, end), status_code=206, media_type=media_type, headers=headers
+            )
+
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+def _read_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
@@ -1,10 +1,15 @@
 from .calibrate_calculation import calculate_CM
 from .calibrate_calculation import calculate_RT
+from .calibrate_calculation import calculate_sweep
 from .calibrate_chessboard import calibrate_camera_chessboard
 from .calibrate_chessboard import stereo_calibrate_chessboard
 from .calibrate_markers import calibrate_camera_markers
 from .calibrate_markers import load_marker_coords
 from .calibrate_markers import stereo_calibrate_markers
 from .calibration_utils import find_and_check_image_resolution
+from .calibration_utils import load_calibration_params
 from .calibration_utils import load_images
 from .calibration_utils import save_calibration_params
+from .detect_markers import detect_markers
+from .detect_markers import detect_markers_folder
+from .detect_markers import save_marker_coords
@@ -2,6 +2,7 @@ import argparse
 from pathlib import Path
 
 import numpy as np
+import pandas as pd
 
 from .calibration_utils import save_calibration_params
 
@@ -13,7 +14,12 @@ This module performs stereo camera calibration using raw parameters of camera/le
 def parse_args():
     parser = argparse.ArgumentParser(description="Stereo Camera Calibration using raw parameters")
 
-    parser.add_argument("--focal-length", type=float, default=0.08, help="Focal length in meters (default 0.08)")
+    parser.add_argument(
+        "--focal-length",
+        type=parse_values,
+        default=0.08,
+        help='Focal length in meters (default 0.08). With --sweep accepts "a,b,c" or "start:stop:num"',
+    )
     parser.add_argument(
         "--resolution",
         type=str,
@@ -27,10 +33,16 @@ def parse_args():
         help='Pixel size as "pixel_x,pixel_y" in meters (default: 4.5e-6, 4.5e-6)',
     )
     parser.add_argument(
-        "--baseline", type=float, default=0.412, help="Baseline distance between cameras in meters (default: 0.412)"
+        "--baseline",
+        type=parse_values,
+        default=0.412,
+        help="Baseline distance between cameras in meters (default: 0.412). With --sweep accepts a list or a range",
     )
     parser.add_argument(
-        "--cam2obj", type=float, default=0.650, help="Distance from cameras to the object in meters (default: 0.650)"
+        "--cam2obj",
+        type=parse_values,
+        default=0.650,
+        help="Distance from cameras to the object in meters (default: 0.650). With --sweep accepts a list or a range",
     )
     parser.add_argument(
         "--output_file",
@@ -38,6 +50,17 @@ def parse_args():
         default=Path("calib_params.json"),
         help="Path to output JSON file (default: calib_params.json)",
     )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Evaluate every combination of --focal-length, --baseline and --cam2obj and save rig metrics",
+    )
+    parser.add_argument(
+        "--sweep-output",
+        type=Path,
+        default=Path("calib_sweep.csv"),
+        help="Path to output CSV file with sweep metrics (default: calib_sweep.csv)",
+    )
 
     return parser.parse_args()
 
@@ -45,21 +68,34 @@ def parse_args():
 def calculate_CM(focal_length_m, img_resolution, pixel_sz_x, pixel_sz_y):
     width, height = img_resolution
 
-    f_x = focal_length_m / pixel_sz_x
-    f_y = focal_length_m / pixel_sz_y
+    f_x = np.divide(focal_length_m, pixel_sz_x)
+    f_y = np.divide(focal_length_m, pixel_sz_y)
+
+    c_x = np.divide(width, 2.0)
+    c_y = np.divide(height, 2.0)
 
-    c_x = width / 2.0
-    c_y = height / 2.0
+    f_x, f_y, c_x, c_y = np.broadcast_arrays(f_x, f_y, c_x, c_y)
+    zeros = np.zeros_like(f_x)
+    ones = np.ones_like(f_x)
 
-    CM = np.array([[f_x, 0, c_x], [0, f_y, c_y], [0, 0, 1]])
+    CM = _stack_matrix([[f_x, zeros, c_x], [zeros, f_y, c_y], [zeros, zeros, ones]])
 
     return CM
 
 
+def _stack_matrix(rows):
+    # Build a (..., 3, 3) matrix from a nested list of equally shaped arrays
+    return np.stack([np.stack(row, axis=-1) for row in rows], axis=-2)
+
+
 def create_rotation_matrix(rx, ry, rz):
-    R_x = np.array([[1, 0, 0], [0, np.cos(rx), -np.sin(rx)], [0, np.sin(rx), np.cos(rx)]])
-    R_y = np.array([[np.cos(ry), 0, np.sin(ry)], [0, 1, 0], [-np.sin(ry), 0, np.cos(ry)]])
-    R_z = np.array([[np.cos(rz), -np.sin(rz), 0], [np.sin(rz), np.cos(rz), 0], [0, 0, 1]])
+    rx, ry, rz = np.broadcast_arrays(*(np.asarray(angle, dtype=float) for angle in (rx, ry, rz)))
+    zeros = np.zeros_like(rx)
+    ones = np.ones_like(rx)
+
+    R_x = _stack_matrix([[ones, zeros, zeros], [zeros, np.cos(rx), -np.sin(rx)], [zeros, np.sin(rx), np.cos(rx)]])
+    R_y = _stack_matrix([[np.cos(ry), zeros, np.sin(ry)], [zeros, ones, zeros], [-np.sin(ry), zeros, np.cos(ry)]])
+    R_z = _stack_matrix([[np.cos(rz), -np.sin(rz), zeros], [np.sin(rz), np.cos(rz), zeros], [zeros, zeros, ones]])
 
     R = np.matmul(np.matmul(R_z, R_y), R_x)
     return R
@@ -67,47 +103,124 @@ def create_rotation_matrix(rx, ry, rz):
 
 def calculate_RT(baseline, cam2obj):
     # Set global coordinate system in between cameras
+    baseline, cam2obj = np.broadcast_arrays(np.asarray(baseline, dtype=float), np.asarray(cam2obj, dtype=float))
 
     # Calculating R
     alpha = np.pi / 2 - np.arccos(baseline / 2 / cam2obj)  # angle bw baseline and optical axis of camera (in rad)
     R1 = create_rotation_matrix(0, -alpha, 0)
     R2 = create_rotation_matrix(0, alpha, 0)
 
-    R = np.dot(R2, R1.T)
+    R = np.matmul(R2, np.swapaxes(R1, -1, -2))
 
     # Calculating T
-    C1 = np.array([baseline / 2, 0.0, 0.0])  # Center of cam1 coord system
-    C2 = np.array([-baseline / 2, 0.0, 0.0])  # Center of cam2 coord system
+    zeros = np.zeros_like(baseline)
+    C1 = np.stack([baseline / 2, zeros, zeros], axis=-1)  # Center of cam1 coord system
+    C2 = np.stack([-baseline / 2, zeros, zeros], axis=-1)  # Center of cam2 coord system
 
     # Translation vector
     t12_world = C2 - C1
 
-    T = np.dot(R1.T, t12_world)
+    T = np.einsum("...ji,...j->...i", R1, t12_world)
 
     return R, T
 
 
 def calculate_E(R, T):
     # Compute skew-symmetric matrix [T]_x for the translation vector
-    T_x = np.array([[0, -T[2], T[1]], [T[2], 0, -T[0]], [-T[1], T[0], 0]])
+    T_0, T_1, T_2 = T[..., 0], T[..., 1], T[..., 2]
+    zeros = np.zeros_like(T_0)
+    T_x = _stack_matrix([[zeros, -T_2, T_1], [T_2, zeros, -T_0], [-T_1, T_0, zeros]])
 
-    E = np.dot(T_x, R)
+    E = np.matmul(T_x, R)
     return E
 
 
 def calculate_F(E, CM):
-    F = np.dot(np.linalg.inv(CM).T, np.dot(E, np.linalg.inv(CM)))
+    CM_inv = np.linalg.inv(CM)
+    F = np.matmul(np.swapaxes(CM_inv, -1, -2), np.matmul(E, CM_inv))
     return F
 
 
+def calculate_sweep(focal_length_m, img_resolution, pixel_sz_x, pixel_sz_y, baseline, cam2obj):
+    """
+    Calculate calibration matrices and rig metrics for the Cartesian product of the given parameter values.
+
+    Every parameter accepts a scalar or a 1-D array of candidate values. All matrices are built in one vectorized
+    pass and returned stacked along the first axis, one row per rig geometry.
+
+    Returns
+    -------
+    matrices : dict
+        Stacked "CM", "R", "T", "E" and "F" arrays of shape (N, 3, 3) or (N, 3).
+    metrics : pd.DataFrame
+        Rig parameters and derived metrics, one row per rig geometry.
+
+    """
+    grid = np.meshgrid(
+        np.atleast_1d(focal_length_m).astype(float),
+        np.atleast_1d(baseline).astype(float),
+        np.atleast_1d(cam2obj).astype(float),
+        indexing="ij",
+    )
+    focal_length_m, baseline, cam2obj = (values.ravel() for values in grid)
+
+    CM = calculate_CM(focal_length_m, img_resolution, pixel_sz_x, pixel_sz_y)
+    R, T = calculate_RT(baseline, cam2obj)
+    E = calculate_E(R, T)
+    F = calculate_F(E, CM)
+
+    f_x = CM[:, 0, 0]
+    depth = np.sqrt(cam2obj**2 - (baseline / 2) ** 2)  # distance from the baseline to the object
+    metrics = pd.DataFrame(
+        {
+            "focal_length": focal_length_m,
+            "baseline": baseline,
+            "cam2obj": cam2obj,
+            "convergence_angle_deg": np.rad2deg(2 * np.arcsin(baseline / 2 / cam2obj)),
+            "object_depth": depth,
+            "pixel_footprint": cam2obj / f_x,  # size of one pixel projected onto the object plane
+            "depth_resolution_per_px": depth**2 / (f_x * baseline),  # depth change for one pixel of disparity
+        }
+    )
+
+    return {"CM": CM, "R": R, "T": T, "E": E, "F": F}, metrics
+
+
+def parse_values(values):
+    """Parse a single value, a comma separated list or a "start:stop:num" range into a 1-D array."""
+    if ":" in values:
+        start, stop, num = values.split(":")
+        return np.linspace(float(start), float(stop), int(num))
+    return np.array([float(value) for value in values.split(",")])
+
+
+def _single_value(name, values):
+    values = np.atleast_1d(values)
+    if values.size != 1:
+        raise ValueError(f"Several values are given for {name}, use --sweep to evaluate them.")
+    return values.item()
+
+
 def main():
     args = parse_args()
 
     resolution = tuple(map(int, args.resolution.split("x")))
 
-    CM = calculate_CM(args.focal_length, resolution, args.pixel_size[0], args.pixel_size[1])
+    if args.sweep:
+        _, metrics = calculate_sweep(
+            args.focal_length, resolution, args.pixel_size[0], args.pixel_size[1], args.baseline, args.cam2obj
+        )
+        metrics.to_csv(args.sweep_output, index=False)
+        print(f"Metrics of {len(metrics)} rig configurations saved to {args.sweep_output}")
+        return
+
+    focal_length = _single_value("--focal-length", args.focal_length)
+    baseline = _single_value("--baseline", args.baseline)
+    cam2obj = _single_value("--cam2obj", args.cam2obj)
+
+    CM = calculate_CM(focal_length, resolution, args.pixel_size[0], args.pixel_size[1])
     dist = np.zeros(shape=(1, 5), dtype=np.float32)
-    R, T = calculate_RT(args.baseline, args.cam2obj)
+    R, T = calculate_RT(baseline, cam2obj)
     E = calculate_E(R, T)
     F = calculate_F(E, CM)
 
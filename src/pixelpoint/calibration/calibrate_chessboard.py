@@ -5,6 +5,7 @@ import cv2 as cv
 import numpy as np
 from tqdm import trange
 
+from .calibrate_markers import load_marker_coords
 from .calibration_utils import find_and_check_image_resolution
 from .calibration_utils import load_images
 from .calibration_utils import save_calibration_params
@@ -20,6 +21,10 @@ Requirements:
      - for left camera images: prefix 'cam1_' (e.g., 'cam1_image1.jpg').
      - for right camera images: prefix 'cam2_' (e.g., 'cam2_image1.jpg').
 
+3. Corners are detected in every image, unless a file with precomputed corners is given (`--corners_file`, e.g.
+`corners.json` written by `render_chessboard.py`). Its format is the same as of `markers_coords.json`, images without
+corners in the file are skipped.
+
 """
 
 
@@ -43,10 +48,31 @@ def parse_args():
         default=Path("calib_params.json"),
         help="Path to output JSON file (default: calib_params.json)",
     )
+    parser.add_argument(
+        "--corners_file",
+        type=Path,
+        default=None,
+        help="Path to JSON file with precomputed corners, the corner detection is skipped (default: detect corners)",
+    )
     return parser.parse_args()
 
 
-def calibrate_camera_chessboard(imgs, img_resolution, square_size, chessboard_size, CM_guess=None, dist_guess=None):
+def _find_corners(img_key, img, chessboard_size, criteria, corners_coords=None):
+    # Precomputed corners are used as they are, otherwise corners are detected and refined
+    if corners_coords is not None:
+        if img_key not in corners_coords:
+            return None
+        return np.array(corners_coords[img_key], dtype=np.float32).reshape(-1, 1, 2)
+
+    ret, corners = cv.findChessboardCorners(img, chessboard_size, None)
+    if not ret:
+        return None
+    return cv.cornerSubPix(img, corners, (11, 11), (-1, -1), criteria)
+
+
+def calibrate_camera_chessboard(
+    imgs, img_resolution, square_size, chessboard_size, CM_guess=None, dist_guess=None, corners_coords=None
+):
     criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
 
     objp = np.zeros((chessboard_size[0] * chessboard_size[1], 3), np.float32)
@@ -60,11 +86,10 @@ def calibrate_camera_chessboard(imgs, img_resolution, square_size, chessboard_si
         img_key = list(imgs.keys())[i]
         img = imgs[img_key].copy()
 
-        ret, corners = cv.findChessboardCorners(img, chessboard_size, None)
+        corners = _find_corners(img_key, img, chessboard_size, criteria, corners_coords)
 
-        if ret:
+        if corners is not None:
             objpoints.append(objp)
-            corners = cv.cornerSubPix(img, corners, (11, 11), (-1, -1), criteria)
             imgpoints.append(corners)
 
     ret, CM, dist, _, _ = cv.calibrateCamera(objpoints, imgpoints, img_resolution, CM_guess, dist_guess)
@@ -73,7 +98,16 @@ def calibrate_camera_chessboard(imgs, img_resolution, square_size, chessboard_si
 
 
 def stereo_calibrate_chessboard(
-    cam1_imgs, cam2_imgs, img_resolution, square_size, chessboard_size, CM, dist, R_guess=None, T_guess=None
+    cam1_imgs,
+    cam2_imgs,
+    img_resolution,
+    square_size,
+    chessboard_size,
+    CM,
+    dist,
+    R_guess=None,
+    T_guess=None,
+    corners_coords=None,
 ):
     criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 100, 0.0001)
 
@@ -88,17 +122,15 @@ def stereo_calibrate_chessboard(
     for i in trange(len(cam1_imgs), desc="Calculating extrinsic parameters..."):
         img_key = list(cam1_imgs.keys())[i]
         img1 = cam1_imgs[img_key]
-        img2 = cam2_imgs[img_key.replace("cam2", "cam1")]
+        img2_key = img_key.replace("cam2", "cam1")
+        img2 = cam2_imgs[img2_key]
 
-        ret1, corners1 = cv.findChessboardCorners(img1, chessboard_size, None)
-        ret2, corners2 = cv.findChessboardCorners(img2, chessboard_size, None)
+        corners1 = _find_corners(img_key, img1, chessboard_size, criteria, corners_coords)
+        corners2 = _find_corners(img2_key, img2, chessboard_size, criteria, corners_coords)
 
-        if ret1 and ret2:
+        if corners1 is not None and corners2 is not None:
             objpoints.append(objp)
 
-            corners1 = cv.cornerSubPix(img1, corners1, (11, 11), (-1, -1), criteria)
-            corners2 = cv.cornerSubPix(img2, corners2, (11, 11), (-1, -1), criteria)
-
             imgpoints1.append(corners1)
             imgpoints2.append(corners2)
 
@@ -135,10 +167,13 @@ def main():
 
     img_resolution = find_and_check_image_resolution({**cam1_imgs, **cam2_imgs})
     chessboard_size = tuple(map(int, args.chessboard_size.split("x")))
+    corners_coords = load_marker_coords(args.corners_file) if args.corners_file is not None else None
 
-    CM, dist = calibrate_camera_chessboard({**cam1_imgs, **cam2_imgs}, img_resolution, square_size, chessboard_size)
+    CM, dist = calibrate_camera_chessboard(
+        {**cam1_imgs, **cam2_imgs}, img_resolution, square_size, chessboard_size, corners_coords=corners_coords
+    )
     R, T, E, F = stereo_calibrate_chessboard(
-        cam1_imgs, cam2_imgs, img_resolution, square_size, chessboard_size, CM, dist
+        cam1_imgs, cam2_imgs, img_resolution, square_size, chessboard_size, CM, dist, corners_coords=corners_coords
     )
 
     save_calibration_params(CM, dist, R, T, E, F, args.output_file)
@@ -8,6 +8,7 @@ import numpy as np
 from .calibration_utils import find_and_check_image_resolution
 from .calibration_utils import load_images
 from .calibration_utils import save_calibration_params
+from .detect_markers import detect_markers_folder
 
 """
 This module performs stereo camera calibration using images and marker coordinates.
@@ -31,6 +32,9 @@ The JSON file should have the following structure:
 The calibration assumes that all images use the same marker distance.
 Notice, that this is not done for the images in default folder.
 
+5. With `--auto_detect` the marker coordinates are detected on the images automatically (see `detect_markers`)
+instead of being read from `markers_file`. Detection results are cached, so repeated runs take seconds.
+
 """
 
 
@@ -53,6 +57,18 @@ def parse_args():
         "--marker_distance", type=float, default=0.011, help="Distance between marker points in meters (default: 0.011)"
     )
     parser.add_argument("--grid_size", type=str, default="7x7", help='Marker grid size, e.g., "7x7" (default: 7x7)')
+    parser.add_argument(
+        "--auto_detect", action="store_true", help="Detect marker coordinates automatically instead of markers_file"
+    )
+    parser.add_argument(
+        "--markers_cache",
+        type=Path,
+        default=None,
+        help="Path to the cache of detected markers (default: .markers_cache.json in images_folder)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Number of marker detection processes (default: number of CPUs)"
+    )
     parser.add_argument(
         "--output_file",
         type=Path,
@@ -66,7 +82,7 @@ def load_marker_coords(markers_file):
     with markers_file.open("r") as file:
         markers_coords = json.load(file)
     for img_name, coords in markers_coords.items():
-        markers_coords[img_name] = [tuple(map(int, point.split(","))) for point in coords]
+        markers_coords[img_name] = [tuple(map(float, point.split(","))) for point in coords]
     return markers_coords
 
 
@@ -126,10 +142,15 @@ def main():
     if not cam1_imgs or not cam2_imgs:
         raise FileNotFoundError("No images found for one or both cameras.")
 
-    markers_coords = load_marker_coords(args.markers_file)
+    grid_shape = tuple(map(int, args.grid_size.split("x")))
+    if args.auto_detect:
+        markers_coords = detect_markers_folder(
+            args.images_folder, grid_shape, cache_file=args.markers_cache, workers=args.workers
+        )
+    else:
+        markers_coords = load_marker_coords(args.markers_file)
 
     img_resolution = find_and_check_image_resolution({**cam1_imgs, **cam2_imgs})
-    grid_shape = tuple(map(int, args.grid_size.split("x")))
     marker_dist = args.marker_distance
 
     CM, dist = calibrate_camera_markers(
@@ -1,6 +1,7 @@
 import json
 
 import cv2 as cv
+import numpy as np
 
 
 def load_images(images_folder):
@@ -58,3 +59,9 @@ def save_calibration_params(CM, dist, R, T, E, F, output_path):
     }
     with open(output_path, "w") as f:
         json.dump(calibration_data_json, f, indent=4)
+
+
+def load_calibration_params(input_path):
+    with open(input_path) as f:
+        calibration_data_json = json.load(f)
+    return {key: np.array(value, dtype=np.float64) for key, value in calibration_data_json.items()}
@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+
+"""
+This module automatically detects marker point grids on calibration images.
+
+The grid is first located on a downscaled copy of the image with `cv.findCirclesGrid`, then every marker center is
+refined at full resolution inside a small tile around it, so 20MP frames are never processed as a whole.
+Images are processed in a process pool and the results are cached next to the images, keyed by file size and
+modification time, so repeated calibration runs only detect markers on new or changed images.
+
+The detected markers are ordered to match the `grid_size` layout used by `calibrate_markers` and are returned in the
+same structure as `load_marker_coords`:
+     {
+       "image_name": [(x1, y1), (x2, y2), ...],
+       ...
+     }
+
+"""
+
+IMAGE_PATTERNS = ("cam1_*.*", "cam2_*.*")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Automatic detection of marker point grids on calibration images")
+    parser.add_argument(
+        "--images_folder",
+        type=Path,
+        default=Path("notebooks/calibration/calibration_images_markers"),
+        help="Path to the folder with marker images (default: notebooks/calibration/calibration_images_markers)",
+    )
+    parser.add_argument("--grid_size", type=str, default="7x7", help='Marker grid size, e.g., "7x7" (default: 7x7)')
+    parser.add_argument(
+        "--scale", type=float, default=0.25, help="Downscale factor for the coarse grid search (default: 0.25)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--output_file",
+        type=Path,
+        default=Path("markers_coords.json"),
+        help="Path to output JSON file with marker coordinates (default: markers_coords.json)",
+    )
+    return parser.parse_args()
+
+
+def detect_markers(img, grid_shape, scale=0.25):
+    """
+    Detect the marker grid on a grayscale image.
+
+    Parameters
+    ----------
+    img : np.ndarray
+        Grayscale image with dark markers on a light background.
+    grid_shape : tuple[int, int]
+        Marker grid size as (rows, columns), the same as `grid_size` of `calibrate_markers`.
+    scale : float
+        Downscale factor of the image used to locate the grid.
+
+    Returns
+    -------
+    markers : np.ndarray or None
+        Array of shape (rows * columns, 2) with (x, y) marker centers, or None if the grid is not found.
+
+    """
+    rows, columns = grid_shape
+
+    small_img = cv.resize(img, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    found, centers = cv.findCirclesGrid(
+        small_img, (rows, columns), flags=cv.CALIB_CB_SYMMETRIC_GRID, blobDetector=_create_blob_detector()
+    )
+    if not found:
+        return None
+
+    centers = centers.reshape(-1, 2) / scale
+    centers = _refine_centers(img, centers, grid_shape)
+    return _normalize_grid_orientation(centers, grid_shape)
+
+
+def _create_blob_detector():
+    params = cv.SimpleBlobDetector_Params()
+    params.filterByArea = True
+    params.minArea = 4
+    params.maxArea = 1e5
+    params.filterByConvexity = False
+    params.filterByInertia = False
+    return cv.SimpleBlobDetector_create(params)
+
+
+def _refine_centers(img, centers, grid_shape):
+    rows, columns = grid_shape
+    grid = centers.reshape(columns, rows, 2)
+
+    # Half of the smallest distance between neighbouring markers bounds the tile around each of them
+    spacing = min(
+        np.linalg.norm(np.diff(grid, axis=0), axis=-1).min(initial=np.inf),
+        np.linalg.norm(np.diff(grid, axis=1), axis=-1).min(initial=np.inf),
+    )
+    radius = max(int(spacing / 2), 2)
+
+    refined = centers.copy()
+    for i, (x, y) in enumerate(centers):
+        x0, y0 = max(int(x) - radius, 0), max(int(y) - radius, 0)
+        tile = img[y0 : int(y) + radius + 1, x0 : int(x) + radius + 1]
+        if tile.size == 0:
+            continue
+
+        _, mask = cv.threshold(tile, 0, 255, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
+        num_labels, _, _, centroids = cv.connectedComponentsWithStats(mask)
+        if num_labels < 2:
+            continue
+
+        # Take the blob closest to the coarse estimate, label 0 is the background
+        distances = np.linalg.norm(centroids[1:] + (x0, y0) - (x, y), axis=1)
+        refined[i] = centroids[1 + np.argmin(distances)] + (x0, y0)
+
+    return refined
+
+
+def _normalize_grid_orientation(centers, grid_shape):
+    # findCirclesGrid may start the grid from any corner, the camera never mirrors the board, so it is enough to pick
+    # the rotation that starts the grid from the marker closest to the image origin
+    rows, columns = grid_shape
+    grid = centers.reshape(columns, rows, 2)
+
+    rotations = range(4) if rows == columns else (0, 2)
+    candidates = [np.rot90(grid, k) for k in rotations]
+    best = min(candidates, key=lambda candidate: candidate[0, 0].sum())
+    return np.ascontiguousarray(best).reshape(-1, 2)
+
+
+def _detect_markers_file(img_path, grid_shape, scale):
+    img = cv.imread(str(img_path), 0)
+    if img is None:
+        raise ValueError(f"Image data is missing or invalid for: {img_path}")
+    return detect_markers(img, grid_shape, scale)
+
+
+def _file_stamp(img_path):
+    stat = img_path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def detect_markers_folder(images_folder, grid_shape, cache_file=None, workers=None, scale=0.25):
+    """
+    Detect marker grids on all calibration images in the folder using a process pool.
+
+    Results are cached in `cache_file` (default: `.markers_cache.json` inside `images_folder`); only images whose
+    size or modification time changed since the last run are processed again, and the whole cache is discarded when
+    the grid size or the scale differs. Images without a detected grid are reported together in one ValueError after
+    the cache of the other images is saved.
+
+    """
+    cache_file = cache_file or images_folder / ".markers_cache.json"
+    grid_size = f"{grid_shape[0]}x{grid_shape[1]}"
+
+    cache = {}
+    if cache_file.exists():
+        with cache_file.open("r") as file:
+            cache_data = json.load(file)
+        if cache_data.get("grid_size") == grid_size and cache_data.get("scale") == scale:
+            cache = cache_data["images"]
+
+    img_paths = sorted(path for pattern in IMAGE_PATTERNS for path in images_folder.glob(pattern))
+    stamps = {img_path.stem: _file_stamp(img_path) for img_path in img_paths}
+    pending = [img_path for img_path in img_paths if cache.get(img_path.stem, {}).get("stamp") != stamps[img_path.stem]]
+
+    failed = []
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = [executor.submit(_detect_markers_file, img_path, grid_shape, scale) for img_path in pending]
+            for img_path, future in zip(pending, futures):
+                try:
+                    markers = future.result()
+                except ValueError as exc:
+                    failed.append(f"{img_path.name}: {exc}")
+                    continue
+                if markers is None:
+                    failed.append(f"{img_path.name}: marker grid {grid_size} is not found")
+                    continue
+                cache[img_path.stem] = {"stamp": stamps[img_path.stem], "markers": markers.tolist()}
+
+        # Detections of this run are kept even if some images failed, the failed ones are retried on the next run
+        with cache_file.open("w") as file:
+            json.dump({"grid_size": grid_size, "scale": scale, "images": cache}, file, indent=4)
+
+    if failed:
+        raise ValueError(f"Markers are not detected on {len(failed)} images:\n" + "\n".join(failed))
+
+    return {img_name: [tuple(point) for point in cache[img_name]["markers"]] for img_name in sorted(stamps)}
+
+
+def save_marker_coords(markers_coords, output_path):
+    markers_coords_json = {
+        img_name: [f"{x:.2f}, {y:.2f}" for x, y in markers] for img_name, markers in markers_coords.items()
+    }
+    with open(output_path, "w") as f:
+        json.dump(markers_coords_json, f, indent=4)
+
+
+def main():
+    args = parse_args()
+
+    grid_shape = tuple(map(int, args.grid_size.split("x")))
+    markers_coords = detect_markers_folder(args.images_folder, grid_shape, workers=args.workers, scale=args.scale)
+
+    save_marker_coords(markers_coords, args.output_file)
+    print(f"Marker coordinates of {len(markers_coords)} images saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,107 @@
 # render.py
 
 import argparse
+import json
 import subprocess
 import sys
 from pathlib import Path
+from typing import NamedTuple
+from typing import Optional
 
 import bpy
 import numpy as np
 
+# Blender runs this file as a script, so the package is imported from the source tree
+sys.path.insert(0, Path(__file__).resolve().parents[2].as_posix())
+# pylint: disable=wrong-import-position
+from pixelpoint.render import apply_render_settings
+from pixelpoint.render import camera_intrinsics
+from pixelpoint.render import euler_to_matrix
+from pixelpoint.render import pair_rng
+from pixelpoint.render import stereo_calibration_params
+from pixelpoint.render import world_to_camera
+from pixelpoint.render_settings import RenderSettings
+from pixelpoint.render_settings import add_render_settings_arguments
+from pixelpoint.render_settings import render_settings_argv
+from pixelpoint.render_settings import render_settings_from_args
+
+"""
+This module generates a synthetic stereo calibration dataset with a chessboard.
+
+The board is built procedurally once per Blender session and only its pose changes between pairs. Images are saved
+with the names expected by `calibrate-chessboard` (`cam1_<i>.png` for the left and `cam2_<i>.png` for the right
+camera) together with:
+
+- `corners.json`: inner corners of every image projected from the known board pose, in the format of
+  `save_marker_coords`, so `calibrate-chessboard --corners_file` can skip the corner detection;
+- `calib_params.json`: exact calibration of the rendered cameras as `calibrate-chessboard` should estimate it.
+
+"""
+
+
+class ChessboardParams(NamedTuple):
+    chessboard_size: tuple  # number of inner corners (columns, rows)
+    square_size: float  # side of a board square in scene units
+    distance_between_cameras: float = 412.0
+    distance_from_object: float = 639.0  # distance from the center between the cameras to the board
+    focal_length: float = 80.0  # lens focal length in millimeters
+    resolution_x: int = 5120
+    resolution_y: int = 4096
+    render_settings: Optional[RenderSettings] = None  # Blender defaults if None
+
+
+class BoardPoseSampling(NamedTuple):
+    max_tilt: float = 30.0  # maximal board tilt in degrees around every axis
+    max_shift: float = 40.0  # maximal board shift from the center in scene units
+    max_attempts: int = 100  # poses sampled per pair until all corners are visible in both images
+
+
+class ChessboardScene(NamedTuple):
+    board: "bpy.types.Object"
+    camera_right: "bpy.types.Object"
+    camera_left: "bpy.types.Object"
+    corners: np.ndarray  # inner corners in board coordinates of shape (N, 3), in the order of findChessboardCorners
+    CM: np.ndarray  # camera matrix of both cameras at the rendered resolution
+
 
 # pylint: disable=too-many-locals
-def render_paired_images(
-    object_path: Path,
-    output_dir: Path,
-    object_scale: float,
-    distance_between_cameras: float = 412.0,  # Updated distance between cameras
-    distance_from_object: float = 639.0,  # Updated distance from center to the object
-    focal_length: float = 80.0,  # Updated focal length of the camera
-    resolution_x: int = 5120,  # Updated picture resolution width
-    resolution_y: int = 4096,  # Updated picture resolution height
-):
+def setup_chessboard_scene(
+    chessboard_size: tuple,
+    square_size: float,
+    distance_between_cameras: float = 412.0,
+    distance_from_object: float = 639.0,
+    focal_length: float = 80.0,
+    resolution_x: int = 5120,
+    resolution_y: int = 4096,
+    render_settings: Optional[RenderSettings] = None,
+) -> ChessboardScene:
     """
-    Render object and save paired images.
+    Build the scene with a procedural chessboard, two cameras and lights once for all rendered poses.
 
     Parameters
     ----------
-    object_path : str
-        Path to .stl file for rendering.
-    output_dir : str
-        Path to save directory for rendered images.
-    object_scale : float
-        Scale object size.
+    chessboard_size : tuple[int, int]
+        Number of inner corners (columns, rows), the same as `--chessboard_size` of `calibrate-chessboard`.
+    square_size : float
+        Side of a board square in scene units.
     distance_between_cameras : float
         Distance between cameras to create paired images.
     distance_from_object : float
-        Distance from the center between the cameras to the object.
+        Distance from the center between the cameras to the board.
     focal_length: float
         Lens focal length in millimeters.
     resolution_x: int
         Width of the picture resolution.
     resolution_y: int
         Height of the picture resolution.
+    render_settings: RenderSettings
+        Engine, samples and output settings, e.g. from `RENDER_PRESETS`. Blender defaults are used if None.
 
     """
-    _setup_object(object_path=object_path, object_scale=object_scale)
+    # Clear existing scene
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+
+    board, corners = _create_chessboard(chessboard_size, square_size)
 
     camera1_object, camera2_object = _setup_cameras_position(
         distance_from_object=distance_from_object,
@@ -57,52 +115,123 @@ def render_paired_images(
     bpy.context.scene.render.resolution_x = resolution_x
     bpy.context.scene.render.resolution_y = resolution_y
     bpy.context.scene.render.resolution_percentage = 100
+    apply_render_settings(render_settings)
+    bpy.context.view_layer.update()
+
+    render = bpy.context.scene.render
+    CM = camera_intrinsics(
+        focal_length=camera2_object.data.lens,
+        sensor_width=camera2_object.data.sensor_width,
+        sensor_height=camera2_object.data.sensor_height,
+        resolution_x=render.resolution_x * render.resolution_percentage // 100,
+        resolution_y=render.resolution_y * render.resolution_percentage // 100,
+        sensor_fit=camera2_object.data.sensor_fit,
+    )
+    return ChessboardScene(board=board, camera_right=camera1_object, camera_left=camera2_object, corners=corners, CM=CM)
+
+
+def project_board_corners(scene: ChessboardScene, rotation: np.ndarray, location: np.ndarray):
+    """
+    Project the inner corners of the board in the given pose to the left and the right image.
+
+    Returns
+    -------
+    corners_left, corners_right : np.ndarray
+        Corners of shape (N, 2) in pixels, None if a corner is outside the image or the board faces away from the
+        camera.
+
+    """
+    rotation_matrix = euler_to_matrix(rotation)
+    world_corners = scene.corners @ rotation_matrix.T + location
+    board_normal = rotation_matrix[:, 2]
+    width, height = (scene.CM[:2, 2] + 0.5) * 2
+
+    projected = []
+    for camera_object in (scene.camera_left, scene.camera_right):
+        camera_location = np.array(camera_object.matrix_world)[:3, 3]
+        camera_rotation, camera_translation = world_to_camera(camera_object.matrix_world)
+        camera_corners = world_corners @ camera_rotation.T + camera_translation
+        image_corners = camera_corners @ scene.CM.T
+        image_corners = image_corners[:, :2] / image_corners[:, 2:]
+
+        facing = np.dot(board_normal, camera_location - location) > 0
+        inside = (
+            (camera_corners[:, 2] > 0).all()
+            and (image_corners >= 0).all()
+            and (image_corners[:, 0] <= width - 1).all()
+            and (image_corners[:, 1] <= height - 1).all()
+        )
+        projected.append(image_corners if facing and inside else None)
+    return tuple(projected)
 
-    # Render images and save
-    image_sides = ["right", "left"]
-    for side, camera_object in zip(image_sides, [camera1_object, camera2_object]):
+
+def random_board_pose(rng: np.random.Generator, max_tilt: float, max_shift: float):
+    """Random board rotation in degrees and location, the board faces the cameras with a tilt up to `max_tilt`."""
+    rotation = np.array([0, 90, 0]) + rng.uniform(-max_tilt, max_tilt, 3)
+    location = np.array([0, 1, 1]) * rng.uniform(-max_shift, max_shift, 3)
+    return rotation, location
+
+
+def render_chessboard_pair(scene: ChessboardScene, output_dir: Path, index: int, rotation, location):
+    """Move the board to the given pose and render the left and the right image of pair `index`."""
+    scene.board.rotation_euler = np.deg2rad(rotation).tolist()
+    scene.board.location = np.asarray(location).tolist()
+
+    for camera_prefix, camera_object in (("cam1", scene.camera_left), ("cam2", scene.camera_right)):
         bpy.context.scene.camera = camera_object
-        bpy.context.scene.render.filepath = (output_dir / f"image_{side}.png").as_posix()
+        bpy.context.scene.render.filepath = (output_dir / f"{camera_prefix}_{index}.png").as_posix()
         bpy.ops.render.render(write_still=True)
 
 
-def _setup_object(object_path: Path, object_scale: float):
-    # Clear existing scene
-    bpy.ops.wm.read_factory_settings(use_empty=True)
-
-    # Import the STL file
-    if object_path.suffix == ".obj":
-        bpy.ops.import_scene.obj(filepath=object_path.as_posix())
-    elif object_path.suffix == ".stl":
-        bpy.ops.import_mesh.stl(filepath=object_path.as_posix())
-    else:
-        raise NotImplementedError(f"Object format {object_path.suffix} is not supported.")
-
-    # Center the object and adjust scale
-    obj = bpy.context.selected_objects[0]  # Assuming only one object is imported
-    bpy.ops.object.origin_set(type="ORIGIN_GEOMETRY", center="BOUNDS")
-
-    # Rotate Chessboard by random angles
-    random_rotation = np.random.randint(0, 30, 3)
-    rotation = np.array([0, 0, -90]) + random_rotation
-    obj.rotation_euler = np.deg2rad(rotation).tolist()
-    obj.location = (0, 0, 0)
-    obj.scale = (np.array([1, 1, 1]) * object_scale).tolist()
-
-    # Apply a basic material to ensure the object is visible
-    mat = bpy.data.materials.new(name="Material")
-    mat.use_nodes = True
-    principled_bsdf = mat.node_tree.nodes.get("Principled BSDF")
-
-    tex_node = mat.node_tree.nodes.new("ShaderNodeTexImage")
-    tex_node.image = bpy.data.images.load("Chess_Board.jpg")
-    mat.node_tree.links.new(principled_bsdf.inputs["Base Color"], tex_node.outputs["Color"])
-
-    # Assign the material to the object
-    if len(obj.data.materials):
-        obj.data.materials[0] = mat
-    else:
-        obj.data.materials.append(mat)
+def _create_chessboard(chessboard_size: tuple, square_size: float, border: int = 1):
+    # A plane of squares in the XY plane with a white border, colors are assigned per face with two materials
+    columns, rows = chessboard_size
+    squares_x, squares_y = columns + 1 + 2 * border, rows + 1 + 2 * border
+
+    vertex_x, vertex_y = np.meshgrid(np.arange(squares_x + 1), np.arange(squares_y + 1), indexing="ij")
+    vertices = np.stack(
+        [(vertex_x - squares_x / 2) * square_size, (vertex_y - squares_y / 2) * square_size, np.zeros(vertex_x.shape)],
+        axis=-1,
+    ).reshape(-1, 3)
+
+    def vertex_index(a, b):
+        return a * (squares_y + 1) + b
+
+    faces, material_indices = [], []
+    for a in range(squares_x):
+        for b in range(squares_y):
+            faces.append(
+                [vertex_index(a, b), vertex_index(a + 1, b), vertex_index(a + 1, b + 1), vertex_index(a, b + 1)]
+            )
+            on_border = a < border or b < border or a >= squares_x - border or b >= squares_y - border
+            material_indices.append(0 if on_border else (a + b) % 2)
+
+    mesh = bpy.data.meshes.new("Chessboard")
+    mesh.from_pydata(vertices.tolist(), [], faces)
+    mesh.update()
+    for name, color in (("White", (0.9, 0.9, 0.9, 1)), ("Black", (0.02, 0.02, 0.02, 1))):
+        mat = bpy.data.materials.new(name=name)
+        mat.use_nodes = True
+        principled_bsdf = mat.node_tree.nodes.get("Principled BSDF")
+        principled_bsdf.inputs["Base Color"].default_value = color
+        principled_bsdf.inputs["Roughness"].default_value = 1.0
+        mesh.materials.append(mat)
+    mesh.polygons.foreach_set("material_index", material_indices)
+
+    board = bpy.data.objects.new("Chessboard", mesh)
+    bpy.context.scene.collection.objects.link(board)
+
+    # Inner corners row by row, the first column varies fastest as in findChessboardCorners
+    corner_x, corner_y = np.meshgrid(np.arange(columns), np.arange(rows))
+    corners = np.stack(
+        [
+            (corner_x.ravel() - (columns - 1) / 2) * square_size,
+            (corner_y.ravel() - (rows - 1) / 2) * square_size,
+            np.zeros(columns * rows),
+        ],
+        axis=-1,
+    )
+    return board, corners
 
 
 def _setup_cameras_position(distance_from_object: float, distance_between_cameras: float, focal_length: float):
@@ -155,82 +284,135 @@ def _setup_light():
 
 
 def blender_render(
-    object_path: str,
+    chessboard_params: ChessboardParams,
     output_dir: str,
-    object_scale: float,
-    distance_between_cameras: float,
-    distance_from_object: float,
-    focal_length: float,
-    resolution_x: int,
-    resolution_y: int,
     num_pairs: int,
+    seed: int = 42,
+    pose_sampling: BoardPoseSampling = BoardPoseSampling(),
 ):
-    np.random.seed(42)
-    Path(output_dir).mkdir(exist_ok=True, parents=True)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
+
+    scene = setup_chessboard_scene(**chessboard_params._asdict())
 
+    corners_coords = {}
+    max_attempts = pose_sampling.max_attempts
     for i in range(num_pairs):
-        render_paired_images(
-            object_path=Path(object_path),
-            output_dir=Path(output_dir) / f"pair_{i}",
-            object_scale=object_scale,
-            distance_between_cameras=distance_between_cameras,
-            distance_from_object=distance_from_object,
-            focal_length=focal_length,
-            resolution_x=resolution_x,
-            resolution_y=resolution_y,
-        )
+        # Poses are resampled until all corners are visible in both images
+        rng = pair_rng(seed, i)
+        for _ in range(max_attempts):
+            rotation, location = random_board_pose(
+                rng, max_tilt=pose_sampling.max_tilt, max_shift=pose_sampling.max_shift
+            )
+            corners_left, corners_right = project_board_corners(scene, rotation, location)
+            if corners_left is not None and corners_right is not None:
+                break
+        else:
+            raise ValueError(
+                f"No board pose with all corners visible in {max_attempts} attempts, reduce the tilt/shift"
+            )
+
+        render_chessboard_pair(scene, output_dir, i, rotation, location)
+        corners_coords[f"cam1_{i}"] = corners_left
+        corners_coords[f"cam2_{i}"] = corners_right
+
+    with open(output_dir / "corners.json", "w") as f:
+        corners_json = {
+            img_name: [f"{x:.4f}, {y:.4f}" for x, y in corners] for img_name, corners in corners_coords.items()
+        }
+        json.dump(corners_json, f, indent=4)
+
+    # calibrate-chessboard uses the cam2_ images as the first camera of the stereo calibration
+    params = stereo_calibration_params(
+        scene.CM, world_to_camera(scene.camera_right.matrix_world), world_to_camera(scene.camera_left.matrix_world)
+    )
+    with open(output_dir / "calib_params.json", "w") as f:
+        json.dump({key: value.tolist() for key, value in params.items()}, f, indent=4)
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Render paired images using Blender.")
-    parser.add_argument("--blender-path", type=str, required=True, help="Path to the Blender program.")
-    parser.add_argument("--object-path", type=str, required=True, help="Path to the .stl file.")
+def add_chessboard_arguments(parser: argparse.ArgumentParser):
     parser.add_argument("--output-dir", type=str, required=True, help="Directory to save the rendered images.")
-    parser.add_argument("--object-scale", type=float, default=5.0, help="Scale object in size.")
+    parser.add_argument(
+        "--chessboard-size", type=str, default="7x7", help='Number of inner corners, e.g. "7x7" (default: 7x7).'
+    )
+    parser.add_argument("--square-size", type=float, default=20.0, help="Side of a board square in scene units.")
     parser.add_argument("--distance-between-cameras", type=float, default=412.0, help="Distance between the cameras.")
     parser.add_argument(
         "--distance-from-object",
         type=float,
         default=639.0,
-        help="Distance from the center between the cameras to the object.",
+        help="Distance from the center between the cameras to the board.",
     )
     parser.add_argument("--focal-length", type=float, default=80.0, help="Lens focal length in millimeters.")
     parser.add_argument("--resolution-x", type=int, default=5120, help="Width of the picture resolution.")
     parser.add_argument("--resolution-y", type=int, default=4096, help="Height of the picture resolution.")
     parser.add_argument("--num-pairs", type=int, default=10, help="Number of image pairs to render.")
+    parser.add_argument("--seed", type=int, default=42, help="Global seed, every pair derives its own seed from it.")
+    parser.add_argument("--max-tilt", type=float, default=30.0, help="Maximal board tilt in degrees around every axis.")
+    parser.add_argument(
+        "--max-shift", type=float, default=40.0, help="Maximal board shift from the center in scene units."
+    )
+
+
+def _chessboard_argv(args: argparse.Namespace):
+    argv = []
+    for option in (
+        "output_dir",
+        "chessboard_size",
+        "square_size",
+        "distance_between_cameras",
+        "distance_from_object",
+        "focal_length",
+        "resolution_x",
+        "resolution_y",
+        "num_pairs",
+        "seed",
+        "max_tilt",
+        "max_shift",
+    ):
+        argv.extend(["--" + option.replace("_", "-"), str(getattr(args, option))])
+    return argv
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a synthetic stereo calibration dataset with a chessboard.")
+    parser.add_argument("--blender-path", type=str, required=True, help="Path to the Blender program.")
+    add_chessboard_arguments(parser)
+    add_render_settings_arguments(parser)
     args = parser.parse_args()
 
-    # Call Blender with the specified script and arguments
+    # Call Blender with the specified script and arguments, all poses are rendered in one Blender session
     blender_command = [
         args.blender_path,
         "--background",
         "--python",
-        (Path(__file__).parent / "render.py").as_posix(),
+        Path(__file__).as_posix(),
         "--",
-        args.object_path,
-        args.output_dir,
-        str(args.object_scale),
-        str(args.distance_between_cameras),
-        str(args.distance_from_object),
-        str(args.focal_length),
-        str(args.resolution_x),
-        str(args.resolution_y),
-        str(args.num_pairs),
+        *_chessboard_argv(args),
+        *render_settings_argv(render_settings_from_args(args)),
     ]
     subprocess.run(blender_command, check=True)
 
 
 if __name__ == "__main__":
-    argv = sys.argv[sys.argv.index("--") + 1 :]
+    blender_parser = argparse.ArgumentParser(description="Render a chessboard calibration dataset inside Blender.")
+    add_chessboard_arguments(blender_parser)
+    add_render_settings_arguments(blender_parser)
+    blender_args = blender_parser.parse_args(sys.argv[sys.argv.index("--") + 1 :])
 
     blender_render(
-        object_path=argv[0],
-        output_dir=argv[1],
-        object_scale=float(argv[2]),
-        distance_between_cameras=float(argv[3]),
-        distance_from_object=float(argv[4]),
-        focal_length=float(argv[5]),
-        resolution_x=int(argv[6]),
-        resolution_y=int(argv[7]),
-        num_pairs=int(argv[8]),
+        ChessboardParams(
+            chessboard_size=tuple(map(int, blender_args.chessboard_size.split("x"))),
+            square_size=blender_args.square_size,
+            distance_between_cameras=blender_args.distance_between_cameras,
+            distance_from_object=blender_args.distance_from_object,
+            focal_length=blender_args.focal_length,
+            resolution_x=blender_args.resolution_x,
+            resolution_y=blender_args.resolution_y,
+            render_settings=render_settings_from_args(blender_args),
+        ),
+        output_dir=blender_args.output_dir,
+        num_pairs=blender_args.num_pairs,
+        seed=blender_args.seed,
+        pose_sampling=BoardPoseSampling(max_tilt=blender_args.max_tilt, max_shift=blender_args.max_shift),
     )
@@ -0,0 +1,104 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+def sampson_errors(F: np.ndarray, points1: np.ndarray, points2: np.ndarray) -> np.ndarray:
+    """
+    Calculate the Sampson approximation of the reprojection error for point correspondences.
+
+    Parameters
+    ----------
+    F : np.ndarray
+        Fundamental matrix of shape (3, 3) such that x2^T F x1 = 0.
+    points1 : np.ndarray
+        Points of the first image of shape (N, 2).
+    points2 : np.ndarray
+        Corresponding points of the second image of shape (N, 2).
+
+    Returns
+    -------
+    errors : np.ndarray
+        Error of every correspondence in pixels, shape (N,).
+
+    """
+    points1 = np.asarray(points1, dtype=np.float64).reshape(-1, 2)
+    points2 = np.asarray(points2, dtype=np.float64).reshape(-1, 2)
+    ones = np.ones((len(points1), 1))
+    x1 = np.hstack([points1, ones])
+    x2 = np.hstack([points2, ones])
+
+    Fx1 = x1 @ F.T
+    Ftx2 = x2 @ F
+    residuals = np.sum(x2 * Fx1, axis=1)
+    denominator = Fx1[:, 0] ** 2 + Fx1[:, 1] ** 2 + Ftx2[:, 0] ** 2 + Ftx2[:, 1] ** 2
+
+    return np.sqrt(residuals**2 / np.maximum(denominator, np.finfo(np.float64).tiny))
+
+
+class EpipolarDriftMonitor:
+    """
+    Track the epipolar error of matched points against the active calibration.
+
+    Every processed pair contributes the median Sampson error of its correspondences to a rolling window. When the
+    median over the window exceeds `threshold` pixels, the calibration is considered drifted.
+
+    Parameters
+    ----------
+    F : np.ndarray
+        Fundamental matrix of the active calibration, x2^T F x1 = 0 for the left (1) and right (2) images.
+    window_size : int
+        Number of the latest pairs kept in the rolling window.
+    threshold : float
+        Median epipolar error in pixels above which recalibration is needed.
+    min_pairs : int
+        Minimal number of pairs in the window before recalibration can be requested.
+
+    """
+
+    def __init__(self, F: np.ndarray, window_size: int = 50, threshold: float = 2.0, min_pairs: int = 10):
+        self.F = np.asarray(F, dtype=np.float64)
+        self.threshold = threshold
+        self.min_pairs = min_pairs
+        self._pair_errors = deque(maxlen=window_size)
+        self._num_pairs = 0
+        self._lock = threading.Lock()
+
+    def update(self, points_left: np.ndarray, points_right: np.ndarray) -> float:
+        """Add correspondences of one pair to the window and return their median error in pixels."""
+        errors = sampson_errors(self.F, points_left, points_right)
+        if errors.size == 0:
+            return float("nan")
+
+        pair_error = float(np.median(errors))
+        with self._lock:
+            self._pair_errors.append(pair_error)
+            self._num_pairs += 1
+        return pair_error
+
+    @property
+    def needs_recalibration(self) -> bool:
+        with self._lock:
+            if len(self._pair_errors) < self.min_pairs:
+                return False
+            return float(np.median(self._pair_errors)) > self.threshold
+
+    def metrics(self) -> dict:
+        with self._lock:
+            window = np.array(self._pair_errors)
+            num_pairs = self._num_pairs
+
+        if window.size == 0:
+            return {"pairs_total": num_pairs, "window_pairs": 0, "needs_recalibration": False}
+
+        return {
+            "pairs_total": num_pairs,
+            "window_pairs": int(window.size),
+            "median_error_px": float(np.median(window)),
+            "mean_error_px": float(window.mean()),
+            "p90_error_px": float(np.percentile(window, 90)),
+            "last_error_px": float(window[-1]),
+            "threshold_px": self.threshold,
+            "needs_recalibration": self.needs_recalibration,
+        }
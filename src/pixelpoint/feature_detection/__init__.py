@@ -1,6 +1,36 @@
+import importlib
+
 from .orb_sift_detectors import orb_sift_draw_keypoints
 from .orb_sift_detectors import orb_sift_extract_keypoints_and_descriptors
-from .superpoint_detector import load_images
-from .superpoint_detector import process_images
-from .superpoint_detector import superpoint_detect_keypoints
-from .superpoint_detector import superpoint_visualize_keypoints
+
+# Modules of these names import torch and transformers, so they are imported on the first access: the OpenCV
+# detectors, e.g. in the isolated processes of feature-benchmark, don't pay for torch and don't need it installed
+_LAZY_NAMES = {
+    "match_descriptors": "descriptor_matching",
+    "superpoint_find_homography": "descriptor_matching",
+    "SuperPointBatcher": "superpoint_batching",
+    "SuperPointDense": "superpoint_detector",
+    "SuperPointEngine": "superpoint_detector",
+    "get_superpoint_engine": "superpoint_detector",
+    "load_images": "superpoint_detector",
+    "process_images": "superpoint_detector",
+    "superpoint_detect_keypoints": "superpoint_detector",
+    "superpoint_detect_keypoints_dense": "superpoint_detector",
+    "superpoint_visualize_keypoints": "superpoint_detector",
+    "export_superpoint": "superpoint_export",
+    "superpoint_detect_keypoints_tiled": "superpoint_tiling",
+}
+
+__all__ = ["orb_sift_draw_keypoints", "orb_sift_extract_keypoints_and_descriptors", *_LAZY_NAMES]
+
+
+def __getattr__(name):
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_LAZY_NAMES[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
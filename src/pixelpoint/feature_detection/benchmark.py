@@ -0,0 +1,284 @@
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+
+"""
+This module compares the cost and the quality of the feature detectors on the same image pairs.
+
+Pairs:
+
+1. `sample`: the sample stereo images from `notebooks/feature_detection/data`, resized to every resolution. The true
+homography is unknown, so the homography error is not reported for them.
+
+2. `synthetic`: a procedurally generated texture and its copy warped with a random homography, so the estimated
+homography can be compared with the true one.
+
+Every detector and pair is measured in a separate process, so the reported peak RSS belongs to that case only.
+
+"""
+
+DETECTORS = ("ORB", "SIFT", "AKAZE", "SuperPoint")
+PAIRS = ("sample", "synthetic")
+SAMPLE_IMAGES = (
+    Path("notebooks/feature_detection/data/cam2_1.jpg"),
+    Path("notebooks/feature_detection/data/cam1_1.jpg"),
+)
+
+
+def make_synthetic_pair(resolution, seed=0, max_shift=0.1):
+    """
+    Generate a textured grayscale image and its copy warped with a random homography.
+
+    Parameters
+    ----------
+    resolution : tuple[int, int]
+        Image size as (width, height).
+    seed : int
+        Seed of the random generator.
+    max_shift : float
+        Maximal shift of the image corners by the homography as a fraction of the image size.
+
+    Returns
+    -------
+    image_1, image_2 : np.ndarray
+        Grayscale images of shape (height, width).
+    homography_matrix : np.ndarray
+        True homography of shape (3, 3) mapping points of `image_1` to `image_2`.
+
+    """
+    width, height = resolution
+    rng = np.random.default_rng(seed)
+
+    # Blurred noise of several scales gives corners and blobs for all detectors
+    image = np.zeros((height, width), dtype=np.float32)
+    for cell in (4, 16, 64):
+        noise = rng.random((max(height // cell, 2), max(width // cell, 2)), dtype=np.float32)
+        image += cv.resize(noise, (width, height), interpolation=cv.INTER_CUBIC)
+    image = cv.normalize(image, None, 0, 255, cv.NORM_MINMAX).astype(np.uint8)
+
+    for _ in range(max(width * height // 20000, 10)):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        color = int(rng.integers(256))
+        if rng.random() < 0.5:
+            radius = int(rng.integers(3, max(min(width, height) // 30, 4)))
+            cv.circle(image, center, radius, color, thickness=-1)
+        else:
+            size = rng.integers(3, max(min(width, height) // 20, 4), size=2)
+            cv.rectangle(image, center, (center[0] + int(size[0]), center[1] + int(size[1])), color, thickness=-1)
+
+    corners = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float32)
+    shifted_corners = corners + rng.uniform(-max_shift, max_shift, size=(4, 2)) * (width, height)
+    homography_matrix = cv.getPerspectiveTransform(corners, shifted_corners.astype(np.float32))
+    warped_image = cv.warpPerspective(image, homography_matrix, (width, height), borderMode=cv.BORDER_REFLECT)
+
+    return image, warped_image, homography_matrix
+
+
+def homography_error(estimated_homography, true_homography, resolution):
+    """Mean distance in pixels between the image corners mapped by the estimated and the true homography."""
+    width, height = resolution
+    corners = np.array([[[0, 0], [width, 0], [width, height], [0, height]]], dtype=np.float64)
+    estimated_corners = cv.perspectiveTransform(corners, estimated_homography)
+    true_corners = cv.perspectiveTransform(corners, true_homography)
+    return float(np.linalg.norm(estimated_corners - true_corners, axis=-1).mean())
+
+
+def _create_detector(detector_name, model):
+    # pylint: disable=import-outside-toplevel
+    if detector_name == "ORB":
+        return cv.ORB_create(nfeatures=1000, nlevels=16)
+    if detector_name == "SIFT":
+        return cv.SIFT_create()
+    if detector_name == "AKAZE":
+        return cv.AKAZE_create()
+    if detector_name == "SuperPoint":
+        from .superpoint_detector import DEFAULT_SUPERPOINT_MODEL
+        from .superpoint_detector import get_superpoint_engine
+
+        return get_superpoint_engine(model or DEFAULT_SUPERPOINT_MODEL)
+    raise ValueError(f"Unsupported detector type: {detector_name}. Use one of {DETECTORS}.")
+
+
+def _detect(detector_name, detector, image):
+    if detector_name != "SuperPoint":
+        keypoints, descriptors = detector.detectAndCompute(image, None)
+        points = np.array([keypoint.pt for keypoint in keypoints], dtype=np.float32).reshape(-1, 2)
+        return points, descriptors
+
+    result = detector.detect([cv.cvtColor(image, cv.COLOR_GRAY2RGB)])[0]
+    # The processor resizes images, keypoints are scaled back to the original resolution
+    _, processed_height, processed_width = result["input_image"].shape
+    scale = (image.shape[1] / processed_width, image.shape[0] / processed_height)
+    return result["keypoints"].numpy().astype(np.float32) * scale, result["descriptors"].numpy()
+
+
+def _match(detector_name, descriptors_1, descriptors_2, ratio_threshold=0.75):
+    # pylint: disable=import-outside-toplevel
+    if descriptors_1 is None or descriptors_2 is None:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if detector_name == "SuperPoint":
+        from .descriptor_matching import match_descriptors
+
+        return match_descriptors(descriptors_1, descriptors_2, ratio_threshold=ratio_threshold)
+
+    # OpenCV descriptors are matched by brute force with the same ratio test and mutual check
+    matcher = cv.BFMatcher(cv.NORM_L2 if detector_name == "SIFT" else cv.NORM_HAMMING)
+    nearest_1 = [pair for pair in matcher.knnMatch(descriptors_1, descriptors_2, k=2) if len(pair) == 2]
+    nearest_2 = {match.queryIdx: match.trainIdx for match in matcher.match(descriptors_2, descriptors_1)}
+    good_matches = [
+        m for m, n in nearest_1 if m.distance < ratio_threshold * n.distance and nearest_2.get(m.trainIdx) == m.queryIdx
+    ]
+    indices_1 = np.array([match.queryIdx for match in good_matches], dtype=np.int64)
+    indices_2 = np.array([match.trainIdx for match in good_matches], dtype=np.int64)
+    return indices_1, indices_2
+
+
+def run_case(detector_name, image_1, image_2, true_homography=None, repeats=3, model=None):
+    """
+    Detect and match features on one image pair and measure the cost and the quality.
+
+    Returns
+    -------
+    report : dict
+        Detection wall time per pair (median over `repeats`), keypoints per second, number of keypoints and matches,
+        RANSAC inlier ratio, homography error in pixels (if `true_homography` is given) and peak RSS of the process.
+
+    """
+    detector = _create_detector(detector_name, model)
+    # Warm up, so lazy initialization is not measured
+    _detect(detector_name, detector, image_1)
+
+    wall_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        points_1, descriptors_1 = _detect(detector_name, detector, image_1)
+        points_2, descriptors_2 = _detect(detector_name, detector, image_2)
+        wall_times.append(time.perf_counter() - start)
+    wall_time = float(np.median(wall_times))
+
+    indices_1, indices_2 = _match(detector_name, descriptors_1, descriptors_2)
+    report = {
+        "wall_time_s": wall_time,
+        "keypoints": len(points_1) + len(points_2),
+        "keypoints_per_s": (len(points_1) + len(points_2)) / wall_time,
+        "matches": len(indices_1),
+        "inlier_ratio": 0.0,
+        "homography_error_px": None,
+    }
+
+    if len(indices_1) >= 4:
+        homography_matrix, inliers_mask = cv.findHomography(points_1[indices_1], points_2[indices_2], cv.RANSAC, 5.0)
+        if homography_matrix is not None:
+            report["inlier_ratio"] = float(inliers_mask.mean())
+            if true_homography is not None:
+                height, width = image_1.shape[:2]
+                report["homography_error_px"] = homography_error(homography_matrix, true_homography, (width, height))
+
+    # ru_maxrss is in kilobytes on Linux
+    report["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return report
+
+
+def _run_isolated(*args, **kwargs):
+    # A fresh spawned process per case, so peak RSS is not inherited from previous cases or the parent
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, *args, **kwargs).result()
+
+
+def _load_sample_pair(image_paths, resolution):
+    images = []
+    for image_path in image_paths:
+        image = cv.imread(str(image_path), cv.IMREAD_GRAYSCALE)
+        if image is None:
+            raise FileNotFoundError(f"Image {image_path} is invalid or cannot be read.")
+        images.append(cv.resize(image, resolution, interpolation=cv.INTER_AREA))
+    return images
+
+
+def run_benchmark(
+    detectors, resolutions, pair_names=PAIRS, image_paths=SAMPLE_IMAGES, seed=0, repeats=3, model=None
+):  # pylint: disable=too-many-arguments
+    """Run every detector on the sample and the synthetic pair at every resolution and return the list of reports."""
+    reports = []
+    for width, height in resolutions:
+        pairs = {}
+        if "sample" in pair_names:
+            pairs["sample"] = (*_load_sample_pair(image_paths, (width, height)), None)
+        if "synthetic" in pair_names:
+            pairs["synthetic"] = make_synthetic_pair((width, height), seed=seed)
+
+        for pair_name, (pair_image_1, pair_image_2, pair_homography) in pairs.items():
+            for detector_name in detectors:
+                report = _run_isolated(
+                    detector_name, pair_image_1, pair_image_2, pair_homography, repeats=repeats, model=model
+                )
+                report = {"detector": detector_name, "pair": pair_name, "resolution": f"{width}x{height}", **report}
+                reports.append(report)
+                homography_error_px = report["homography_error_px"]
+                print(
+                    f"{detector_name:>10} {pair_name:>9} {width}x{height}: {report['wall_time_s'] * 1000:.1f} ms, "
+                    f"{report['keypoints_per_s']:.0f} kps/s, inliers {report['inlier_ratio']:.2f}, "
+                    f"H error {'-' if homography_error_px is None else f'{homography_error_px:.2f} px'}, "
+                    f"peak RSS {report['peak_rss_mb']:.0f} MB"
+                )
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ORB, SIFT, AKAZE and SuperPoint feature detectors")
+    parser.add_argument(
+        "--detectors", type=str, nargs="+", default=list(DETECTORS), choices=DETECTORS, help="Detectors to compare."
+    )
+    parser.add_argument(
+        "--resolutions",
+        type=str,
+        nargs="+",
+        default=["640x480", "1280x960", "2560x1920"],
+        help="Image resolutions as WIDTHxHEIGHT. Default is 640x480 1280x960 2560x1920.",
+    )
+    parser.add_argument(
+        "--pairs", type=str, nargs="+", default=list(PAIRS), choices=PAIRS, help="Image pairs to run the detectors on."
+    )
+    parser.add_argument(
+        "--images",
+        type=Path,
+        nargs=2,
+        default=list(SAMPLE_IMAGES),
+        help="Sample image pair. Default are the images in 'notebooks/feature_detection/data'.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic pair.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed repeats per case.")
+    parser.add_argument("--model", type=str, default=None, help="SuperPoint model id or local directory.")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("feature_detection_benchmark.json"),
+        help="Path to the JSON report. Default is 'feature_detection_benchmark.json'.",
+    )
+    args = parser.parse_args()
+
+    resolutions = [tuple(map(int, resolution.split("x"))) for resolution in args.resolutions]
+    reports = run_benchmark(
+        args.detectors,
+        resolutions,
+        pair_names=args.pairs,
+        image_paths=args.images,
+        seed=args.seed,
+        repeats=args.repeats,
+        model=args.model,
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(reports, f, indent=4)
+    print(f"Benchmark report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
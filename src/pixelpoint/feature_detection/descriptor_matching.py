@@ -0,0 +1,109 @@
+import cv2 as cv
+import numpy as np
+import torch
+
+
+def match_descriptors(descriptors_1, descriptors_2, chunk_size=1024, ratio_threshold=0.75, mutual=True):
+    """
+    Match descriptors by the nearest neighbour in euclidean distance with a ratio test and a mutual check.
+
+    Distances are computed with matrix products in chunks of `chunk_size` descriptors of the first set, so the peak
+    memory is `chunk_size * len(descriptors_2)` floats regardless of the size of the first set. The nearest neighbours
+    of the second set are accumulated over the chunks for the mutual check.
+
+    Parameters
+    ----------
+    descriptors_1 : torch.Tensor or np.ndarray
+        Descriptors of the first image of shape (N, D).
+    descriptors_2 : torch.Tensor or np.ndarray
+        Descriptors of the second image of shape (M, D).
+    chunk_size : int
+        Number of descriptors of the first set processed in one matrix product.
+    ratio_threshold : float
+        Maximal ratio of the distances to the nearest and the second nearest neighbour, 1.0 disables the test.
+    mutual : bool
+        Whether to keep only matches that are nearest neighbours of each other.
+
+    Returns
+    -------
+    indices_1, indices_2 : np.ndarray
+        Indices of the matched descriptors in the first and the second set.
+
+    """
+    descriptors_1 = torch.as_tensor(descriptors_1, dtype=torch.float32)
+    descriptors_2 = torch.as_tensor(descriptors_2, dtype=torch.float32)
+    num_descriptors_1, num_descriptors_2 = len(descriptors_1), len(descriptors_2)
+    if num_descriptors_1 == 0 or num_descriptors_2 == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    squared_norms_2 = (descriptors_2**2).sum(dim=1)
+    nearest_1 = torch.empty(num_descriptors_1, dtype=torch.int64)
+    passes_ratio = torch.empty(num_descriptors_1, dtype=torch.bool)
+    best_distances_2 = torch.full((num_descriptors_2,), float("inf"))
+    nearest_2 = torch.zeros(num_descriptors_2, dtype=torch.int64)
+
+    with torch.inference_mode():
+        for start in range(0, num_descriptors_1, chunk_size):
+            chunk = descriptors_1[start : start + chunk_size]
+            squared_distances = (chunk**2).sum(dim=1, keepdim=True) + squared_norms_2 - 2 * chunk @ descriptors_2.T
+            distances = squared_distances.clamp_(min=0).sqrt_()
+
+            k = min(2, num_descriptors_2)
+            top_distances, top_indices = distances.topk(k, dim=1, largest=False)
+            nearest_1[start : start + len(chunk)] = top_indices[:, 0]
+            if k == 2:
+                passes_ratio[start : start + len(chunk)] = top_distances[:, 0] < ratio_threshold * top_distances[:, 1]
+            else:
+                passes_ratio[start : start + len(chunk)] = True
+
+            chunk_best_distances, chunk_nearest = distances.min(dim=0)
+            improved = chunk_best_distances < best_distances_2
+            best_distances_2[improved] = chunk_best_distances[improved]
+            nearest_2[improved] = chunk_nearest[improved] + start
+
+    keep = passes_ratio
+    if mutual:
+        keep = keep & (nearest_2[nearest_1] == torch.arange(num_descriptors_1))
+
+    indices_1 = torch.nonzero(keep).flatten()
+    return indices_1.numpy(), nearest_1[indices_1].numpy()
+
+
+def superpoint_find_homography(result_1, result_2, chunk_size=1024, ratio_threshold=0.75, ransac_threshold=5.0):
+    """
+    Match SuperPoint keypoints of two images and find the homography between them with RANSAC.
+
+    Parameters
+    ----------
+    result_1, result_2 : dict
+        Detection results with "keypoints" and "descriptors", e.g. from `SuperPointEngine.detect`.
+    chunk_size : int
+        Chunk size of `match_descriptors`.
+    ratio_threshold : float
+        Ratio test threshold of `match_descriptors`.
+    ransac_threshold : float
+        Maximal reprojection error in pixels for a match to be a RANSAC inlier.
+
+    Returns
+    -------
+    homography_matrix : np.ndarray
+        Homography of shape (3, 3) mapping points of the first image to the second one.
+    points_1, points_2 : np.ndarray
+        Matched points of shape (K, 2) that are RANSAC inliers.
+
+    """
+    indices_1, indices_2 = match_descriptors(
+        result_1["descriptors"], result_2["descriptors"], chunk_size=chunk_size, ratio_threshold=ratio_threshold
+    )
+    if len(indices_1) <= 4:
+        raise ValueError(f"Not enough matches are found - {len(indices_1)}/{4}")
+
+    points_1 = np.asarray(result_1["keypoints"], dtype=np.float32)[indices_1]
+    points_2 = np.asarray(result_2["keypoints"], dtype=np.float32)[indices_2]
+
+    homography_matrix, inliers_mask = cv.findHomography(points_1, points_2, cv.RANSAC, ransac_threshold)
+    if homography_matrix is None:
+        raise ValueError("Homography is not found.")
+
+    inliers = inliers_mask.ravel().astype(bool)
+    return homography_matrix, points_1[inliers], points_2[inliers]
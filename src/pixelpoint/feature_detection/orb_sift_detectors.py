@@ -2,7 +2,11 @@ import argparse
 from pathlib import Path
 
 import cv2
-import matplotlib.pyplot as plt
+import numpy as np
+
+from pixelpoint.visualization import draw_markers
+from pixelpoint.visualization import save_image
+from pixelpoint.visualization import show_images
 
 
 def orb_sift_extract_keypoints_and_descriptors(img_1_path, img_2_path, detector_type="ORB"):
@@ -25,34 +29,21 @@ def orb_sift_extract_keypoints_and_descriptors(img_1_path, img_2_path, detector_
     return (keypoints_1, descriptors_1), (keypoints_2, descriptors_2)
 
 
-def orb_sift_draw_keypoints(img_1_path, kp1, img_2_path, kp2):
-    img1 = cv2.imread(str(img_1_path))
-    img2 = cv2.imread(str(img_2_path))
-
-    img1_with_keypoints = cv2.drawKeypoints(
-        img1, kp1, None, color=(0, 255, 0), flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS
-    )
-    img2_with_keypoints = cv2.drawKeypoints(
-        img2, kp2, None, color=(0, 255, 0), flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS
-    )
-
-    img1_with_keypoints_rgb = cv2.cvtColor(img1_with_keypoints, cv2.COLOR_BGR2RGB)
-    img2_with_keypoints_rgb = cv2.cvtColor(img2_with_keypoints, cv2.COLOR_BGR2RGB)
+def orb_sift_draw_keypoints(img_1, kp1, img_2, kp2, output_dir=None, scale=1.0):
+    images_with_keypoints = []
+    for img, keypoints in ((img_1, kp1), (img_2, kp2)):
+        # Images are read from disk only if paths are passed instead of already loaded images
+        if not isinstance(img, np.ndarray):
+            img = cv2.imread(str(img))
+        points = np.array([keypoint.pt for keypoint in keypoints], dtype=np.float64).reshape(-1, 2)
+        images_with_keypoints.append(draw_markers(img, points, (0, 255, 0), radius=4, thickness=1, scale=scale))
 
-    plt.figure(figsize=(12, 6))
+    if output_dir is None:
+        show_images(images_with_keypoints, titles=["Image 1 with Keypoints", "Image 2 with Keypoints"])
+        return
 
-    plt.subplot(1, 2, 1)
-    plt.imshow(img1_with_keypoints_rgb)
-    plt.axis("off")
-    plt.title("Image 1 with Keypoints")
-
-    plt.subplot(1, 2, 2)
-    plt.imshow(img2_with_keypoints_rgb)
-    plt.axis("off")
-    plt.title("Image 2 with Keypoints")
-
-    plt.tight_layout()
-    plt.show()
+    for i, image in enumerate(images_with_keypoints):
+        save_image(Path(output_dir) / f"keypoints_{i + 1}.png", image)
 
 
 def main():
@@ -78,6 +69,10 @@ def main():
         default=Path("notebooks/feature_detection/data/cam1_1.jpg"),
         help="Path to the second image. Default is 'notebooks/feature_detection/data/cam1_1.jpg'.",
     )
+    parser.add_argument(
+        "--output-dir", type=Path, default=None, help="Save images with keypoints here instead of showing them."
+    )
+    parser.add_argument("--preview-scale", type=float, default=1.0, help="Scale of the images with keypoints.")
 
     args = parser.parse_args()
 
@@ -93,7 +88,7 @@ def main():
         print(f"Keypoints in image 1: {len(kp1)}")
         print(f"Keypoints in image 2: {len(kp2)}")
 
-        orb_sift_draw_keypoints(img_1_path, kp1, img_2_path, kp2)
+        orb_sift_draw_keypoints(img_1_path, kp1, img_2_path, kp2, output_dir=args.output_dir, scale=args.preview_scale)
 
     except FileNotFoundError as e:
         print(f"Error: {e}")
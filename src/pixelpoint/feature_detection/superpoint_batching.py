@@ -0,0 +1,165 @@
+import argparse
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .superpoint_detector import DEFAULT_SUPERPOINT_MODEL
+from .superpoint_detector import get_superpoint_engine
+from .superpoint_detector import load_images
+
+
+class SuperPointBatcher:
+    """
+    Collect images from concurrent callers and detect keypoints on them in one batched forward pass.
+
+    A batch is closed when it reaches `max_batch_size` images or `max_wait_ms` milliseconds have passed since its
+    first image arrived. The processor resizes all images of a batch to the same size and the per-image keypoints,
+    scores and descriptors are scattered back to the callers using the model output mask.
+
+    Parameters
+    ----------
+    engine : SuperPointEngine
+        Engine used to run the batched forward pass.
+    max_batch_size : int
+        Maximal number of images in one forward pass.
+    max_wait_ms : float
+        Maximal time to wait for more images after the first image of a batch.
+
+    """
+
+    def __init__(self, engine, max_batch_size: int = 8, max_wait_ms: float = 10.0):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._requests = queue.Queue()
+        self._batch_sizes = Counter()
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="superpoint-batcher", daemon=True)
+        self._worker.start()
+
+    def detect(self, image):
+        """Detect keypoints on one PIL image, blocking until its batch is processed. Raises RuntimeError after close."""
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("SuperPoint batcher is closed")
+            self._requests.put((image, future))
+        return future.result()
+
+    def close(self):
+        """Detect the queued images and stop the worker thread, e.g. on shutdown."""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._requests.put(None)
+        self._worker.join()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batch_sizes = dict(sorted(self._batch_sizes.items()))
+        num_batches = sum(batch_sizes.values())
+        num_images = sum(size * count for size, count in batch_sizes.items())
+        return {
+            "batches": num_batches,
+            "images": num_images,
+            "mean_batch_size": num_images / num_batches if num_batches else 0.0,
+            "batch_sizes": batch_sizes,
+        }
+
+    def _collect_batch(self, first_request):
+        batch = [first_request]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Finish the current batch and stop after it
+                self._requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+
+            batch = self._collect_batch(request)
+            images = [image for image, _ in batch]
+            futures = [future for _, future in batch]
+            try:
+                image_results = self.engine.detect(images)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+            for future, image_result in zip(futures, image_results):
+                future.set_result(image_result)
+
+
+def _measure_throughput(detect, images, num_requests, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(detect, (images[i % len(images)] for i in range(num_requests))))
+    return num_requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dynamic micro-batching of SuperPoint keypoint detection")
+    parser.add_argument(
+        "--images",
+        type=Path,
+        nargs="+",
+        default=[
+            Path("notebooks/feature_detection/data/cam2_1.jpg"),
+            Path("notebooks/feature_detection/data/cam1_1.jpg"),
+        ],
+        help="Images to send as requests. Default are the images in 'notebooks/feature_detection/data'.",
+    )
+    parser.add_argument("--model", type=str, default=DEFAULT_SUPERPOINT_MODEL, help="Model id or local directory.")
+    parser.add_argument("--num-threads", type=int, default=None, help="Number of intra-op torch threads.")
+    parser.add_argument("--num-requests", type=int, default=64, help="Number of detection requests.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent callers.")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="Maximal number of images in a batch.")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0, help="Maximal time to wait for a full batch.")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    engine = get_superpoint_engine(args.model, num_threads=args.num_threads)
+
+    # Warm up the model, so the first measured request doesn't pay for lazy initialization
+    engine.detect(images[:1])
+
+    unbatched = _measure_throughput(
+        lambda image: engine.detect([image])[0], images, args.num_requests, args.concurrency
+    )
+
+    batcher = SuperPointBatcher(engine, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    batched = _measure_throughput(batcher.detect, images, args.num_requests, args.concurrency)
+    batcher.close()
+
+    stats = batcher.stats()
+    print(f"Unbatched throughput: {unbatched:.2f} images/s")
+    print(f"Batched throughput: {batched:.2f} images/s ({batched / unbatched:.2f}x)")
+    print(f"Mean batch size: {stats['mean_batch_size']:.2f}, batch sizes: {stats['batch_sizes']}")
+
+
+if __name__ == "__main__":
+    main()
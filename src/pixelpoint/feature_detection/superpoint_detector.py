@@ -1,13 +1,28 @@
 import argparse
+import threading
 from pathlib import Path
+from typing import Dict
+from typing import Optional
+from typing import Tuple
 
 import cv2 as cv
 import numpy as np
 import torch
-from matplotlib import pyplot as plt
 from PIL import Image
 from transformers import AutoImageProcessor
 from transformers import SuperPointForKeypointDetection
+from transformers.models.superpoint.modeling_superpoint import simple_nms
+
+from pixelpoint.visualization import draw_markers
+from pixelpoint.visualization import save_image
+from pixelpoint.visualization import show_images
+
+from .descriptor_matching import match_descriptors
+from .superpoint_tiling import superpoint_detect_keypoints_tiled
+
+DEFAULT_SUPERPOINT_MODEL = "magic-leap-community/superpoint"
+SUPERPOINT_RUNTIMES = ("eager", "scripted", "quantized")
+SUPERPOINT_EXPORT_FILES = {"scripted": "superpoint_scripted.pt", "quantized": "superpoint_quantized.pt"}
 
 
 def load_images(image_paths):
@@ -20,7 +35,8 @@ def process_images(images, processor):
 
 def superpoint_detect_keypoints(images, model, processor):
     inputs = process_images(images, processor)
-    outputs = model(**inputs)
+    with torch.inference_mode():
+        outputs = model(**inputs)
 
     results = []
     for i in range(len(images)):
@@ -36,14 +52,198 @@ def superpoint_detect_keypoints(images, model, processor):
     return results
 
 
-def superpoint_draw_keypoints(image_np, keypoints, color=(0, 0, 255), radius=2):
-    for keypoint in keypoints:
-        keypoint_x, keypoint_y = int(keypoint[0].item()), int(keypoint[1].item())
-        image_np = cv.circle(image_np, (keypoint_x, keypoint_y), radius, color, thickness=-1)
-    return image_np
+class SuperPointDense(torch.nn.Module):
+    """
+    Convolutional part of SuperPoint that maps images to dense keypoint logits and descriptor maps.
+
+    Unlike the HuggingFace model it has no data-dependent control flow, so it can be traced to TorchScript, exported
+    to ONNX and quantized. Keypoint extraction and descriptor sampling are done by
+    `superpoint_detect_keypoints_dense`. The quant/dequant stubs are identities until the module is quantized.
+
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.quant = torch.quantization.QuantStub()
+        self.conv_blocks = model.encoder.conv_blocks
+        self.conv_score_a = model.keypoint_decoder.conv_score_a
+        self.conv_score_b = model.keypoint_decoder.conv_score_b
+        self.conv_descriptor_a = model.descriptor_decoder.conv_descriptor_a
+        self.conv_descriptor_b = model.descriptor_decoder.conv_descriptor_b
+        self.relu_score = torch.nn.ReLU()
+        self.relu_descriptor = torch.nn.ReLU()
+        self.dequant_scores = torch.quantization.DeQuantStub()
+        self.dequant_descriptors = torch.quantization.DeQuantStub()
+
+    def forward(self, pixel_values):
+        hidden_states = self.quant(pixel_values)
+        for conv_block in self.conv_blocks:
+            hidden_states = conv_block(hidden_states)
+
+        scores = self.conv_score_b(self.relu_score(self.conv_score_a(hidden_states)))
+        descriptors = self.conv_descriptor_b(self.relu_descriptor(self.conv_descriptor_a(hidden_states)))
+        return self.dequant_scores(scores), self.dequant_descriptors(descriptors)
+
+
+def superpoint_detect_pixel_values(pixel_values, model, dense_model=None):
+    """
+    Detect keypoints on a batch of prepared grayscale images without resizing them.
+
+    Parameters
+    ----------
+    pixel_values : torch.Tensor
+        Images of shape (batch_size, 1, height, width) with values in [0, 1], height and width divisible by 8.
+    model : SuperPointForKeypointDetection
+        Eager model, its post-processing is used for the exported models as well.
+    dense_model : torch.nn.Module, optional
+        Exported `SuperPointDense` to run instead of the eager model.
+
+    Returns
+    -------
+    results : list[dict]
+        Keypoints, scores and descriptors of every image.
+
+    """
+    # pylint: disable=protected-access
+    with torch.inference_mode():
+        if dense_model is None:
+            outputs = model(pixel_values=pixel_values.expand(-1, 3, -1, -1))
+            results = []
+            for i in range(len(pixel_values)):
+                image_mask = outputs.mask[i].bool()
+                results.append(
+                    {
+                        "keypoints": outputs.keypoints[i][image_mask],
+                        "scores": outputs.scores[i][image_mask],
+                        "descriptors": outputs.descriptors[i][image_mask],
+                    }
+                )
+            return results
+
+        score_logits, descriptor_maps = dense_model(pixel_values)
+
+        scores = torch.nn.functional.softmax(score_logits, 1)[:, :-1]
+        batch_size, _, height, width = scores.shape
+        scores = scores.permute(0, 2, 3, 1).reshape(batch_size, height, width, 8, 8)
+        scores = scores.permute(0, 1, 3, 2, 4).reshape(batch_size, height * 8, width * 8)
+        scores = simple_nms(scores, model.keypoint_decoder.nms_radius)
+        descriptor_maps = torch.nn.functional.normalize(descriptor_maps, p=2, dim=1)
+
+        results = []
+        for i in range(batch_size):
+            keypoints, keypoint_scores = model.keypoint_decoder._extract_keypoints(scores[i][None])
+            descriptors = model.descriptor_decoder._sample_descriptors(keypoints[None], descriptor_maps[i][None], 8)
+            results.append(
+                {
+                    "keypoints": keypoints,
+                    "scores": keypoint_scores,
+                    "descriptors": torch.transpose(descriptors[0], 0, 1),
+                }
+            )
+        return results
+
+
+def superpoint_detect_keypoints_dense(images, dense_model, model, processor):
+    """Detect keypoints using an exported `SuperPointDense` with the post-processing of the HuggingFace model."""
+    inputs = process_images(images, processor)
+    pixel_values = model.extract_one_channel_pixel_values(inputs["pixel_values"])
+
+    results = superpoint_detect_pixel_values(pixel_values, model, dense_model=dense_model)
+    for i, image_result in enumerate(results):
+        image_result["input_image"] = inputs["pixel_values"][i]
+
+    return results
+
+
+class SuperPointEngine:
+    """
+    Long-lived SuperPoint model ready for inference.
+
+    The processor and the model are loaded once and the model is switched to evaluation mode, so every call only
+    pays for the forward pass. Calls are serialized, as one forward pass already uses the whole intra-op thread pool.
+
+    Parameters
+    ----------
+    model_path : str
+        HuggingFace model id or path to a local directory with the saved model. A local directory is loaded without
+        network access.
+    num_threads : int, optional
+        Number of intra-op threads used by torch. By default torch settings are kept.
+    runtime : str
+        One of "eager" (HuggingFace model), "scripted" (TorchScript) or "quantized" (int8 TorchScript).
+    export_dir : str, optional
+        Directory with the models exported by `superpoint-export`, required for the non-eager runtimes.
 
+    """
 
-def superpoint_visualize_keypoints(image_results):
+    def __init__(
+        self,
+        model_path: str = DEFAULT_SUPERPOINT_MODEL,
+        num_threads: Optional[int] = None,
+        runtime: str = "eager",
+        export_dir: Optional[str] = None,
+    ):
+        if runtime not in SUPERPOINT_RUNTIMES:
+            raise ValueError(f"Unsupported SuperPoint runtime: {runtime}. Use one of {SUPERPOINT_RUNTIMES}.")
+        if runtime != "eager" and export_dir is None:
+            raise ValueError(f"SuperPoint runtime {runtime} requires the directory with exported models.")
+
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+        local_files_only = Path(model_path).is_dir()
+        self.model_path = model_path
+        self.processor = AutoImageProcessor.from_pretrained(model_path, local_files_only=local_files_only)
+        self.model = SuperPointForKeypointDetection.from_pretrained(model_path, local_files_only=local_files_only)
+        self.model.eval()
+
+        self.runtime = runtime
+        self.dense_model = None
+        if runtime != "eager":
+            self.dense_model = torch.jit.load(str(Path(export_dir) / SUPERPOINT_EXPORT_FILES[runtime]))
+            self.dense_model.eval()
+
+        self._lock = threading.Lock()
+
+    def detect(self, images):
+        """Detect keypoints on a list of PIL images, see `superpoint_detect_keypoints` for the result format."""
+        with self._lock:
+            if self.dense_model is None:
+                return superpoint_detect_keypoints(images, self.model, self.processor)
+            return superpoint_detect_keypoints_dense(images, self.dense_model, self.model, self.processor)
+
+    def detect_pixel_values(self, pixel_values):
+        """Detect keypoints on prepared grayscale images, see `superpoint_detect_pixel_values`."""
+        with self._lock:
+            return superpoint_detect_pixel_values(pixel_values, self.model, dense_model=self.dense_model)
+
+
+_ENGINES: Dict[Tuple[str, Optional[int], str, Optional[str]], SuperPointEngine] = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_superpoint_engine(
+    model_path: str = DEFAULT_SUPERPOINT_MODEL,
+    num_threads: Optional[int] = None,
+    runtime: str = "eager",
+    export_dir: Optional[str] = None,
+):
+    """Return the process-wide SuperPoint engine for the model and runtime, loading it on the first call."""
+    export_dir = str(export_dir) if export_dir is not None else None
+    key = (str(model_path), num_threads, runtime, export_dir)
+    with _ENGINES_LOCK:
+        if key not in _ENGINES:
+            _ENGINES[key] = SuperPointEngine(
+                model_path=str(model_path), num_threads=num_threads, runtime=runtime, export_dir=export_dir
+            )
+        return _ENGINES[key]
+
+
+def superpoint_draw_keypoints(image_np, keypoints, color=(0, 0, 255), radius=2, scale=1.0):
+    return draw_markers(image_np, np.asarray(keypoints), color, radius=radius, scale=scale)
+
+
+def superpoint_visualize_keypoints(image_results, output_dir=None, scale=1.0):
     processed_images = []
     for result in image_results:
         image_np = np.transpose(result["input_image"], (1, 2, 0)).numpy()
@@ -53,19 +253,15 @@ def superpoint_visualize_keypoints(image_results):
         else:
             image_np = image_np.astype(np.uint8)
 
-        image_np = np.ascontiguousarray(image_np)
-
-        image_np = superpoint_draw_keypoints(image_np, result["keypoints"])
+        image_np = cv.cvtColor(image_np, cv.COLOR_RGB2BGR)
+        processed_images.append(superpoint_draw_keypoints(image_np, result["keypoints"], scale=scale))
 
-        processed_images.append(cv.cvtColor(image_np, cv.COLOR_BGR2RGB))
+    if output_dir is None:
+        show_images(processed_images)
+        return
 
-    plt.figure(figsize=(10, 5))
-    for i, img in enumerate(processed_images):
-        plt.subplot(1, 2, i + 1)
-        plt.imshow(img)
-        plt.axis("off")
-    plt.tight_layout()
-    plt.show()
+    for i, image in enumerate(processed_images):
+        save_image(Path(output_dir) / f"superpoint_keypoints_{i + 1}.png", image)
 
 
 def main():
@@ -82,6 +278,31 @@ def main():
         default=Path("notebooks/feature_detection/data/cam1_1.jpg"),
         help="Path to the second image. Default is 'notebooks/feature_detection/data/cam1_1.jpg'.",
     )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=DEFAULT_SUPERPOINT_MODEL,
+        help=f"HuggingFace model id or local model directory. Default is '{DEFAULT_SUPERPOINT_MODEL}'.",
+    )
+    parser.add_argument("--num-threads", type=int, default=None, help="Number of intra-op torch threads.")
+    parser.add_argument(
+        "--runtime", type=str, default="eager", choices=SUPERPOINT_RUNTIMES, help="Model runtime. Default is eager."
+    )
+    parser.add_argument(
+        "--export-dir", type=Path, default=None, help="Directory with exported models for non-eager runtimes."
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=None,
+        help="Detect keypoints at native resolution in square tiles of this size (divisible by 8).",
+    )
+    parser.add_argument("--tile-overlap", type=int, default=64, help="Overlap of neighbouring tiles in pixels.")
+    parser.add_argument("--tile-batch-size", type=int, default=4, help="Number of tiles in one forward pass.")
+    parser.add_argument(
+        "--output-dir", type=Path, default=None, help="Save images with keypoints here instead of showing them."
+    )
+    parser.add_argument("--preview-scale", type=float, default=1.0, help="Scale of the images with keypoints.")
 
     args = parser.parse_args()
 
@@ -91,11 +312,24 @@ def main():
 
     images = load_images(image_paths)
 
-    processor = AutoImageProcessor.from_pretrained("magic-leap-community/superpoint")
-    model = SuperPointForKeypointDetection.from_pretrained("magic-leap-community/superpoint")
+    engine = get_superpoint_engine(
+        args.model, num_threads=args.num_threads, runtime=args.runtime, export_dir=args.export_dir
+    )
 
-    image_results = superpoint_detect_keypoints(images, model, processor)
-    superpoint_visualize_keypoints(image_results)
+    if args.tile_size is None:
+        image_results = engine.detect(images)
+    else:
+        image_results = [
+            superpoint_detect_keypoints_tiled(
+                image, engine, tile_size=args.tile_size, overlap=args.tile_overlap, batch_size=args.tile_batch_size
+            )
+            for image in images
+        ]
+    for image_path, result in zip(image_paths, image_results):
+        print(f"{image_path.name}: {len(result['keypoints'])} keypoints")
+    indices_1, _ = match_descriptors(image_results[0]["descriptors"], image_results[1]["descriptors"])
+    print(f"Mutual matches: {len(indices_1)}")
+    superpoint_visualize_keypoints(image_results, output_dir=args.output_dir, scale=args.preview_scale)
 
 
 if __name__ == "__main__":
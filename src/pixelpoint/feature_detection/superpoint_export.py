@@ -0,0 +1,170 @@
+import argparse
+import copy
+import json
+import time
+from pathlib import Path
+
+import torch
+
+from .superpoint_detector import DEFAULT_SUPERPOINT_MODEL
+from .superpoint_detector import SUPERPOINT_EXPORT_FILES
+from .superpoint_detector import SUPERPOINT_RUNTIMES
+from .superpoint_detector import SuperPointDense
+from .superpoint_detector import SuperPointEngine
+from .superpoint_detector import load_images
+from .superpoint_detector import process_images
+
+"""
+This module exports the SuperPoint model for fast CPU inference and compares the exported runtimes with the eager one.
+
+Exported models (see `SuperPointEngine` for the runtime switch):
+
+1. `superpoint_scripted.pt`: TorchScript trace of the convolutional part of the model (`SuperPointDense`).
+
+2. `superpoint_quantized.pt`: TorchScript trace of the same part with int8 weights and activations. Dynamic
+quantization only covers linear and recurrent layers and SuperPoint is fully convolutional, so the convolutions are
+quantized statically with activation ranges calibrated on the given images.
+
+3. `superpoint.onnx` (optional): ONNX graph of the float convolutional part with dynamic batch and image size.
+
+"""
+
+
+def _pixel_values(images, model, processor):
+    return model.extract_one_channel_pixel_values(process_images(images, processor)["pixel_values"])
+
+
+def export_superpoint(model, processor, calibration_images, output_dir, onnx=False):
+    """
+    Export TorchScript, int8 TorchScript and optionally ONNX versions of the SuperPoint model into `output_dir`.
+
+    Parameters
+    ----------
+    model : SuperPointForKeypointDetection
+        Loaded eager model.
+    processor : SuperPointImageProcessor
+        Image processor of the model.
+    calibration_images : list[PIL.Image.Image]
+        Images used as the tracing example and to calibrate quantization ranges.
+    output_dir : Path
+        Directory to save the exported models.
+    onnx : bool
+        Whether to export the ONNX graph as well.
+
+    """
+    output_dir.mkdir(exist_ok=True, parents=True)
+    pixel_values = _pixel_values(calibration_images, model, processor)
+    example = pixel_values[:1]
+
+    dense_model = SuperPointDense(copy.deepcopy(model)).eval()
+    with torch.no_grad():
+        scripted_model = torch.jit.trace(dense_model, example)
+    scripted_model.save(str(output_dir / SUPERPOINT_EXPORT_FILES["scripted"]))
+
+    quantized_model = SuperPointDense(copy.deepcopy(model)).eval()
+    quantized_model.qconfig = torch.quantization.get_default_qconfig("fbgemm")
+    torch.quantization.prepare(quantized_model, inplace=True)
+    with torch.no_grad():
+        for image_pixel_values in pixel_values:
+            quantized_model(image_pixel_values[None])
+    torch.quantization.convert(quantized_model, inplace=True)
+    with torch.no_grad():
+        scripted_quantized_model = torch.jit.trace(quantized_model, example)
+    scripted_quantized_model.save(str(output_dir / SUPERPOINT_EXPORT_FILES["quantized"]))
+
+    if onnx:
+        torch.onnx.export(
+            dense_model,
+            example,
+            str(output_dir / "superpoint.onnx"),
+            input_names=["pixel_values"],
+            output_names=["scores", "descriptors"],
+            dynamic_axes={"pixel_values": {0: "batch", 2: "height", 3: "width"}},
+            opset_version=13,
+        )
+
+
+def keypoint_repeatability(reference_keypoints, keypoints, tolerance=3.0):
+    """Fraction of reference keypoints that have a keypoint closer than `tolerance` pixels."""
+    if len(reference_keypoints) == 0:
+        return 1.0
+    if len(keypoints) == 0:
+        return 0.0
+    distances = torch.cdist(reference_keypoints.float(), keypoints.float())
+    return (distances.min(dim=1).values <= tolerance).float().mean().item()
+
+
+def benchmark_runtimes(engines, images, repeats=10, tolerance=3.0):
+    """Measure the detection time of every engine and the keypoint repeatability against the eager engine."""
+    reference_results = engines["eager"].detect(images)
+
+    report = {}
+    for runtime, engine in engines.items():
+        image_results = engine.detect(images)  # warm up
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            engine.detect(images)
+        seconds_per_image = (time.perf_counter() - start) / repeats / len(images)
+
+        repeatability = [
+            keypoint_repeatability(reference["keypoints"], result["keypoints"], tolerance)
+            for reference, result in zip(reference_results, image_results)
+        ]
+        report[runtime] = {
+            "seconds_per_image": seconds_per_image,
+            "keypoints_per_image": sum(len(result["keypoints"]) for result in image_results) / len(images),
+            "repeatability": sum(repeatability) / len(repeatability),
+        }
+
+    for runtime_report in report.values():
+        runtime_report["speedup"] = report["eager"]["seconds_per_image"] / runtime_report["seconds_per_image"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export SuperPoint to TorchScript/ONNX with int8 quantization")
+    parser.add_argument(
+        "--images",
+        type=Path,
+        nargs="+",
+        default=[
+            Path("notebooks/feature_detection/data/cam2_1.jpg"),
+            Path("notebooks/feature_detection/data/cam1_1.jpg"),
+        ],
+        help="Images to calibrate quantization and to benchmark. Default are the sample images.",
+    )
+    parser.add_argument("--model", type=str, default=DEFAULT_SUPERPOINT_MODEL, help="Model id or local directory.")
+    parser.add_argument("--output-dir", type=Path, required=True, help="Directory to save the exported models.")
+    parser.add_argument("--onnx", action="store_true", help="Export the ONNX graph as well.")
+    parser.add_argument("--num-threads", type=int, default=None, help="Number of intra-op torch threads.")
+    parser.add_argument("--repeats", type=int, default=10, help="Number of benchmark repeats.")
+    parser.add_argument(
+        "--tolerance", type=float, default=3.0, help="Distance in pixels for a keypoint to count as repeated."
+    )
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+
+    eager_engine = SuperPointEngine(args.model, num_threads=args.num_threads)
+    export_superpoint(eager_engine.model, eager_engine.processor, images, args.output_dir, onnx=args.onnx)
+    print(f"Exported models saved to {args.output_dir}")
+
+    engines = {"eager": eager_engine}
+    for runtime in SUPERPOINT_RUNTIMES:
+        if runtime != "eager":
+            engines[runtime] = SuperPointEngine(args.model, runtime=runtime, export_dir=args.output_dir)
+
+    report = benchmark_runtimes(engines, images, repeats=args.repeats, tolerance=args.tolerance)
+    for runtime, runtime_report in report.items():
+        print(
+            f"{runtime}: {runtime_report['seconds_per_image'] * 1000:.1f} ms/image, "
+            f"{runtime_report['speedup']:.2f}x, repeatability {runtime_report['repeatability']:.3f}"
+        )
+
+    with open(args.output_dir / "benchmark.json", "w") as f:
+        json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
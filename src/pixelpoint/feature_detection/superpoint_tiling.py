@@ -0,0 +1,125 @@
+import cv2 as cv
+import numpy as np
+import torch
+
+
+def _tile_origins(size, tile_size, overlap):
+    # Tiles step by tile_size - overlap and the last one is aligned with the image border
+    if size <= tile_size:
+        return np.array([0])
+    origins = np.arange(0, size - tile_size, tile_size - overlap)
+    return np.append(origins, size - tile_size)
+
+
+def _tile_boundaries(origins, tile_size):
+    # Every keypoint belongs to exactly one tile: neighbouring tiles are split in the middle of their overlap
+    return (origins[1:] + origins[:-1] + tile_size) / 2
+
+
+def _seam_nms(keypoints, scores, boundaries_x, boundaries_y, radius):
+    near_seam = (np.abs(keypoints[:, :1] - boundaries_x[None]) < radius).any(axis=1)
+    near_seam |= (np.abs(keypoints[:, 1:] - boundaries_y[None]) < radius).any(axis=1)
+
+    candidates = np.flatnonzero(near_seam)
+    candidates = candidates[np.argsort(-scores[candidates])]
+
+    # Greedy suppression in the order of scores, a candidate is compared only with the kept ones of the neighbouring
+    # cells of a `radius` grid, so time and memory are linear in the number of candidates
+    kept_cells = {}
+    keep = np.ones(len(candidates), dtype=bool)
+    for k, (x, y) in enumerate(keypoints[candidates]):
+        cell_x, cell_y = int(x // radius), int(y // radius)
+        neighbours = [
+            point for dx in (-1, 0, 1) for dy in (-1, 0, 1) for point in kept_cells.get((cell_x + dx, cell_y + dy), ())
+        ]
+        if any((x - nx) ** 2 + (y - ny) ** 2 < radius**2 for nx, ny in neighbours):
+            keep[k] = False
+        else:
+            kept_cells.setdefault((cell_x, cell_y), []).append((x, y))
+
+    mask = np.ones(len(keypoints), dtype=bool)
+    mask[candidates[~keep]] = False
+    return mask
+
+
+def superpoint_detect_keypoints_tiled(image, engine, tile_size=1024, overlap=64, batch_size=4, nms_radius=4):
+    """
+    Detect SuperPoint keypoints on an image at its native resolution.
+
+    The image is split into overlapping square tiles that are passed through the model in small batches, so peak
+    memory depends on `tile_size` and `batch_size`, not on the image size. Keypoints are shifted back to image
+    coordinates, each of them is kept only by the tile owning its location, and duplicates detected on both sides of
+    a seam are suppressed with a radius non-maximum suppression.
+
+    Parameters
+    ----------
+    image : PIL.Image.Image or np.ndarray
+        RGB or grayscale image.
+    engine : SuperPointEngine
+        Engine used to run the model.
+    tile_size : int
+        Tile side in pixels, must be divisible by 8.
+    overlap : int
+        Overlap of neighbouring tiles in pixels.
+    batch_size : int
+        Number of tiles in one forward pass.
+    nms_radius : float
+        Radius of the non-maximum suppression across tile seams in pixels.
+
+    Returns
+    -------
+    result : dict
+        Keypoints (N, 2) in image coordinates, scores (N,) and descriptors (N, 256), the same as for
+        `superpoint_detect_keypoints`, plus the grayscale "input_image".
+
+    """
+    if tile_size % 8 != 0:
+        raise ValueError(f"Tile size must be divisible by 8, got {tile_size}.")
+    if not 0 <= overlap < tile_size:
+        raise ValueError(f"Tile overlap must be in [0, {tile_size}), got {overlap}.")
+
+    image = np.asarray(image)
+    gray = cv.cvtColor(image, cv.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    height, width = gray.shape
+
+    origins_x = _tile_origins(width, tile_size, overlap)
+    origins_y = _tile_origins(height, tile_size, overlap)
+    boundaries_x = _tile_boundaries(origins_x, tile_size)
+    boundaries_y = _tile_boundaries(origins_y, tile_size)
+    edges_x = np.concatenate([[0], boundaries_x, [width]])
+    edges_y = np.concatenate([[0], boundaries_y, [height]])
+    tiles = [(i, j) for i in range(len(origins_y)) for j in range(len(origins_x))]
+
+    keypoints, scores, descriptors = [], [], []
+    for batch_start in range(0, len(tiles), batch_size):
+        batch_tiles = tiles[batch_start : batch_start + batch_size]
+
+        # Tiles over the image border are padded with zeros
+        pixel_values = np.zeros((len(batch_tiles), 1, tile_size, tile_size), dtype=np.float32)
+        for k, (i, j) in enumerate(batch_tiles):
+            tile = gray[origins_y[i] : origins_y[i] + tile_size, origins_x[j] : origins_x[j] + tile_size]
+            pixel_values[k, 0, : tile.shape[0], : tile.shape[1]] = tile / 255.0
+
+        for (i, j), tile_result in zip(batch_tiles, engine.detect_pixel_values(torch.from_numpy(pixel_values))):
+            tile_keypoints = tile_result["keypoints"].numpy() + (origins_x[j], origins_y[i])
+            owned = (
+                (tile_keypoints[:, 0] >= edges_x[j])
+                & (tile_keypoints[:, 0] < edges_x[j + 1])
+                & (tile_keypoints[:, 1] >= edges_y[i])
+                & (tile_keypoints[:, 1] < edges_y[i + 1])
+            )
+            keypoints.append(tile_keypoints[owned])
+            scores.append(tile_result["scores"].numpy()[owned])
+            descriptors.append(tile_result["descriptors"].numpy()[owned])
+
+    keypoints = np.concatenate(keypoints)
+    scores = np.concatenate(scores)
+    descriptors = np.concatenate(descriptors)
+
+    keep = _seam_nms(keypoints, scores, boundaries_x, boundaries_y, nms_radius)
+    return {
+        "keypoints": torch.from_numpy(keypoints[keep]),
+        "scores": torch.from_numpy(scores[keep]),
+        "descriptors": torch.from_numpy(descriptors[keep]),
+        "input_image": torch.from_numpy(gray)[None].expand(3, -1, -1),
+    }
@@ -0,0 +1,444 @@
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+from pixelpoint.progress import FINAL_STAGES
+
+"""
+Load test of the web app.
+
+Worker threads send requests of the chosen scenarios in a loop for a fixed duration, against a server at `--url` or
+against the app started in this process. Every request is timed; the report has latency percentiles, throughput and
+error rates per scenario, and the server RSS sampled over time.
+
+"""
+
+NOTEBOOKS_DIR = Path(__file__).resolve().parents[2] / "notebooks"
+DEFAULT_LEFT_IMAGE = NOTEBOOKS_DIR / "feature_detection" / "data" / "cam1_1.jpg"
+DEFAULT_RIGHT_IMAGE = NOTEBOOKS_DIR / "feature_detection" / "data" / "cam2_1.jpg"
+DEFAULT_CALIBRATION_FILE = NOTEBOOKS_DIR / "calibration" / "calibration_params" / "calibration_data_synthetic.json"
+SCENARIOS = ("upload_and_process", "upload", "upload_calibration", "upload_params")
+
+
+class LoadProfile(NamedTuple):
+    duration: float  # seconds of measured load
+    concurrency: int  # number of concurrent clients
+    warmup: float  # seconds of load before the measurement, e.g. to load models
+
+
+PROFILES = {
+    "ci": LoadProfile(duration=10.0, concurrency=2, warmup=2.0),
+    "full": LoadProfile(duration=120.0, concurrency=16, warmup=10.0),
+}
+
+
+class RequestRecord(NamedTuple):
+    scenario: str
+    start: float  # seconds since the start of the load test
+    latency: float  # seconds
+    status: int  # HTTP status, 0 if the request failed without a response
+    error: Optional[str] = None
+    processing_time: Optional[float] = None  # seconds until the final progress event, with --follow-progress
+
+
+def encode_multipart(fields: Dict[str, str], files: Dict[str, Tuple[str, bytes, str]]) -> Tuple[bytes, str]:
+    """Encode form fields and files (name -> (filename, content, content type)) as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, content_type) in files.items():
+        header = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        )
+        parts.append(header.encode() + content + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def load_sample_images(left_path: Path, right_path: Path) -> Tuple[bytes, bytes]:
+    """
+    Encoded sample pair of the notebooks.
+
+    The notebook images are Git LFS files; in a checkout without them a synthetic pair with circles is generated, so
+    the load test still exercises the whole matching path.
+
+    """
+    images = []
+    for path in (left_path, right_path):
+        data = Path(path).read_bytes() if Path(path).is_file() else b""
+        if cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE) is None:
+            break
+        images.append(data)
+    if len(images) == 2:
+        return images[0], images[1]
+
+    print(f"Sample images {left_path}, {right_path} can't be decoded, a synthetic pair is used", file=sys.stderr)
+    return synthetic_pair()
+
+
+def synthetic_pair(width: int = 2048, height: int = 1536, num_circles: int = 40, seed: int = 0) -> Tuple[bytes, bytes]:
+    rng = np.random.default_rng(seed)
+    image_left = np.full((height, width), 200, dtype=np.uint8)
+    noise = rng.integers(0, 30, size=(height, width), dtype=np.uint8)
+    image_left -= noise
+    for x, y in zip(rng.integers(100, width - 100, num_circles), rng.integers(100, height - 100, num_circles)):
+        cv2.circle(image_left, (int(x), int(y)), int(rng.integers(8, 20)), 30, -1)
+    # The right camera sees the scene shifted horizontally
+    image_right = np.roll(image_left, -int(width * 0.05), axis=1)
+    return cv2.imencode(".png", image_left)[1].tobytes(), cv2.imencode(".png", image_right)[1].tobytes()
+
+
+def build_requests(
+    image_left: bytes, image_right: bytes, calibration: bytes, image_suffix: str = ".png"
+) -> Dict[str, Tuple[str, bytes, str]]:
+    """Method-less requests of the scenarios: path, body and content type. Bodies are encoded once and reused."""
+    content_type = "image/png" if image_suffix == ".png" else "image/jpeg"
+    images = {
+        "image1": (f"left{image_suffix}", image_left, content_type),
+        "image2": (f"right{image_suffix}", image_right, content_type),
+    }
+    params = {
+        "focal_length": "80",
+        "pixel_size": "0.0045",
+        "sensor_resolution": "0",
+        "sensor_size": "36 24",
+        "distance": "639 639 412",
+        "num_tiles": "9x6",
+        "square_size": "20",
+    }
+    chessboard_images = {
+        "chessboard_image1": images["image1"],
+        "chessboard_image2": images["image2"],
+    }
+    return {
+        "upload_and_process": ("/upload_and_process/", *encode_multipart({}, images)),
+        "upload": ("/upload/", *encode_multipart({}, images)),
+        "upload_calibration": (
+            "/upload_calibration/",
+            *encode_multipart({}, {"calibration_file": ("calibration.json", calibration, "application/json")}),
+        ),
+        "upload_params": ("/upload_params/", *encode_multipart(params, chessboard_images)),
+    }
+
+
+def process_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """Resident set size of a process from /proc, or the peak RSS of this process where /proc is not available."""
+    pid = os.getpid() if pid is None else pid
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == os.getpid():
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return None
+
+
+@contextlib.contextmanager
+def in_process_server(artefacts_dir: Path) -> Iterator[str]:
+    """Serve the app on a free local port in a thread of this process and yield its URL."""
+    # pylint: disable=import-outside-toplevel
+    import uvicorn
+
+    from pixelpoint import main as server
+
+    server.app.state.store_options["root"] = Path(artefacts_dir).as_posix()
+    uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=uvicorn_server.run, name="loadtest-server", daemon=True)
+    thread.start()
+    while not uvicorn_server.started:
+        if not thread.is_alive():
+            raise RuntimeError("In-process server failed to start")
+        time.sleep(0.05)
+    port = uvicorn_server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        uvicorn_server.should_exit = True
+        thread.join()
+
+
+class LoadTest:
+    """
+    Concurrent clients sending requests of the scenarios until the deadline.
+
+    Parameters
+    ----------
+    url : str
+        Server URL, e.g. "http://127.0.0.1:8000".
+    requests : dict
+        Requests of the scenarios from `build_requests`.
+    scenarios : list[str]
+        Scenarios to run, every client picks one at random for each request.
+    concurrency : int
+        Number of clients, every one in its own thread with its own keep-alive connection.
+    follow_progress : bool
+        Follow the progress of `/upload_and_process/` to its final event, to measure the processing time too.
+
+    """
+
+    def __init__(
+        self,
+        url: str,
+        requests: Dict[str, Tuple[str, bytes, str]],
+        scenarios: List[str],
+        concurrency: int,
+        follow_progress: bool = False,
+        timeout: float = 120.0,
+        seed: int = 0,
+    ):
+        split = urlsplit(url)
+        self.host, self.port = split.hostname, split.port or 80
+        self.requests = requests
+        self.scenarios = scenarios
+        self.concurrency = concurrency
+        self.follow_progress = follow_progress
+        self.timeout = timeout
+        self.seed = seed
+        self.records: List[RequestRecord] = []
+        self._lock = threading.Lock()
+        self._start = 0.0
+
+    def run(self, duration: float, server_pid: Optional[int] = None, rss_interval: float = 0.5) -> List[list]:
+        """Run the clients for `duration` seconds, return the server RSS samples [seconds, MB]."""
+        self._start = time.perf_counter()
+        deadline = self._start + duration
+        rss_samples = []
+        clients = [
+            threading.Thread(target=self._client, args=(i, deadline), name=f"loadtest-client-{i}")
+            for i in range(self.concurrency)
+        ]
+        for client in clients:
+            client.start()
+        while any(client.is_alive() for client in clients):
+            rss = process_rss_mb(server_pid)
+            if rss is not None:
+                rss_samples.append([round(time.perf_counter() - self._start, 3), round(rss, 1)])
+            time.sleep(rss_interval)
+        for client in clients:
+            client.join()
+        return rss_samples
+
+    def _client(self, index: int, deadline: float):
+        rng = random.Random(self.seed + index)
+        connection = None
+        while time.perf_counter() < deadline:
+            if connection is None:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            scenario = rng.choice(self.scenarios)
+            path, body, content_type = self.requests[scenario]
+            start = time.perf_counter()
+            status, latency, error, processing_time = 0, 0.0, None, None
+            try:
+                connection.request("POST", path, body=body, headers={"Content-Type": content_type})
+                response = connection.getresponse()
+                content = response.read()
+                status = response.status
+                latency = time.perf_counter() - start
+                if status >= 400:
+                    error = content.decode(errors="replace")[:500]
+                elif self.follow_progress and scenario == "upload_and_process":
+                    progress_url = json.loads(content)["progress_url"]
+                    final_stage = self._follow(progress_url)
+                    processing_time = time.perf_counter() - start
+                    if final_stage != "done":
+                        error = f"Processing ended with {final_stage}"
+            except (OSError, http.client.HTTPException, ValueError, KeyError) as exc:
+                error = f"{type(exc).__name__}: {exc}"
+                connection.close()
+                connection = None
+                latency = time.perf_counter() - start
+            record = RequestRecord(scenario, start - self._start, latency, status, error, processing_time)
+            with self._lock:
+                self.records.append(record)
+        if connection is not None:
+            connection.close()
+
+    def _follow(self, progress_url: str) -> Optional[str]:
+        # A separate connection, the event stream is read until the final event
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request("GET", progress_url)
+            response = connection.getresponse()
+            stage = None
+            for line in response:
+                if line.startswith(b"data: "):
+                    stage = json.loads(line[len(b"data: ") :])["stage"]
+                    if stage in FINAL_STAGES:
+                        break
+            return stage
+        finally:
+            connection.close()
+
+
+def summarize(records: List[RequestRecord], duration: float, warmup: float = 0.0) -> dict:
+    """Latency percentiles, throughput and error rate per scenario and in total, without the warmup requests."""
+    measured = [record for record in records if record.start >= warmup]
+    measured_duration = max(duration - warmup, 1e-9)
+    scenarios = sorted({record.scenario for record in measured})
+    report = {scenario: _summarize_records([r for r in measured if r.scenario == scenario]) for scenario in scenarios}
+    report["total"] = _summarize_records(measured)
+    for summary in report.values():
+        summary["throughput_rps"] = summary["requests"] / measured_duration
+    return report
+
+
+def _summarize_records(records: List[RequestRecord]) -> dict:
+    latencies = np.array([record.latency for record in records]) * 1000
+    errors = [record for record in records if record.error is not None or record.status == 0]
+    status_codes: Dict[str, int] = {}
+    for record in records:
+        status_codes[str(record.status)] = status_codes.get(str(record.status), 0) + 1
+    summary = {
+        "requests": len(records),
+        "errors": len(errors),
+        "error_rate": len(errors) / max(len(records), 1),
+        "status_codes": status_codes,
+        # A few distinct error messages, so validation errors are visible in the report
+        "error_samples": sorted({record.error for record in errors if record.error})[:5],
+        "latency_ms": {},
+    }
+    if len(records):
+        summary["latency_ms"] = {
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "mean": float(latencies.mean()),
+            "max": float(latencies.max()),
+        }
+    processing_times = [record.processing_time for record in records if record.processing_time is not None]
+    if processing_times:
+        processing_ms = np.array(processing_times) * 1000
+        summary["processing_ms"] = {
+            "p50": float(np.percentile(processing_ms, 50)),
+            "p95": float(np.percentile(processing_ms, 95)),
+            "p99": float(np.percentile(processing_ms, 99)),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the web app: latency, throughput, errors and RSS.")
+    parser.add_argument(
+        "--url", type=str, default=None, help="Server URL (default: the app is served in this process)."
+    )
+    parser.add_argument("--profile", default="ci", choices=list(PROFILES), help="Duration and concurrency preset.")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds of measured load.")
+    parser.add_argument("--concurrency", type=int, default=None, help="Number of concurrent clients.")
+    parser.add_argument("--warmup", type=float, default=None, help="Seconds of load excluded from the report.")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS, help="Requests to send.")
+    parser.add_argument(
+        "--follow-progress",
+        action="store_true",
+        help="Follow /upload_and_process/ operations to the end and report the processing time.",
+    )
+    parser.add_argument("--left-image", type=Path, default=DEFAULT_LEFT_IMAGE, help="Left image of the requests.")
+    parser.add_argument("--right-image", type=Path, default=DEFAULT_RIGHT_IMAGE, help="Right image of the requests.")
+    parser.add_argument(
+        "--calibration-file", type=Path, default=DEFAULT_CALIBRATION_FILE, help="Calibration JSON of the requests."
+    )
+    parser.add_argument(
+        "--server-pid", type=int, default=None, help="Server process to sample RSS of (default: this process)."
+    )
+    parser.add_argument("--rss-interval", type=float, default=0.5, help="Seconds between RSS samples.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the scenario choice of the clients.")
+    parser.add_argument(
+        "--max-error-rate",
+        type=float,
+        default=None,
+        help="Exit with code 1 if the total error rate is higher, e.g. 0 in CI.",
+    )
+    parser.add_argument(
+        "--output-file",
+        type=Path,
+        default=Path("loadtest.json"),
+        help="Path to the JSON report (default: loadtest.json).",
+    )
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile]
+    duration = args.duration if args.duration is not None else profile.duration
+    concurrency = args.concurrency if args.concurrency is not None else profile.concurrency
+    warmup = args.warmup if args.warmup is not None else profile.warmup
+
+    image_left, image_right = load_sample_images(args.left_image, args.right_image)
+    image_suffix = ".png" if image_left.startswith(b"\x89PNG") else ".jpg"
+    requests = build_requests(image_left, image_right, args.calibration_file.read_bytes(), image_suffix)
+
+    with contextlib.ExitStack() as stack:
+        url = args.url
+        server_pid = args.server_pid
+        if url is None:
+            artefacts_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="loadtest_artefacts_"))
+            url = stack.enter_context(in_process_server(Path(artefacts_dir)))
+            server_pid = os.getpid()
+        load_test = LoadTest(
+            url, requests, args.scenarios, concurrency, follow_progress=args.follow_progress, seed=args.seed
+        )
+        print(f"Load test of {url}: {concurrency} clients, {warmup:.0f} s warmup, {duration:.0f} s measured")
+        rss_samples = load_test.run(warmup + duration, server_pid=server_pid, rss_interval=args.rss_interval)
+
+    summary = summarize(load_test.records, warmup + duration, warmup=warmup)
+    report = {
+        "url": args.url or "in-process",
+        "profile": args.profile,
+        "duration_s": duration,
+        "warmup_s": warmup,
+        "concurrency": concurrency,
+        "scenarios": summary,
+        "rss_mb": {
+            "samples": rss_samples,
+            "max": max((sample[1] for sample in rss_samples), default=None),
+            "end": rss_samples[-1][1] if rss_samples else None,
+        },
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    for scenario, scenario_summary in summary.items():
+        latency = scenario_summary["latency_ms"]
+        percentiles = (
+            f"p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, p99 {latency['p99']:.1f} ms" if latency else "-"
+        )
+        print(
+            f"{scenario}: {scenario_summary['requests']} requests, {scenario_summary['throughput_rps']:.1f} req/s, "
+            f"{percentiles}, errors {scenario_summary['error_rate']:.1%}"
+        )
+    if rss_samples:
+        print(f"Server RSS: max {report['rss_mb']['max']:.0f} MB, end {report['rss_mb']['end']:.0f} MB")
+
+    with open(args.output_file, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Load test report saved to {args.output_file}")
+
+    if args.max_error_rate is not None and summary["total"]["error_rate"] > args.max_error_rate:
+        print(f"Error rate {summary['total']['error_rate']:.1%} exceeds {args.max_error_rate:.1%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
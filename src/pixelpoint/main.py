@@ -1,47 +1,147 @@
 import argparse
+import asyncio
+import io
 import json
+import os
+import time
 from pathlib import Path
+from typing import List
+from typing import Optional
 
-import matplotlib.pyplot as plt
+import cv2
+import numpy as np
 import uvicorn
+from fastapi import BackgroundTasks
 from fastapi import FastAPI
 from fastapi import File
 from fastapi import Form
+from fastapi import Header
+from fastapi import Query
 from fastapi import UploadFile
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 
+from pixelpoint.artefact_store import ARTEFACT_STORES
+from pixelpoint.artefact_store import ArtefactNotFound
+from pixelpoint.artefact_store import ArtefactStore
+from pixelpoint.artefact_store import create_artefact_store
+from pixelpoint.artefact_writer import FSYNC_POLICIES
+from pixelpoint.artefact_writer import ArtefactWriter
+from pixelpoint.artefacts import PREVIEW_FORMATS
+from pixelpoint.artefacts import artefact_response
+from pixelpoint.artefacts import encode_png
+from pixelpoint.artefacts import encode_preview
+from pixelpoint.artefacts import key_etag
+from pixelpoint.artefacts import result_image_key
+from pixelpoint.calibration.calibration_utils import load_calibration_params
+from pixelpoint.drift import EpipolarDriftMonitor
+from pixelpoint.feature_detection.superpoint_batching import SuperPointBatcher
+from pixelpoint.feature_detection.superpoint_detector import DEFAULT_SUPERPOINT_MODEL
+from pixelpoint.feature_detection.superpoint_detector import SUPERPOINT_RUNTIMES
+from pixelpoint.feature_detection.superpoint_detector import get_superpoint_engine
 from pixelpoint.matching import draw_images_with_circles
 from pixelpoint.matching import match_circles
-from pixelpoint.render import render_paired_images
+from pixelpoint.progress import ProgressHub
+from pixelpoint.progress import ProgressTracker
+from pixelpoint.progress import render_job_events
+from pixelpoint.progress import render_job_statuses
+from pixelpoint.progress import tracker_events
+from pixelpoint.render_queue import RenderQueue
+from pixelpoint.render_queue import RenderQueueFull
+from pixelpoint.render_queue import RenderWorkerPool
+from pixelpoint.render_settings import RENDER_PRESETS
 
 app = FastAPI()
+app.state.drift_monitor = None
+app.state.drift_calibration_key = None
+app.state.superpoint_options = {"model_path": DEFAULT_SUPERPOINT_MODEL}
+app.state.superpoint_batcher = None
+app.state.superpoint_lock = asyncio.Lock()
+app.state.render_options = {"workers": 1, "blender_path": None, "max_pairs_per_job": 1000, "time_limit": None}
+app.state.render_queue = None
+app.state.render_pool = None
+app.state.progress = None
+app.state.artefact_options = {"png_compression": 3, "preview_quality": 85, "writer_queue": 8, "fsync": "never"}
+app.state.artefact_writer = None
+app.state.store_options = {
+    "kind": "local",
+    "root": "artefacts",
+    "bucket": "pixelpoint",
+    "prefix": "",
+    "endpoint_url": None,
+}
+app.state.store = None
 
 ROOT_DIR = Path(__file__).parent
 STATIC_DIR = ROOT_DIR / "static"
 TEMPLATES_DIR = ROOT_DIR / "templates"
 
-ARTEFACTS_DIR = Path().cwd() / "artefacts"
-UPLOAD_IMAGES_PATH = ARTEFACTS_DIR / "camera_images"
-MATCHED_CIRCLES_ON_IMAGES_PATH = ARTEFACTS_DIR / "circle_images"
-RENDERED_IMAGES_BY_OBJECT_PATH = ARTEFACTS_DIR / "rendered_images"
-UPLOAD_CALIBRATION_PATH = ARTEFACTS_DIR / "calibration"
-UPLOAD_MODELS_PATH = ARTEFACTS_DIR / "models"
-UPLOAD_CALIBRATION_PHOTO_PATH = ARTEFACTS_DIR / "calibration_photo"
-
-UPLOAD_IMAGES_PATH.mkdir(exist_ok=True, parents=True)
-UPLOAD_CALIBRATION_PATH.mkdir(exist_ok=True, parents=True)
-UPLOAD_MODELS_PATH.mkdir(exist_ok=True, parents=True)
-UPLOAD_CALIBRATION_PHOTO_PATH.mkdir(exist_ok=True, parents=True)
-MATCHED_CIRCLES_ON_IMAGES_PATH.mkdir(exist_ok=True, parents=True)
-RENDERED_IMAGES_BY_OBJECT_PATH.mkdir(exist_ok=True, parents=True)
+# Options of run-app, passed to every uvicorn worker process through the environment
+SERVER_OPTIONS_ENV = "PIXELPOINT_SERVER_OPTIONS"
+# How long a result request waits for the result of a finished operation written by another worker
+RESULT_WRITE_TIMEOUT = 10.0
+
+# Namespaces of the content-addressed uploads in the artefact store
+UPLOAD_IMAGES = "camera_images"
+UPLOAD_CALIBRATION = "calibration"
+UPLOAD_MODELS = "models"
+UPLOAD_CALIBRATION_PHOTO = "calibration_photo"
+# Key of the active calibration, shared by all workers
+ACTIVE_CALIBRATION_KEY = "calibration/active.json"
 
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 
+def _artefacts_dir() -> Path:
+    return Path(app.state.store_options["root"]).resolve()
+
+
+def _store() -> ArtefactStore:
+    # Created on the first use, so importing the app doesn't create any directories
+    if app.state.store is None:
+        options = app.state.store_options
+        app.state.store = create_artefact_store(
+            options["kind"],
+            _artefacts_dir(),
+            fsync=app.state.artefact_options["fsync"],
+            bucket=options["bucket"],
+            prefix=options["prefix"],
+            endpoint_url=options["endpoint_url"],
+        )
+    return app.state.store
+
+
+def _progress() -> ProgressHub:
+    # Events are saved to the store, so any worker can stream them
+    if app.state.progress is None:
+        app.state.progress = ProgressHub(store=_store())
+    return app.state.progress
+
+
+async def _put_upload(upload: UploadFile, namespace: str) -> str:
+    # Uploads are stored by content, files of concurrent requests with the same name don't overwrite each other
+    data = await upload.read()
+    return await run_in_threadpool(_store().put, data, namespace, Path(upload.filename or "").suffix)
+
+
+@app.on_event("startup")
+def configure_app():
+    options = json.loads(os.environ.get(SERVER_OPTIONS_ENV, "{}"))
+    for name in ("render_options", "artefact_options", "store_options"):
+        getattr(app.state, name).update(options.get(name) or {})
+    if options.get("superpoint_options") is not None:
+        # Load the model before serving, so the first request doesn't pay for it
+        app.state.superpoint_options = options["superpoint_options"]
+        get_superpoint_engine(**app.state.superpoint_options)
+
+
 @app.get("/")
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
@@ -50,12 +150,8 @@ async def read_root(request: Request):
 @app.post("/upload/")
 async def upload_data(image1: UploadFile = File(None), image2: UploadFile = File(None)):
     if image1 and image2:
-        image1_path = UPLOAD_IMAGES_PATH / image1.filename
-        image2_path = UPLOAD_IMAGES_PATH / image2.filename
-        with open(image1_path, "wb") as buffer:
-            buffer.write(await image1.read())
-        with open(image2_path, "wb") as buffer:
-            buffer.write(await image2.read())
+        await _put_upload(image1, UPLOAD_IMAGES)
+        await _put_upload(image2, UPLOAD_IMAGES)
     else:
         return JSONResponse(status_code=422, content={"error": "Images are missing"})
 
@@ -67,9 +163,17 @@ async def upload_calibration(calibration_file: UploadFile = File(...)):
     if not calibration_file.filename.endswith(".json"):
         return JSONResponse(status_code=422, content={"error": "Only JSON files are allowed."})
 
-    calibration_path = UPLOAD_CALIBRATION_PATH / calibration_file.filename
-    with open(calibration_path, "wb") as buffer:
-        buffer.write(await calibration_file.read())
+    calibration_key = await _put_upload(calibration_file, UPLOAD_CALIBRATION)
+
+    # Monitor epipolar error of the processed pairs against the new active calibration
+    calibration_path = await run_in_threadpool(_store().local_path, calibration_key)
+    try:
+        calibration_params = await run_in_threadpool(load_calibration_params, calibration_path)
+    except (ValueError, AttributeError, TypeError) as exc:
+        return JSONResponse(status_code=422, content={"error": f"Invalid calibration file: {exc}"})
+    if "F" in calibration_params:
+        await run_in_threadpool(_store().write, ACTIVE_CALIBRATION_KEY, json.dumps({"key": calibration_key}).encode())
+        await run_in_threadpool(_update_drift_monitor)
 
     return {"result": "Calibration file uploaded successfully."}
 
@@ -90,12 +194,8 @@ async def upload_params(
         return JSONResponse(status_code=422, content={"error": "All fields must be provided."})
 
     if chessboard_image1 and chessboard_image2:
-        chessboard_image1_path = UPLOAD_CALIBRATION_PHOTO_PATH / chessboard_image1.filename
-        chessboard_image2_path = UPLOAD_CALIBRATION_PHOTO_PATH / chessboard_image2.filename
-        with open(chessboard_image1_path, "wb") as buffer:
-            buffer.write(await chessboard_image1.read())
-        with open(chessboard_image2_path, "wb") as buffer:
-            buffer.write(await chessboard_image2.read())
+        chessboard_image1_key = await _put_upload(chessboard_image1, UPLOAD_CALIBRATION_PHOTO)
+        chessboard_image2_key = await _put_upload(chessboard_image2, UPLOAD_CALIBRATION_PHOTO)
     else:
         return JSONResponse(status_code=422, content={"error": "Calibration chessboard images are missing."})
 
@@ -107,78 +207,440 @@ async def upload_params(
         "distance": distance,
         "num_tiles": num_tiles,
         "square_size": square_size,
+        "chessboard_images": [chessboard_image1_key, chessboard_image2_key],
         "result": "Calibration parameters uploaded successfully.",
     }
-    with open(UPLOAD_CALIBRATION_PATH / "calib.json", "w", encoding="utf-8") as f:
-        json.dump(params, f)
-
-
-@app.post("/upload_and_process/")
-async def upload_and_process(image1: UploadFile = File(...), image2: UploadFile = File(...)):
-    if image1 and image2:
-        image1_path = UPLOAD_IMAGES_PATH / image1.filename
-        image2_path = UPLOAD_IMAGES_PATH / image2.filename
-        with open(image1_path, "wb") as buffer:
-            buffer.write(await image1.read())
-        with open(image2_path, "wb") as buffer:
-            buffer.write(await image2.read())
-
-        image_left = plt.imread(image1_path)
-        image_right = plt.imread(image2_path)
+    await run_in_threadpool(_store().put, json.dumps(params).encode(), UPLOAD_CALIBRATION, ".json")
+
+
+def _artefact_writer() -> ArtefactWriter:
+    if app.state.artefact_writer is None:
+        app.state.artefact_writer = ArtefactWriter(max_queue=app.state.artefact_options["writer_queue"], store=_store())
+    return app.state.artefact_writer
+
+
+async def _result_raw_key(op_id: str, name: str) -> Optional[str]:
+    raw_key = result_image_key(op_id, name)
+    if raw_key is None:
+        return None
+    # The result is acknowledged before the writer has saved it, by this or by another worker
+    try:
+        await run_in_threadpool(_artefact_writer().wait, Path(raw_key))
+    except Exception:  # pylint: disable=broad-except
+        return None
+    deadline = time.monotonic() + RESULT_WRITE_TIMEOUT
+    while not await run_in_threadpool(_store().exists, raw_key):
+        events = await run_in_threadpool(_operation_events, op_id)
+        if not events or events[-1]["stage"] != "done" or time.monotonic() > deadline:
+            return None
+        await asyncio.sleep(0.1)
+    return raw_key
+
+
+def _operation_events(op_id: str) -> List[dict]:
+    # Reads the store for operations of other workers, so it's called in the threadpool
+    tracker = _progress().get(op_id)
+    return tracker.events_since(0) if tracker is not None else []
+
+
+def _result_image_urls(op_id: str, name: str) -> dict:
+    return {"name": name, "url": f"/results/{op_id}/{name}", "preview_url": f"/results/{op_id}/{name}/preview"}
+
+
+def _update_drift_monitor() -> Optional[EpipolarDriftMonitor]:
+    # The calibration may be uploaded to another worker, so the active one is looked up in the store
+    try:
+        calibration_key = json.loads(_store().get(ACTIVE_CALIBRATION_KEY))["key"]
+    except ArtefactNotFound:
+        return app.state.drift_monitor
+    if calibration_key != app.state.drift_calibration_key:
+        calibration_params = load_calibration_params(_store().local_path(calibration_key))
+        app.state.drift_monitor = EpipolarDriftMonitor(F=calibration_params["F"])
+        app.state.drift_calibration_key = calibration_key
+    return app.state.drift_monitor
+
+
+def _process_images(tracker: ProgressTracker, image1_data: bytes, image2_data: bytes):
+    # Runs after the response is sent, the client follows the stages at /progress/{op_id}
+    try:
+        image_left = cv2.imdecode(np.frombuffer(image1_data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        image_right = cv2.imdecode(np.frombuffer(image2_data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image_left is None or image_right is None:
+            raise ValueError("Images are invalid or cannot be read.")
+        tracker.emit("decoded", width=image_left.shape[1], height=image_left.shape[0])
 
         circles = match_circles(
             image_left=image_left,
             image_right=image_right,
+            drift_monitor=_update_drift_monitor(),
+            on_stage=tracker.emit,
         )
         draw_image_left, draw_image_right = draw_images_with_circles(
             image_left=image_left,
             image_right=image_right,
             circles=circles,
         )
-        plt.imsave(MATCHED_CIRCLES_ON_IMAGES_PATH / image1_path.name, draw_image_left)
-        plt.imsave(MATCHED_CIRCLES_ON_IMAGES_PATH / image2_path.name, draw_image_right)
+        # Images are written in the background, PNG and previews are encoded on the first request, see /results/
+        _artefact_writer().write(result_image_key(tracker.op_id, "left"), draw_image_left)
+        _artefact_writer().write(result_image_key(tracker.op_id, "right"), draw_image_right)
+        tracker.emit("queued_for_writing")
+
+        tracker.emit(
+            "done",
+            circles=len(circles),
+            images=[_result_image_urls(tracker.op_id, name) for name in ("left", "right")],
+            result=f"Images with circles: /results/{tracker.op_id}/",
+        )
+    except Exception as exc:  # pylint: disable=broad-except
+        tracker.emit("error", error=str(exc))
+
 
-        return {"result": f"Path to saved images with circles: {MATCHED_CIRCLES_ON_IMAGES_PATH.as_posix()}"}
+@app.post("/upload_and_process/")
+async def upload_and_process(
+    background_tasks: BackgroundTasks, image1: UploadFile = File(...), image2: UploadFile = File(...)
+):
+    if image1 and image2:
+        image1_data, image2_data = await image1.read(), await image2.read()
+        for data, upload in ((image1_data, image1), (image2_data, image2)):
+            await run_in_threadpool(_store().put, data, UPLOAD_IMAGES, Path(upload.filename or "").suffix)
+
+        tracker = _progress().create()
+        await run_in_threadpool(tracker.emit, "uploaded")
+        background_tasks.add_task(_process_images, tracker, image1_data, image2_data)
+
+        return {
+            "op_id": tracker.op_id,
+            "progress_url": f"/progress/{tracker.op_id}",
+            "result": f"Processing {tracker.op_id} is started.",
+        }
     return JSONResponse(status_code=422, content={"error": "Images are missing"})
 
 
+@app.get("/results/{op_id}/")
+async def result_images(op_id: str):
+    names = [name for name in ("left", "right") if await _result_raw_key(op_id, name)]
+    if not names:
+        return JSONResponse(status_code=404, content={"error": f"No result images of {op_id}."})
+    return {"images": [_result_image_urls(op_id, name) for name in names]}
+
+
+@app.get("/results/{op_id}/{name}")
+async def result_image(request: Request, op_id: str, name: str):
+    raw_key = await _result_raw_key(op_id, name)
+    if raw_key is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown result image: {op_id}/{name}."})
+
+    # Full resolution PNG is encoded once, on the first request
+    png_key = await run_in_threadpool(encode_png, _store(), raw_key, app.state.artefact_options["png_compression"])
+    png_path = await run_in_threadpool(_store().local_path, png_key)
+    return artefact_response(request, png_path, media_type="image/png", etag=key_etag(png_key))
+
+
+@app.get("/results/{op_id}/{name}/preview")
+async def result_image_preview(
+    request: Request,
+    op_id: str,
+    name: str,
+    max_size: int = Query(1024, ge=64, le=4096),
+    image_format: str = Query("jpg", alias="format"),
+):
+    raw_key = await _result_raw_key(op_id, name)
+    if raw_key is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown result image: {op_id}/{name}."})
+    if image_format not in PREVIEW_FORMATS:
+        return JSONResponse(
+            status_code=422, content={"error": f"Preview format must be one of {list(PREVIEW_FORMATS)}."}
+        )
+
+    preview_key = await run_in_threadpool(
+        encode_preview, _store(), raw_key, max_size, image_format, app.state.artefact_options["preview_quality"]
+    )
+    preview_path = await run_in_threadpool(_store().local_path, preview_key)
+    return artefact_response(
+        request, preview_path, media_type=PREVIEW_FORMATS[image_format][1], etag=key_etag(preview_key)
+    )
+
+
+async def _superpoint_batcher() -> SuperPointBatcher:
+    # Without --superpoint-model the model is loaded by the first request, in the threadpool, so the other connections
+    # aren't blocked, and only once for concurrent first requests
+    async with app.state.superpoint_lock:
+        if app.state.superpoint_batcher is None:
+            engine = await run_in_threadpool(get_superpoint_engine, **app.state.superpoint_options)
+            app.state.superpoint_batcher = SuperPointBatcher(engine)
+    return app.state.superpoint_batcher
+
+
+@app.post("/detect_keypoints/")
+async def detect_keypoints(image1: UploadFile = File(...), image2: UploadFile = File(...)):
+    images = [Image.open(io.BytesIO(await image.read())).convert("RGB") for image in (image1, image2)]
+
+    # Images of concurrent requests are detected together in one batched forward pass
+    batcher = await _superpoint_batcher()
+    image_results = await asyncio.gather(*(run_in_threadpool(batcher.detect, image) for image in images))
+
+    return {
+        "keypoints": [result["keypoints"].tolist() for result in image_results],
+        "scores": [result["scores"].tolist() for result in image_results],
+    }
+
+
+def _render_queue(start_workers: bool = False) -> RenderQueue:
+    # Render workers are started with the first job and restarted if they have exited. Every server process has a pool,
+    # but only the one holding the lock of the spool runs workers
+    if app.state.render_queue is None:
+        app.state.render_queue = RenderQueue(
+            _artefacts_dir() / "render_queue", max_pairs_per_job=app.state.render_options["max_pairs_per_job"]
+        )
+        app.state.render_pool = RenderWorkerPool(
+            app.state.render_queue,
+            workers=app.state.render_options["workers"],
+            blender_path=app.state.render_options["blender_path"],
+        )
+    if start_workers:
+        app.state.render_pool.start()
+    return app.state.render_queue
+
+
+def _submit_render_job(**job) -> str:
+    # Starting the workers and writing the spool block, so it's called in the threadpool
+    return _render_queue(start_workers=True).submit(**job)
+
+
 @app.post("/upload_model/")
-async def upload_model(images_count: str = Form(None), model_file: UploadFile = File(None)):
+async def upload_model(
+    images_count: str = Form(None), model_file: UploadFile = File(None), render_preset: str = Form(None)
+):
     if not images_count or not model_file:
         return JSONResponse(status_code=422, content={"error": "Images count and a model must be provided."})
-
-    model_path = UPLOAD_MODELS_PATH / model_file.filename
-    with open(model_path, "wb") as buffer:
-        buffer.write(await model_file.read())
-
-    output_dir = RENDERED_IMAGES_BY_OBJECT_PATH / model_path.stem
-    for i in range(int(images_count)):
-        render_paired_images(
+    if render_preset is not None and render_preset not in RENDER_PRESETS:
+        return JSONResponse(status_code=422, content={"error": f"Unknown render preset: {render_preset}."})
+    max_pairs = app.state.render_options["max_pairs_per_job"]
+    if not images_count.isdigit() or not 1 <= int(images_count) <= max_pairs:
+        return JSONResponse(status_code=422, content={"error": f"Images count must be from 1 to {max_pairs}."})
+
+    # Blender reads the model from a local file, S3 stores download it to their cache
+    model_key = await _put_upload(model_file, UPLOAD_MODELS)
+    model_path = await run_in_threadpool(_store().local_path, model_key)
+
+    # Rendering runs in the render workers, the request returns as soon as the job is queued. The model key is its
+    # content hash, so the images go to a directory of the job: jobs of the same model don't overwrite each other
+    output_dir = _artefacts_dir() / "rendered_images"
+    try:
+        job_id = await run_in_threadpool(
+            _submit_render_job,
             object_path=model_path,
-            output_dir=output_dir / f"pair_{i}",
+            output_dir=output_dir,
+            num_pairs=int(images_count),
+            render_preset=render_preset,
+            time_limit=app.state.render_options["time_limit"],
         )
+    except RenderQueueFull as exc:
+        return JSONResponse(status_code=429, content={"error": str(exc)})
+
+    return {
+        "job_id": job_id,
+        "progress_url": f"/progress/{job_id}",
+        "images_count": images_count,
+        "result": f"Render job {job_id} is queued, images will be saved to {(output_dir / job_id).as_posix()}",
+    }
+
+
+@app.get("/render_jobs/")
+async def render_jobs():
+    return {"jobs": await run_in_threadpool(_render_queue().jobs)}
+
+
+@app.get("/render_jobs/{job_id}")
+async def render_job_status(job_id: str):
+    status = await run_in_threadpool(_render_queue().status, job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown render job: {job_id}."})
+    return status
+
+
+@app.get("/render_jobs/{job_id}/stream")
+async def render_job_stream(job_id: str):
+    queue = _render_queue()
+    if await run_in_threadpool(queue.status, job_id) is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown render job: {job_id}."})
+
+    # One JSON line per status change, i.e. per rendered pair, until the job is finished. The statuses are polled with
+    # asyncio.sleep, so a viewer doesn't hold a threadpool thread
+    lines = (json.dumps(status) + "\n" async for status in render_job_statuses(queue, job_id))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
+@app.get("/progress/{op_id}")
+async def progress(op_id: str, last_event_id: str = Header(None)):
+    # Stage events of an image processing or a render job as Server-Sent Events
+    last_event = int(last_event_id) if last_event_id is not None and last_event_id.isdigit() else -1
+    tracker = await run_in_threadpool(_progress().get, op_id)
+    if tracker is not None:
+        events = tracker_events(tracker, last_event_id=last_event)
+    elif await run_in_threadpool(_render_queue().status, op_id) is not None:
+        events = render_job_events(_render_queue(), op_id, last_event_id=last_event)
+    else:
+        return JSONResponse(status_code=404, content={"error": f"Unknown operation: {op_id}."})
+
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.delete("/render_jobs/{job_id}")
+async def cancel_render_job(job_id: str):
+    if not await run_in_threadpool(_render_queue().cancel, job_id):
+        return JSONResponse(status_code=404, content={"error": f"No unfinished render job: {job_id}."})
+    return {"result": f"Render job {job_id} is cancelled."}
+
+
+@app.on_event("shutdown")
+def stop_render_workers():
+    if app.state.render_pool is not None:
+        app.state.render_pool.stop()
+
 
-    return {"images_count": images_count, "result": f"Path to rendered images: {output_dir.as_posix()}"}
+@app.on_event("shutdown")
+def close_superpoint_batcher():
+    if app.state.superpoint_batcher is not None:
+        app.state.superpoint_batcher.close()
 
 
+@app.on_event("shutdown")
+def drain_artefact_writer():
+    # Results already acknowledged to the clients are written before the process exits
+    if app.state.artefact_writer is not None:
+        app.state.artefact_writer.close()
+
+
+@app.get("/metrics/")
+async def metrics():
+    drift_monitor = app.state.drift_monitor
+    superpoint_batcher = app.state.superpoint_batcher
+    artefact_writer = app.state.artefact_writer
+    return {
+        "drift": drift_monitor.metrics() if drift_monitor is not None else None,
+        "superpoint_batching": superpoint_batcher.stats() if superpoint_batcher is not None else None,
+        "artefact_writer": artefact_writer.metrics() if artefact_writer is not None else None,
+    }
+
+
+@app.exception_handler(RequestValidationError)
 @app.exception_handler(422)
 async def validation_exception_handler(request, exc):
     del request
-    del exc
 
+    # The fields that failed, without their input values: uploads can't be serialized, and clients know them anyway
+    if isinstance(exc, RequestValidationError):
+        detail = [{"loc": list(error["loc"]), "msg": error["msg"], "type": error["type"]} for error in exc.errors()]
+    else:
+        detail = getattr(exc, "detail", None)
     return JSONResponse(
-        status_code=422, content={"error": "Validation error. Please check all fields and file uploads."}
+        status_code=422,
+        content={"error": "Validation error. Please check all fields and file uploads.", "detail": detail},
     )
 
 
-def run_server(host: str, port: int):
-    uvicorn.run(app, host=host, port=port)
+def run_server(
+    host: str,
+    port: int,
+    superpoint_options: dict = None,
+    render_options: dict = None,
+    artefact_options: dict = None,
+    store_options: dict = None,
+    workers: int = 1,
+):
+    # Workers are separate processes importing the app, they read the options in `configure_app`
+    os.environ[SERVER_OPTIONS_ENV] = json.dumps(
+        {
+            "superpoint_options": superpoint_options,
+            "render_options": render_options,
+            "artefact_options": artefact_options,
+            "store_options": store_options,
+        }
+    )
+    uvicorn.run("pixelpoint.main:app" if workers > 1 else app, host=host, port=port, workers=workers)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", default="0.0.0.0")
     parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--superpoint-model", default=None, help="SuperPoint model id or local directory to load at startup."
+    )
+    parser.add_argument("--superpoint-threads", type=int, default=None, help="Number of intra-op torch threads.")
+    parser.add_argument(
+        "--superpoint-runtime", default="eager", choices=SUPERPOINT_RUNTIMES, help="SuperPoint model runtime."
+    )
+    parser.add_argument(
+        "--superpoint-export-dir", default=None, help="Directory with exported SuperPoint models (superpoint-export)."
+    )
+    parser.add_argument("--render-workers", type=int, default=1, help="Number of render worker processes.")
+    parser.add_argument(
+        "--blender-path", default=None, help="Blender program of the render workers (default: the bpy module)."
+    )
+    parser.add_argument("--max-render-pairs", type=int, default=1000, help="Maximal number of pairs of a render job.")
+    parser.add_argument(
+        "--render-time-limit", type=float, default=None, help="Maximal render time of a job in seconds."
+    )
+    parser.add_argument(
+        "--png-compression",
+        type=int,
+        default=3,
+        choices=range(10),
+        help="zlib level of the full resolution result PNGs, 0 is the fastest.",
+    )
+    parser.add_argument("--preview-quality", type=int, default=85, help="JPEG/WebP quality of the result previews.")
+    parser.add_argument(
+        "--writer-queue", type=int, default=8, help="Maximal number of result images waiting to be written."
+    )
+    parser.add_argument(
+        "--fsync", default="never", choices=FSYNC_POLICIES, help="Fsync policy of the written result images."
+    )
+    parser.add_argument(
+        "--artefacts-dir", default="artefacts", help="Directory of the local artefact store and of the S3 store cache."
+    )
+    parser.add_argument("--artefact-store", default="local", choices=ARTEFACT_STORES, help="Artefact store backend.")
+    parser.add_argument("--s3-bucket", default="pixelpoint", help="Bucket of the S3 artefact store.")
+    parser.add_argument("--s3-prefix", default="", help="Key prefix of the artefacts in the S3 bucket.")
+    parser.add_argument("--s3-endpoint-url", default=None, help="S3 endpoint, e.g. of MinIO (default: AWS).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of server worker processes.")
 
     args = parser.parse_args()
-    run_server(host=args.host, port=args.port)
+
+    superpoint_options = None
+    if args.superpoint_model is not None:
+        superpoint_options = {
+            "model_path": args.superpoint_model,
+            "num_threads": args.superpoint_threads,
+            "runtime": args.superpoint_runtime,
+            "export_dir": args.superpoint_export_dir,
+        }
+    render_options = {
+        "workers": args.render_workers,
+        "blender_path": args.blender_path,
+        "max_pairs_per_job": args.max_render_pairs,
+        "time_limit": args.render_time_limit,
+    }
+    artefact_options = {
+        "png_compression": args.png_compression,
+        "preview_quality": args.preview_quality,
+        "writer_queue": args.writer_queue,
+        "fsync": args.fsync,
+    }
+    store_options = {
+        "kind": args.artefact_store,
+        "root": Path(args.artefacts_dir).resolve().as_posix(),
+        "bucket": args.s3_bucket,
+        "prefix": args.s3_prefix,
+        "endpoint_url": args.s3_endpoint_url,
+    }
+    run_server(
+        host=args.host,
+        port=args.port,
+        superpoint_options=superpoint_options,
+        render_options=render_options,
+        artefact_options=artefact_options,
+        store_options=store_options,
+        workers=args.workers,
+    )
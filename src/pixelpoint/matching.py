@@ -1,12 +1,22 @@
 import argparse
 from pathlib import Path
+from typing import Callable
 from typing import List
 from typing import NamedTuple
+from typing import Optional
 from typing import Tuple
 
 import cv2
 import numpy as np
 
+from pixelpoint.artefact_writer import ENCODERS
+from pixelpoint.artefact_writer import ArtefactWriter
+from pixelpoint.calibration.calibration_utils import load_calibration_params
+from pixelpoint.drift import EpipolarDriftMonitor
+from pixelpoint.drift import sampson_errors
+from pixelpoint.visualization import draw_markers
+from pixelpoint.visualization import match_colors
+
 
 class Circle(NamedTuple):
     idx: int  # circle ID
@@ -14,40 +24,68 @@ class Circle(NamedTuple):
     x: int  # circle coord by width
 
 
-def draw_images_with_circles(image_left: np.ndarray, image_right: np.ndarray, circles: List[Tuple[Circle, Circle]]):
-    draw_image_left = cv2.cvtColor(image_left, cv2.COLOR_GRAY2RGB)
-    draw_image_right = cv2.cvtColor(image_right, cv2.COLOR_GRAY2RGB)
+def draw_images_with_circles(
+    image_left: np.ndarray,
+    image_right: np.ndarray,
+    circles: List[Tuple[Circle, Circle]],
+    scale: float = 1.0,
+    seed: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Every matched pair gets the same color on both images
+    colors = match_colors(len(circles), seed=seed)
+    points_left = np.array([(circle_left.x, circle_left.y) for circle_left, _ in circles], dtype=np.float64)
+    points_right = np.array([(circle_right.x, circle_right.y) for _, circle_right in circles], dtype=np.float64)
+
+    draw_image_left = draw_markers(image_left, points_left, colors, radius=10, thickness=20, scale=scale)
+    draw_image_right = draw_markers(image_right, points_right, colors, radius=10, thickness=20, scale=scale)
+    return draw_image_left, draw_image_right
 
-    for i, (circles_left, circles_right) in enumerate(circles):
-        color_int = np.random.randint(128, 255, 1).item()
-        color = [0 for _ in range(3)]
-        color[i % 3] = color_int
 
-        draw_image_left = cv2.circle(draw_image_left, (circles_left.x, circles_left.y), 10, color, 20)
-        draw_image_right = cv2.circle(draw_image_right, (circles_right.x, circles_right.y), 10, color, 20)
+def match_circles(
+    image_left: np.ndarray,
+    image_right: np.ndarray,
+    drift_monitor: Optional[EpipolarDriftMonitor] = None,
+    on_stage: Optional[Callable[..., None]] = None,
+) -> List[Tuple[Circle, Circle]]:
+    """
+    Detect circles on the left image and map them to the right image with the SIFT homography.
 
-    return draw_image_left, draw_image_right
+    `on_stage(stage, **data)` is called at the end of every stage ("keypoints_detected", "homography_found",
+    "circles_detected" and "circles_matched") with the stage results, e.g. to report progress.
 
+    """
+    on_stage = on_stage or _ignore_stage
 
-def match_circles(image_left: np.ndarray, image_right: np.ndarray) -> List[Tuple[Circle, Circle]]:
     # Find homography between the two images
-    homography_matrix = _find_homography_sift(image_left, image_right)
+    homography_matrix = _find_homography_sift(image_left, image_right, drift_monitor=drift_monitor, on_stage=on_stage)
 
     # Detect circles in the left image
     circles_left = _detect_circles(image_left)
+    on_stage("circles_detected", circles=len(circles_left))
 
     # Map detected circles to the right image using the homography
     circles_right = _map_circles_homography(circles_left, homography_matrix)
+    on_stage("circles_matched", circles=len(circles_right))
 
     return list(zip(circles_left, circles_right))
 
 
+def _ignore_stage(stage: str, **data):
+    del stage, data
+
+
 # pylint: disable=too-many-locals
-def _find_homography_sift(image_left: np.ndarray, image_right: np.ndarray) -> np.ndarray:
+def _find_homography_sift(
+    image_left: np.ndarray,
+    image_right: np.ndarray,
+    drift_monitor: Optional[EpipolarDriftMonitor] = None,
+    on_stage: Callable[..., None] = _ignore_stage,
+) -> np.ndarray:
     # Step 1: Detect keypoints and descriptors using SIFT
     sift = cv2.SIFT_create()
     kp_left, des_left = sift.detectAndCompute(image_left, None)
     kp_right, des_right = sift.detectAndCompute(image_right, None)
+    on_stage("keypoints_detected", keypoints_left=len(kp_left), keypoints_right=len(kp_right))
 
     # Step 2: Match descriptors using FLANN-based matcher
     flann_index_kdtree = 1
@@ -71,7 +109,18 @@ def _find_homography_sift(image_left: np.ndarray, image_right: np.ndarray) -> np
     dst_pts = np.array([kp_right[m.trainIdx].pt for m in good_matches], dtype=np.float32).reshape((-1, 1, 2))
 
     # Compute the homography matrix using RANSAC
-    homography_matrix, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+    homography_matrix, inliers_mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+    on_stage(
+        "homography_found",
+        matches=len(good_matches),
+        inliers=int(inliers_mask.sum()) if inliers_mask is not None else 0,
+    )
+
+    # Check the RANSAC inliers against the epipolar geometry of the active calibration
+    if drift_monitor is not None and inliers_mask is not None:
+        inliers = inliers_mask.ravel().astype(bool)
+        drift_monitor.update(src_pts[inliers], dst_pts[inliers])
+
     return homography_matrix
 
 
@@ -102,13 +151,175 @@ def _map_circles_homography(circles_left: List[Circle], homography_matrix: np.nd
     return circles_right
 
 
-def main():
-    np.random.seed(42)
+class CircleTracker:
+    """
+    Track matched circles over consecutive stereo frames with pyramidal Lucas-Kanade optical flow.
+
+    The first frame is matched with `match_circles`, then the circle centers are propagated in both views: every circle
+    is tracked on a patch of `search_radius` pixels around it, so the cost doesn't depend on the frame size. A track is
+    lost when the flow isn't found, the forward-backward flow error exceeds `max_flow_error` pixels or, with `F`, the
+    epipolar error of the pair grows by more than `max_epipolar_error` pixels since the detection. The circles are
+    detected again when less than `min_tracked` of the tracks survive, and every `redetect_interval` frames if it's
+    set, so new circles are found too.
+
+    Parameters
+    ----------
+    drift_monitor : EpipolarDriftMonitor, optional
+        Monitor updated on full detections, see `match_circles`.
+    F : np.ndarray, optional
+        Fundamental matrix of the pair to check the tracked circles against.
+    search_radius : int
+        Maximal motion of a circle between two frames in pixels.
+    win_size : int
+        Side of the Lucas-Kanade window. The inside of a circle is uniform, so the window must cover the circle border:
+        it's larger than the diameter of the largest circle detected by `match_circles`.
+    max_level : int
+        Number of pyramid levels above the patch.
+
+    """
+
+    def __init__(
+        self,
+        drift_monitor: Optional[EpipolarDriftMonitor] = None,
+        F: Optional[np.ndarray] = None,
+        search_radius: int = 64,
+        win_size: int = 171,
+        max_level: int = 2,
+        max_flow_error: float = 1.0,
+        max_epipolar_error: float = 2.0,
+        min_tracked: float = 0.8,
+        redetect_interval: Optional[int] = None,
+    ):
+        self.drift_monitor = drift_monitor
+        self.F = None if F is None else np.asarray(F, dtype=np.float64)
+        self.search_radius = search_radius
+        self.win_size = win_size
+        self.max_level = max_level
+        self.max_flow_error = max_flow_error
+        self.max_epipolar_error = max_epipolar_error
+        self.min_tracked = min_tracked
+        self.redetect_interval = redetect_interval
+        self._criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+        self._stats = {"frames": 0, "detections": 0, "lost_tracks": 0}
+        # Tracks of the last frame, set by `reset`
+        self._images: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._ids: Optional[np.ndarray] = None
+        self._points_left: Optional[np.ndarray] = None
+        self._points_right: Optional[np.ndarray] = None
+        self._detected_errors: Optional[np.ndarray] = None
+        self._frames_since_detection = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the tracks, the next frame is matched with `match_circles`."""
+        self._images = None
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._points_left = np.zeros((0, 2), dtype=np.float32)
+        self._points_right = np.zeros((0, 2), dtype=np.float32)
+        self._detected_errors = np.zeros(0)
+        self._frames_since_detection = 0
+
+    def update(self, image_left: np.ndarray, image_right: np.ndarray) -> List[Tuple[Circle, Circle]]:
+        """Matched circles of the next grayscale frame, tracked from the previous one or detected again."""
+        self._stats["frames"] += 1
+        redetect_due = self.redetect_interval is not None and self._frames_since_detection >= self.redetect_interval
+        if self._images is not None and len(self._ids) and not redetect_due and self._track(image_left, image_right):
+            self._frames_since_detection += 1
+        else:
+            self._detect(image_left, image_right)
+        self._images = (image_left, image_right)
+
+        return [
+            (
+                Circle(idx=int(idx), x=int(round(left[0])), y=int(round(left[1]))),
+                Circle(idx=int(idx), x=int(round(right[0])), y=int(round(right[1]))),
+            )
+            for idx, left, right in zip(self._ids, self._points_left, self._points_right)
+        ]
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["tracked_frames"] = stats["frames"] - stats["detections"]
+        return stats
+
+    def _detect(self, image_left: np.ndarray, image_right: np.ndarray):
+        circles = match_circles(image_left, image_right, drift_monitor=self.drift_monitor)
+        self._ids = np.array([left.idx for left, _ in circles], dtype=np.int64)
+        self._points_left = np.array([(left.x, left.y) for left, _ in circles], dtype=np.float32).reshape(-1, 2)
+        self._points_right = np.array([(right.x, right.y) for _, right in circles], dtype=np.float32).reshape(-1, 2)
+        # The homography maps the circles only approximately, the tracks are checked against the error they start with
+        self._detected_errors = (
+            sampson_errors(self.F, self._points_left, self._points_right)
+            if self.F is not None
+            else np.zeros(len(circles))
+        )
+        self._frames_since_detection = 0
+        self._stats["detections"] += 1
+
+    def _track(self, image_left: np.ndarray, image_right: np.ndarray) -> bool:
+        tracked_left, points_left = self._track_view(self._images[0], image_left, self._points_left)
+        tracked_right, points_right = self._track_view(self._images[1], image_right, self._points_right)
+        tracked = tracked_left & tracked_right
+        if self.F is not None and tracked.any():
+            errors = sampson_errors(self.F, points_left[tracked], points_right[tracked])
+            tracked[tracked] = errors <= self._detected_errors[tracked] + self.max_epipolar_error
+
+        self._stats["lost_tracks"] += int((~tracked).sum())
+        if not tracked.any() or tracked.sum() < self.min_tracked * len(tracked):
+            return False
+        self._ids = self._ids[tracked]
+        self._detected_errors = self._detected_errors[tracked]
+        self._points_left, self._points_right = points_left[tracked], points_right[tracked]
+        return True
+
+    def _track_view(self, previous: np.ndarray, image: np.ndarray, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Every point is tracked on its own patch, the pyramids of the whole frames are never built
+        half_size = self.search_radius + self.win_size // 2 + 1
+        height, width = image.shape[:2]
+        tracked = np.zeros(len(points), dtype=bool)
+        new_points = points.copy()
+        for i, (x, y) in enumerate(points):
+            x0, y0 = max(int(x) - half_size, 0), max(int(y) - half_size, 0)
+            x1, y1 = min(int(x) + half_size + 1, width), min(int(y) + half_size + 1, height)
+            if x1 - x0 <= self.win_size or y1 - y0 <= self.win_size:
+                continue
+            previous_patch, patch = previous[y0:y1, x0:x1], image[y0:y1, x0:x1]
+            point = np.array([[[x - x0, y - y0]]], dtype=np.float32)
+
+            flow_options = {
+                "winSize": (self.win_size, self.win_size),
+                "maxLevel": self.max_level,
+                "criteria": self._criteria,
+            }
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(previous_patch, patch, point, None, **flow_options)
+            if not status[0, 0]:
+                continue
+            # Tracking back to the previous frame must return to the start point
+            back, status_back, _ = cv2.calcOpticalFlowPyrLK(patch, previous_patch, moved, None, **flow_options)
+            if not status_back[0, 0] or np.linalg.norm(back - point) > self.max_flow_error:
+                continue
+
+            moved_x, moved_y = moved[0, 0]
+            if 0 <= moved_x < x1 - x0 and 0 <= moved_y < y1 - y0:
+                new_points[i] = (moved_x + x0, moved_y + y0)
+                tracked[i] = True
+        return tracked, new_points
 
+
+def main():
     parser = argparse.ArgumentParser(description="Match circles on paired images.")
     parser.add_argument("--left-image-path", type=str, required=True, help="")
     parser.add_argument("--right-image-path", type=str, required=True, help="")
     parser.add_argument("--output-dir", type=str, required=True, help="Directory to save images with visualization.")
+    parser.add_argument(
+        "--calibration-file", type=str, default=None, help="Calibration JSON file to report the epipolar error against."
+    )
+    parser.add_argument(
+        "--preview-scale", type=float, default=1.0, help="Scale of the saved images, e.g. 0.25 for previews."
+    )
+    parser.add_argument("--image-format", default="png", choices=ENCODERS, help="Format of the saved images.")
+    parser.add_argument("--png-compression", type=int, default=3, help="zlib level of PNG, 0 is the fastest.")
+    parser.add_argument("--jpeg-quality", type=int, default=95, help="Quality of JPEG images.")
     args = parser.parse_args()
 
     image_left = cv2.imread(args.left_image_path)
@@ -117,20 +328,30 @@ def main():
     image_right = cv2.imread(args.right_image_path)
     image_right = cv2.cvtColor(image_right, cv2.COLOR_BGR2GRAY)
 
-    matches = match_circles(image_left=image_left, image_right=image_right)
+    drift_monitor = None
+    if args.calibration_file is not None:
+        drift_monitor = EpipolarDriftMonitor(F=load_calibration_params(args.calibration_file)["F"], min_pairs=1)
 
-    draw_image_left = cv2.cvtColor(image_left, cv2.COLOR_GRAY2RGB)
-    draw_image_right = cv2.cvtColor(image_right, cv2.COLOR_GRAY2RGB)
+    matches = match_circles(image_left=image_left, image_right=image_right, drift_monitor=drift_monitor)
 
-    for i, (matches_left, matches_right) in enumerate(matches):
-        color_int = np.random.randint(128, 255, 1).item()
-        color = [0 for _ in range(3)]
-        color[i % 3] = color_int
+    if drift_monitor is not None:
+        # The monitor records nothing when the homography has no inliers
+        last_error = drift_monitor.metrics().get("last_error_px")
+        if last_error is None:
+            print("Median epipolar error: no inliers")
+        else:
+            print(f"Median epipolar error: {last_error:.3f} px")
 
-        draw_image_left = cv2.circle(draw_image_left, (matches_left.x, matches_left.y), 10, color, 20)
-        draw_image_right = cv2.circle(draw_image_right, (matches_right.x, matches_right.y), 10, color, 20)
+    draw_image_left, draw_image_right = draw_images_with_circles(
+        image_left, image_right, matches, scale=args.preview_scale, seed=42
+    )
 
+    # Both images are encoded in parallel, the writer is drained when the block exits
     output_dir = Path(args.output_dir)
-    output_dir.mkdir(exist_ok=True, parents=True)
-    cv2.imwrite((output_dir / "image_left.png").as_posix(), draw_image_left)
-    cv2.imwrite((output_dir / "image_right.png").as_posix(), draw_image_right)
+    with ArtefactWriter(workers=2, png_compression=args.png_compression, quality=args.jpeg_quality) as writer:
+        written = [
+            writer.write(output_dir / f"image_{side}.{args.image_format}", image)
+            for side, image in (("left", draw_image_left), ("right", draw_image_right))
+        ]
+    for future in written:
+        future.result()
@@ -0,0 +1,573 @@
+import argparse
+import functools
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from pixelpoint.artefact_writer import ENCODERS
+from pixelpoint.artefact_writer import encode_artefact
+from pixelpoint.artefact_writer import write_file_atomic
+from pixelpoint.calibration.calibration_utils import load_calibration_params
+from pixelpoint.drift import EpipolarDriftMonitor
+from pixelpoint.drift import sampson_errors
+from pixelpoint.matching import CircleTracker
+from pixelpoint.matching import draw_images_with_circles
+from pixelpoint.matching import match_circles
+
+"""
+Pipelined processing of a stream of stereo frames.
+
+Frames come from a directory being filled with pairs or from a pair of video files and pass through the stages
+decode -> match -> measure -> write. Every stage is a generator of frames running in its own threads, the stages are
+connected by bounded queues: a slow stage fills its input queue and blocks the stages before it, so at most
+`queue_size` frames wait between two stages. OpenCV releases the GIL in decoding, SIFT, Hough detection and encoding,
+so the stages of different frames run in parallel in one process.
+
+The report has the sustained frame rate and, for every stage, the utilization: the share of the time its threads
+processed frames, instead of waiting for input (starved) or for space in the next queue (blocked). The stage with the
+highest utilization is the bottleneck; more workers of it (`--match-workers`) raise the frame rate.
+
+"""
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp")
+
+
+class StereoFrame(NamedTuple):
+    index: int  # frame number in the stream
+    name: str  # name of the output files
+    left: Any  # image path before decoding, grayscale image after it, None after writing
+    right: Any
+    created: float  # time.perf_counter() when the frame was read from the source
+    circles: Optional[list] = None  # matched circles from `match_circles`
+    measurement: Optional[dict] = None
+    error: Optional[str] = None  # the frame is passed to the writer without processing if set
+
+
+class Stage(NamedTuple):
+    name: str
+    function: Callable[[Iterator[StereoFrame]], Iterator[StereoFrame]]  # generator of output frames
+    workers: int = 1  # number of threads running the generator on the same input queue
+
+
+class _StageStats:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.items = 0
+        self.wall = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.lock = threading.Lock()
+
+    def report(self, elapsed: float) -> dict:
+        busy = max(self.wall - self.starved - self.blocked, 0.0)
+        return {
+            "workers": self.workers,
+            "frames": self.items,
+            "busy_s": busy,
+            "starved_s": self.starved,
+            "blocked_s": self.blocked,
+            "utilization": busy / max(elapsed * self.workers, 1e-9),
+            "time_per_frame_ms": busy / self.items * 1000 if self.items else None,
+        }
+
+
+class _Aborted(Exception):
+    pass
+
+
+_END = object()
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues.
+
+    Parameters
+    ----------
+    stages : list[Stage]
+        Stages in the processing order, every one gets the output frames of the previous one.
+    queue_size : int
+        Maximal number of frames waiting in front of every stage.
+    stop_event : threading.Event
+        Stops reading the source when set, the frames already read are processed to the end.
+
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 4, stop_event: Optional[threading.Event] = None):
+        if queue_size < 1 or any(stage.workers < 1 for stage in stages):
+            raise ValueError("Queue size and number of workers must be positive")
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stop_event = stop_event or threading.Event()
+        self._abort = threading.Event()
+        self._errors: List[BaseException] = []
+
+    def run(self, source: Iterable[StereoFrame], on_frame: Optional[Callable[[StereoFrame], None]] = None) -> dict:
+        """Process all frames of the source, call `on_frame` with every written frame and return the report."""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        source_stats = _StageStats(workers=1)
+        stats = [_StageStats(stage.workers) for stage in self.stages]
+        threads = [threading.Thread(target=self._read_source, args=(source, queues[0], source_stats), name="source")]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            threads += [
+                threading.Thread(
+                    target=self._run_stage,
+                    args=(stage, queues[i], queues[i + 1], stats[i], remaining),
+                    name=f"{stage.name}-{worker}",
+                )
+                for worker in range(stage.workers)
+            ]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        completed, latencies = [], []
+        try:
+            while True:
+                try:
+                    frame = self._get(queues[-1])
+                    if frame is _END:
+                        break
+                    completed.append(time.perf_counter() - start)
+                    latencies.append(time.perf_counter() - frame.created)
+                    if on_frame is not None:
+                        on_frame(frame)
+                except _Aborted:
+                    break
+                except KeyboardInterrupt:
+                    # The first Ctrl+C stops reading the source and the frames in the queues are still processed,
+                    # the second one aborts
+                    if self.stop_event.is_set():
+                        raise
+                    self.stop_event.set()
+        except BaseException:
+            self._abort.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+        elapsed = time.perf_counter() - start
+        # The first frame passes all stages alone, the sustained rate is measured after it when the stages overlap
+        sustained_fps = (len(completed) - 1) / (completed[-1] - completed[0]) if len(completed) > 2 else None
+        stage_reports = {stage.name: stats[i].report(elapsed) for i, stage in enumerate(self.stages)}
+        return {
+            "frames": len(completed),
+            "elapsed_s": elapsed,
+            "fps": len(completed) / elapsed if elapsed > 0 else None,
+            "sustained_fps": sustained_fps,
+            "latency_ms": (
+                {
+                    "p50": float(np.percentile(latencies, 50)) * 1000,
+                    "p95": float(np.percentile(latencies, 95)) * 1000,
+                    "max": float(np.max(latencies)) * 1000,
+                }
+                if latencies
+                else {}
+            ),
+            # Waiting for new files, or decoding of videos, which happens in the source
+            "source_s": source_stats.wall - source_stats.blocked,
+            "stages": stage_reports,
+            "bottleneck": max(stage_reports, key=lambda name: stage_reports[name]["utilization"], default=None),
+        }
+
+    def _read_source(self, source: Iterable[StereoFrame], output: queue.Queue, stats: _StageStats):
+        start = time.perf_counter()
+        try:
+            for frame in source:
+                blocked = time.perf_counter()
+                self._put(output, frame)
+                stats.blocked += time.perf_counter() - blocked
+                stats.items += 1
+                if self.stop_event.is_set():
+                    break
+            self._put(output, _END)
+        except _Aborted:
+            pass
+        except BaseException as exc:  # pylint: disable=broad-except
+            self._fail(exc)
+        finally:
+            stats.wall = time.perf_counter() - start
+
+    def _run_stage(self, stage: Stage, input_queue, output_queue, stats: _StageStats, remaining: List[int]):
+        start = time.perf_counter()
+        starved = blocked = 0.0
+        items = 0
+
+        def frames() -> Iterator[StereoFrame]:
+            nonlocal starved
+            while True:
+                waiting = time.perf_counter()
+                frame = self._get(input_queue)
+                starved += time.perf_counter() - waiting
+                if frame is _END:
+                    # The other workers of the stage stop on the same marker
+                    input_queue.put(_END)
+                    return
+                yield frame
+
+        try:
+            for frame in stage.function(frames()):
+                waiting = time.perf_counter()
+                self._put(output_queue, frame)
+                blocked += time.perf_counter() - waiting
+                items += 1
+            with stats.lock:
+                remaining[0] -= 1
+                last_worker = remaining[0] == 0
+            if last_worker:
+                self._put(output_queue, _END)
+        except _Aborted:
+            pass
+        except BaseException as exc:  # pylint: disable=broad-except
+            self._fail(exc)
+        finally:
+            with stats.lock:
+                stats.wall += time.perf_counter() - start
+                stats.starved += starved
+                stats.blocked += blocked
+                stats.items += items
+
+    def _get(self, input_queue: queue.Queue):
+        # Waits in short steps, so all threads stop soon after an error in any stage
+        while True:
+            if self._abort.is_set():
+                raise _Aborted
+            try:
+                return input_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _put(self, output_queue: queue.Queue, item):
+        while True:
+            if self._abort.is_set():
+                raise _Aborted
+            try:
+                output_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _fail(self, exc: BaseException):
+        self._errors.append(exc)
+        self._abort.set()
+
+
+def directory_frames(
+    input_dir: Path,
+    follow: bool = False,
+    poll_interval: float = 0.5,
+    idle_timeout: Optional[float] = None,
+    stop_event: Optional[threading.Event] = None,
+) -> Iterator[StereoFrame]:
+    """
+    Stereo pairs of a directory, e.g. `render-cli` output or `cam_left_0001.png` and `cam_right_0001.png`.
+
+    A pair is an image with "left" in its name and the image in the same directory with the last "left" replaced by
+    "right". With `follow` the directory is polled for new pairs until `stop_event` is set or no new pair appears for
+    `idle_timeout` seconds; a pair is taken when the sizes of both files didn't change since the previous poll, so
+    files that are still being written are skipped. Hidden files, e.g. temporary files of atomic writes, are ignored.
+
+    """
+    input_dir = Path(input_dir)
+    stop_event = stop_event or threading.Event()
+    taken, previous_sizes = set(), {}
+    index = 0
+    last_frame = time.monotonic()
+    while True:
+        sizes = {}
+        for left_path in sorted(input_dir.rglob("*left*")):
+            if left_path in taken or left_path.name.startswith(".") or left_path.suffix.lower() not in IMAGE_SUFFIXES:
+                continue
+            position = left_path.name.rfind("left")
+            right_path = left_path.with_name(left_path.name[:position] + "right" + left_path.name[position + 4 :])
+            if not right_path.is_file():
+                continue
+            sizes[left_path] = (left_path.stat().st_size, right_path.stat().st_size)
+            if follow and previous_sizes.get(left_path) != sizes[left_path]:
+                continue
+
+            taken.add(left_path)
+            # Output name of the pair: its path without "left", e.g. pair_0001_image or cam_0001
+            stem = left_path.stem[:position].rstrip("_-.") + left_path.stem[position + 4 :]
+            name = left_path.parent.relative_to(input_dir).joinpath(stem or f"{index:06d}").as_posix()
+            name = name.replace("/", "_").lstrip("._")
+            yield StereoFrame(index, name, left_path, right_path, time.perf_counter())
+            index += 1
+            last_frame = time.monotonic()
+        previous_sizes = sizes
+
+        if not follow or stop_event.is_set():
+            return
+        if idle_timeout is not None and time.monotonic() - last_frame > idle_timeout:
+            return
+        stop_event.wait(poll_interval)
+
+
+def video_frames(
+    left_video: Path, right_video: Path, stop_event: Optional[threading.Event] = None
+) -> Iterator[StereoFrame]:
+    """Synchronized frames of two video files, until the shorter one ends. Frames are decoded here, in the source."""
+    capture_left, capture_right = cv2.VideoCapture(str(left_video)), cv2.VideoCapture(str(right_video))
+    try:
+        if not capture_left.isOpened() or not capture_right.isOpened():
+            raise ValueError(f"Videos {left_video}, {right_video} can't be opened.")
+        index = 0
+        while stop_event is None or not stop_event.is_set():
+            ok_left, image_left = capture_left.read()
+            ok_right, image_right = capture_right.read()
+            if not ok_left or not ok_right:
+                return
+            yield StereoFrame(index, f"frame_{index:06d}", image_left, image_right, time.perf_counter())
+            index += 1
+    finally:
+        capture_left.release()
+        capture_right.release()
+
+
+def decode_stage(frames: Iterator[StereoFrame]) -> Iterator[StereoFrame]:
+    """Read image files, or convert decoded video frames, to grayscale."""
+    for frame in frames:
+        images = []
+        for image in (frame.left, frame.right):
+            if isinstance(image, Path):
+                image = cv2.imread(str(image), cv2.IMREAD_GRAYSCALE)
+            elif image.ndim == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            images.append(image)
+        if images[0] is None or images[1] is None:
+            yield frame._replace(error=f"Images of {frame.name} can't be read.")
+        else:
+            yield frame._replace(left=images[0], right=images[1])
+
+
+def match_stage(
+    frames: Iterator[StereoFrame],
+    drift_monitor: Optional[EpipolarDriftMonitor] = None,
+    tracker: Optional[CircleTracker] = None,
+) -> Iterator[StereoFrame]:
+    """
+    Match circles with `match_circles`, or track them from the previous frame with `tracker`, which needs the frames
+    in order: one worker of this stage and of the stages before it. A pair without enough matches is reported, not
+    fatal for the stream.
+
+    """
+    for frame in frames:
+        if frame.error is not None:
+            yield frame
+            continue
+        try:
+            if tracker is not None:
+                circles = tracker.update(frame.left, frame.right)
+            else:
+                circles = match_circles(frame.left, frame.right, drift_monitor=drift_monitor)
+        except (ValueError, cv2.error) as exc:
+            if tracker is not None:
+                tracker.reset()
+            yield frame._replace(error=str(exc))
+            continue
+        yield frame._replace(circles=circles)
+
+
+def measure_stage(frames: Iterator[StereoFrame], calibration: Optional[dict] = None) -> Iterator[StereoFrame]:
+    """
+    Measure the matched circles: disparity in pixels and, with a calibration, the epipolar error of the pair and the
+    3D points triangulated in the left camera coordinates, in the units of the calibration translation.
+
+    """
+    projection_left, projection_right = None, None
+    if calibration is not None:
+        projection_left = calibration["CM"] @ np.hstack([np.eye(3), np.zeros((3, 1))])
+        projection_right = calibration["CM"] @ np.hstack([calibration["R"], calibration["T"].reshape(3, 1)])
+
+    for frame in frames:
+        if frame.error is not None:
+            yield frame
+            continue
+        points_left = np.array([(left.x, left.y) for left, _ in frame.circles], dtype=np.float64).reshape(-1, 2)
+        points_right = np.array([(right.x, right.y) for _, right in frame.circles], dtype=np.float64).reshape(-1, 2)
+        circles = [
+            {"idx": left.idx, "left": [left.x, left.y], "right": [right.x, right.y], "disparity_px": left.x - right.x}
+            for left, right in frame.circles
+        ]
+        measurement = {"circles": circles}
+
+        if calibration is not None and len(circles):
+            points = cv2.triangulatePoints(projection_left, projection_right, points_left.T, points_right.T)
+            points = (points[:3] / points[3]).T
+            for circle, point in zip(circles, points):
+                circle["point"] = point.tolist()
+            measurement["epipolar_error_px"] = float(
+                np.median(sampson_errors(calibration["F"], points_left, points_right))
+            )
+        yield frame._replace(measurement=measurement)
+
+
+def write_stage(
+    frames: Iterator[StereoFrame],
+    output_dir: Path,
+    draw: bool = False,
+    preview_scale: float = 1.0,
+    image_format: str = "jpg",
+    png_compression: int = 3,
+    quality: int = 95,
+) -> Iterator[StereoFrame]:
+    """Write the measurement of every frame as JSON and, with `draw`, the images with the circles."""
+    output_dir = Path(output_dir)
+    for frame in frames:
+        result = {"index": frame.index, "name": frame.name, "error": frame.error}
+        if frame.measurement is not None:
+            result.update(frame.measurement)
+        write_file_atomic(output_dir / f"{frame.name}.json", encode_artefact(result, ".json"))
+
+        if draw and frame.error is None:
+            draw_image_left, draw_image_right = draw_images_with_circles(
+                frame.left, frame.right, frame.circles, scale=preview_scale, seed=42
+            )
+            for side, image in (("left", draw_image_left), ("right", draw_image_right)):
+                encoded = encode_artefact(image, f".{image_format}", png_compression=png_compression, quality=quality)
+                write_file_atomic(output_dir / f"{frame.name}_{side}.{image_format}", encoded)
+
+        # Images are not needed after the last stage
+        yield frame._replace(left=None, right=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Match and measure circles on a stream of stereo frames.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", type=Path, help="Directory with stereo pairs, see --follow.")
+    source.add_argument("--left-video", type=Path, help="Video of the left camera, requires --right-video.")
+    parser.add_argument("--right-video", type=Path, default=None, help="Video of the right camera.")
+    parser.add_argument(
+        "--follow", action="store_true", help="Wait for new pairs in --input-dir until Ctrl+C or --idle-timeout."
+    )
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between scans of --input-dir.")
+    parser.add_argument(
+        "--idle-timeout", type=float, default=None, help="Stop following after this many seconds without new pairs."
+    )
+    parser.add_argument("--output-dir", type=Path, required=True, help="Directory to write the results to.")
+    parser.add_argument(
+        "--calibration-file", type=str, default=None, help="Calibration JSON to triangulate the circles with."
+    )
+    parser.add_argument("--queue-size", type=int, default=4, help="Maximal number of frames between two stages.")
+    parser.add_argument("--decode-workers", type=int, default=1, help="Number of decoding threads.")
+    parser.add_argument(
+        "--match-workers", type=int, default=None, help="Number of matching threads (default: 2, 1 with --track)."
+    )
+    parser.add_argument(
+        "--track",
+        action="store_true",
+        help="Track the circles between frames with optical flow, match them again only when tracks are lost.",
+    )
+    parser.add_argument(
+        "--redetect-interval", type=int, default=None, help="With --track, also match the circles every N frames."
+    )
+    parser.add_argument("--write-workers", type=int, default=1, help="Number of writing threads.")
+    parser.add_argument("--draw", action="store_true", help="Also write the images with the circles.")
+    parser.add_argument("--preview-scale", type=float, default=0.25, help="Scale of the images written with --draw.")
+    parser.add_argument("--image-format", default="jpg", choices=ENCODERS, help="Format of the images.")
+    parser.add_argument("--png-compression", type=int, default=3, help="zlib level of PNG, 0 is the fastest.")
+    parser.add_argument("--jpeg-quality", type=int, default=95, help="Quality of JPEG images.")
+    parser.add_argument(
+        "--report-file", type=Path, default=None, help="Path to the JSON report (default: <output-dir>/report.json)."
+    )
+    args = parser.parse_args()
+    if args.left_video is not None and args.right_video is None:
+        parser.error("--left-video requires --right-video")
+    if args.track and (args.decode_workers > 1 or (args.match_workers or 1) > 1):
+        parser.error("--track needs the frames in order, use one decode and match worker")
+    match_workers = args.match_workers or (1 if args.track else 2)
+
+    stop_event = threading.Event()
+    if args.input_dir is not None:
+        frames = directory_frames(
+            args.input_dir,
+            follow=args.follow,
+            poll_interval=args.poll_interval,
+            idle_timeout=args.idle_timeout,
+            stop_event=stop_event,
+        )
+    else:
+        frames = video_frames(args.left_video, args.right_video, stop_event=stop_event)
+
+    calibration, drift_monitor = None, None
+    if args.calibration_file is not None:
+        calibration = load_calibration_params(args.calibration_file)
+        drift_monitor = EpipolarDriftMonitor(F=calibration["F"])
+    tracker = None
+    if args.track:
+        tracker = CircleTracker(
+            drift_monitor=drift_monitor,
+            F=calibration["F"] if calibration is not None else None,
+            redetect_interval=args.redetect_interval,
+        )
+
+    write = functools.partial(
+        write_stage,
+        output_dir=args.output_dir,
+        draw=args.draw,
+        preview_scale=args.preview_scale,
+        image_format=args.image_format,
+        png_compression=args.png_compression,
+        quality=args.jpeg_quality,
+    )
+    pipeline = Pipeline(
+        [
+            Stage("decode", decode_stage, workers=args.decode_workers),
+            Stage(
+                "match",
+                functools.partial(match_stage, drift_monitor=drift_monitor, tracker=tracker),
+                workers=match_workers,
+            ),
+            Stage("measure", functools.partial(measure_stage, calibration=calibration)),
+            Stage("write", write, workers=args.write_workers),
+        ],
+        queue_size=args.queue_size,
+        stop_event=stop_event,
+    )
+
+    def on_frame(frame: StereoFrame):
+        status = frame.error or f"{len(frame.measurement['circles'])} circles"
+        print(f"{frame.index}: {frame.name}: {status}")
+
+    report = pipeline.run(frames, on_frame=on_frame)
+    if drift_monitor is not None:
+        report["drift"] = drift_monitor.metrics()
+    if tracker is not None:
+        report["tracking"] = tracker.stats()
+
+    print(f"{report['frames']} frames in {report['elapsed_s']:.1f} s")
+    if report["sustained_fps"] is not None:
+        print(f"Sustained frame rate: {report['sustained_fps']:.2f} fps")
+    for name, stage in report["stages"].items():
+        print(
+            f"{name}: utilization {stage['utilization']:.0%} of {stage['workers']} workers, "
+            f"starved {stage['starved_s']:.1f} s, blocked {stage['blocked_s']:.1f} s"
+        )
+    print(f"Bottleneck: {report['bottleneck']}")
+
+    report_file = args.report_file or args.output_dir / "report.json"
+    report_file.parent.mkdir(exist_ok=True, parents=True)
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Pipeline report saved to {report_file}")
+
+
+if __name__ == "__main__":
+    main()
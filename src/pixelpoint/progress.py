@@ -0,0 +1,248 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Union
+
+from starlette.concurrency import run_in_threadpool
+
+from pixelpoint.artefact_store import ArtefactNotFound
+from pixelpoint.artefact_store import ArtefactStore
+from pixelpoint.render_queue import FINAL_JOB_STATES
+from pixelpoint.render_queue import RenderQueue
+
+"""
+Progress events of long operations of the web app, streamed to the clients as Server-Sent Events.
+
+An operation, e.g. the processing of an uploaded pair, emits an event at the end of every stage from a worker thread.
+Every event carries the time since the start of the operation and the duration of the stage, so a client can show
+incremental results without keeping the upload request open until the operation is finished.
+
+With an artefact store the events are also saved to it, so a client can follow the operation through any server
+worker, not only the one running it. Store calls block, so the async code runs them in the threadpool.
+
+"""
+
+FINAL_STAGES = ("done", "error", "cancelled")
+# Poll intervals of the events of this worker, kept in memory, and of another worker, read from the store
+LOCAL_POLL_INTERVAL = 0.1
+STORED_POLL_INTERVAL = 1.0
+
+
+class ProgressTracker:
+    """Events of one operation, written by the thread running it and read by any number of subscribers."""
+
+    def __init__(self, op_id: str, store: Optional[ArtefactStore] = None):
+        self.op_id = op_id
+        self.store = store
+        self.created = time.time()
+        self._events: List[dict] = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def emit(self, stage: str, **data):
+        """
+        Record the end of a stage with its duration and any JSON serializable data, e.g. number of keypoints.
+
+        With a store the events are written to it, so `emit` blocks and is called from a worker thread.
+
+        """
+        with self._lock:
+            now = time.perf_counter()
+            event = {
+                "id": len(self._events),
+                "op_id": self.op_id,
+                "stage": stage,
+                "elapsed": now - self._start,
+                "duration": now - self._last,
+                **data,
+            }
+            self._events.append(event)
+            self._last = now
+            if self.store is not None:
+                self.store.write(progress_key(self.op_id), json.dumps(self._events).encode())
+
+    def events_since(self, index: int) -> List[dict]:
+        with self._lock:
+            return self._events[index:]
+
+    @property
+    def finished(self) -> bool:
+        with self._lock:
+            return bool(self._events) and self._events[-1]["stage"] in FINAL_STAGES
+
+
+class StoredProgress:
+    """Read-only events of an operation run by another worker, loaded from the artefact store on every read."""
+
+    def __init__(self, op_id: str, store: ArtefactStore):
+        self.op_id = op_id
+        self.store = store
+
+    def events_since(self, index: int) -> List[dict]:
+        try:
+            return json.loads(self.store.get(progress_key(self.op_id)))[index:]
+        except ArtefactNotFound:
+            return []
+
+    @property
+    def finished(self) -> bool:
+        events = self.events_since(0)
+        return bool(events) and events[-1]["stage"] in FINAL_STAGES
+
+
+def progress_key(op_id: str) -> str:
+    return f"progress/{op_id}.json"
+
+
+class ProgressHub:
+    """
+    Trackers of the recent operations.
+
+    Finished operations are kept for `ttl` seconds, so a client that connects after the end still receives all events.
+    Operations of other workers are found in the artefact `store`.
+
+    """
+
+    def __init__(self, ttl: float = 600.0, store: Optional[ArtefactStore] = None):
+        self.ttl = ttl
+        self.store = store
+        self._trackers: Dict[str, ProgressTracker] = {}
+        self._lock = threading.Lock()
+
+    def create(self) -> ProgressTracker:
+        with self._lock:
+            now = time.time()
+            expired = [
+                op_id
+                for op_id, tracker in self._trackers.items()
+                if tracker.finished and now - tracker.created > self.ttl
+            ]
+            for op_id in expired:
+                del self._trackers[op_id]
+
+            tracker = ProgressTracker(uuid.uuid4().hex[:12], store=self.store)
+            self._trackers[tracker.op_id] = tracker
+            return tracker
+
+    def get(self, op_id: str) -> Union[ProgressTracker, StoredProgress, None]:
+        """Tracker of an operation of this worker or the stored events of another one, looks up the store (blocks)."""
+        with self._lock:
+            tracker = self._trackers.get(op_id)
+        if tracker is not None or self.store is None or not op_id.isalnum():
+            return tracker
+        return StoredProgress(op_id, self.store) if self.store.exists(progress_key(op_id)) else None
+
+
+def format_sse(event: dict) -> str:
+    """Server-Sent Event with the event id, so a reconnecting EventSource continues after the last received event."""
+    return f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def tracker_events(
+    tracker: Union[ProgressTracker, StoredProgress],
+    last_event_id: int = -1,
+    poll_interval: Optional[float] = None,
+    keep_alive: float = 15.0,
+) -> AsyncIterator[str]:
+    """
+    Stream the events of an operation as SSE messages until its final event.
+
+    Events of another worker are read from the store in the threadpool and, by default, polled less often.
+
+    """
+    stored = isinstance(tracker, StoredProgress)
+    if poll_interval is None:
+        poll_interval = STORED_POLL_INTERVAL if stored else LOCAL_POLL_INTERVAL
+    index = last_event_id + 1
+    last_sent = time.monotonic()
+    while True:
+        if stored:
+            events = await run_in_threadpool(tracker.events_since, index)
+        else:
+            events = tracker.events_since(index)
+        for event in events:
+            yield format_sse(event)
+        index += len(events)
+        if events:
+            last_sent = time.monotonic()
+            if events[-1]["stage"] in FINAL_STAGES:
+                return
+        elif time.monotonic() - last_sent > keep_alive:
+            # Comments keep proxies from closing an idle connection
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        await asyncio.sleep(poll_interval)
+
+
+async def render_job_statuses(queue: RenderQueue, job_id: str, poll_interval: float = 0.5) -> AsyncIterator[dict]:
+    """Yield the status of a render job every time it changes, e.g. after every rendered pair, until it's finished."""
+    last_status = None
+    while True:
+        status = await run_in_threadpool(queue.status, job_id)
+        if status is None:
+            return
+        if status != last_status:
+            yield status
+            last_status = status
+        if status["state"] in FINAL_JOB_STATES:
+            return
+        await asyncio.sleep(poll_interval)
+
+
+async def render_job_events(
+    queue: RenderQueue, job_id: str, last_event_id: int = -1, poll_interval: float = 0.5
+) -> AsyncIterator[str]:
+    """
+    Stream the progress of a render job as SSE messages: a "pair_rendered" event per pair and a final event.
+
+    The render workers save only the cumulative render time of a job, so pairs finished between two polls share the
+    render time of these polls equally.
+
+    """
+    event_id = 0
+    pairs_done, render_time = 0, 0.0
+    status = await run_in_threadpool(queue.status, job_id)
+    while status is not None:
+        new_pairs = status["pairs_done"] - pairs_done
+        for i in range(pairs_done, status["pairs_done"]):
+            event = {
+                "id": event_id,
+                "op_id": job_id,
+                "stage": "pair_rendered",
+                "pair": i,
+                "pairs_done": i + 1,
+                "num_pairs": status["num_pairs"],
+                "duration": (status["render_time"] - render_time) / new_pairs,
+                "elapsed": status["render_time"],
+            }
+            if event_id > last_event_id:
+                yield format_sse(event)
+            event_id += 1
+        pairs_done, render_time = status["pairs_done"], status["render_time"]
+
+        if status["state"] in FINAL_JOB_STATES:
+            stage = {"done": "done", "failed": "error", "cancelled": "cancelled"}[status["state"]]
+            event = {
+                "id": event_id,
+                "op_id": job_id,
+                "stage": stage,
+                "pairs_done": pairs_done,
+                "num_pairs": status["num_pairs"],
+                "elapsed": render_time,
+                "duration": 0.0,
+                "result": status["output_dir"],
+                "error": status["error"],
+            }
+            if event_id > last_event_id:
+                yield format_sse(event)
+            return
+
+        await asyncio.sleep(poll_interval)
+        status = await run_in_threadpool(queue.status, job_id)
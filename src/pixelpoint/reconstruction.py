@@ -0,0 +1,312 @@
+import argparse
+import time
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from pixelpoint.calibration.calibration_utils import load_calibration_params
+from pixelpoint.matching import Circle
+from pixelpoint.matching import match_circles
+
+"""
+Dense reconstruction restricted to regions of interest.
+
+The notebooks rectify the whole frame and compute SGBM disparity and `reprojectImageTo3D` over all 20 Mp, while the
+geometry is measured only around the detected circles or inside the object mask. Here only padded windows around the
+regions are rectified: the rectification maps are computed for a window by shifting the principal point of the
+rectified camera, and `cv2.remap` reads only the source pixels the window needs. The disparity range of every window
+is inferred from the sparse matches inside it, so SGBM searches tens of disparities instead of hundreds, and the
+window is reprojected to 3D with Q shifted by the window offset. The cost scales with the area of the regions, not
+with the sensor size.
+
+"""
+
+
+class Roi(NamedTuple):
+    x: int  # left column in the rectified left image
+    y: int  # top row in the rectified left image
+    width: int
+    height: int
+    label: str  # e.g. "circle_3" or "mask_0", labels of merged regions are joined with "+"
+
+
+class ReconstructionPatch(NamedTuple):
+    roi: Roi
+    disparity: np.ndarray  # (height, width) disparity in rectified pixels, NaN where it isn't found
+    points: np.ndarray  # (height, width, 3) points in the left camera coordinates, NaN where disparity isn't found
+    min_disparity: int
+    num_disparities: int
+
+
+class StereoRectifier:
+    """
+    Rectification of a calibrated pair, computed window by window.
+
+    Parameters
+    ----------
+    calibration : dict
+        Calibration parameters from `load_calibration_params`: "CM", "dist", "R" and "T".
+    image_size : tuple[int, int]
+        (width, height) of the images.
+    alpha : float
+        Free scaling parameter of `cv2.stereoRectify`, -1 is the default scaling used in the notebooks.
+
+    """
+
+    def __init__(self, calibration: dict, image_size: Tuple[int, int], alpha: float = -1):
+        self.camera_matrix = calibration["CM"]
+        self.dist = calibration["dist"]
+        self.image_size = tuple(image_size)
+        self.R1, self.R2, self.P1, self.P2, self.Q, _, _ = cv2.stereoRectify(
+            self.camera_matrix,
+            self.dist,
+            self.camera_matrix,
+            self.dist,
+            self.image_size,
+            calibration["R"],
+            calibration["T"].reshape(3, 1),
+            flags=0,
+            alpha=alpha,
+        )
+
+    def rectify_points(self, points: np.ndarray, side: str) -> np.ndarray:
+        """Positions of (N, 2) points of the "left" or "right" image in the rectified image."""
+        rotation, projection = (self.R1, self.P1) if side == "left" else (self.R2, self.P2)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if not len(points):
+            return np.zeros((0, 2))
+        return cv2.undistortPoints(points, self.camera_matrix, self.dist, R=rotation, P=projection).reshape(-1, 2)
+
+    def rectify_window(self, image: np.ndarray, side: str, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """Window of the rectified "left" or "right" image, computed from the source image without rectifying it all."""
+        rotation, projection = (self.R1, self.P1) if side == "left" else (self.R2, self.P2)
+        # The rectified camera of the window has the principal point shifted by the window offset
+        window_projection = projection[:, :3].copy()
+        window_projection[0, 2] -= x
+        window_projection[1, 2] -= y
+        map_x, map_y = cv2.initUndistortRectifyMap(
+            self.camera_matrix, self.dist, rotation, window_projection, (width, height), cv2.CV_32FC1
+        )
+        return cv2.remap(image, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+
+    def window_q(self, x: int, y: int) -> np.ndarray:
+        """Q of `cv2.reprojectImageTo3D` for disparity of a window at (x, y) of the rectified left image."""
+        offset = np.eye(4)
+        offset[0, 3], offset[1, 3] = x, y
+        return self.Q @ offset
+
+
+def circle_rois(rectifier: StereoRectifier, circles: List[Tuple[Circle, Circle]], radius: int = 120) -> List[Roi]:
+    """Square regions of `radius` rectified pixels around the matched circles from `match_circles`."""
+    points = rectifier.rectify_points([(left.x, left.y) for left, _ in circles], "left")
+    return [
+        Roi(int(x) - radius, int(y) - radius, 2 * radius + 1, 2 * radius + 1, f"circle_{left.idx}")
+        for (left, _), (x, y) in zip(circles, points)
+    ]
+
+
+def mask_rois(rectifier: StereoRectifier, mask: np.ndarray, padding: int = 16, min_area: int = 64) -> List[Roi]:
+    """Bounding boxes in the rectified left image of the connected components of a mask of the left image."""
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats((mask > 0).astype(np.uint8))
+    rois = []
+    for label in range(1, num_labels):
+        if stats[label, cv2.CC_STAT_AREA] < min_area:
+            continue
+        contours, _ = cv2.findContours((labels == label).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Only the contour is rectified, its bounding box in the rectified image contains the whole component
+        points = rectifier.rectify_points(np.concatenate(contours).reshape(-1, 2), "left")
+        x0, y0 = np.floor(points.min(axis=0)).astype(int) - padding
+        x1, y1 = np.ceil(points.max(axis=0)).astype(int) + padding
+        rois.append(Roi(int(x0), int(y0), int(x1 - x0 + 1), int(y1 - y0 + 1), f"mask_{len(rois)}"))
+    return rois
+
+
+def merge_rois(rois: List[Roi]) -> List[Roi]:
+    """Merge overlapping regions, so no pixel is reconstructed twice."""
+    rois = list(rois)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rois)):
+            for j in range(i + 1, len(rois)):
+                a, b = rois[i], rois[j]
+                if a.x < b.x + b.width and b.x < a.x + a.width and a.y < b.y + b.height and b.y < a.y + a.height:
+                    x, y = min(a.x, b.x), min(a.y, b.y)
+                    width = max(a.x + a.width, b.x + b.width) - x
+                    height = max(a.y + a.height, b.y + b.height) - y
+                    rois[i] = Roi(x, y, width, height, f"{a.label}+{b.label}")
+                    del rois[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rois
+
+
+def disparity_range(
+    disparities: np.ndarray, margin: int = 16, fallback: Optional[Tuple[int, int]] = None
+) -> Tuple[int, int]:
+    """SGBM minDisparity and numDisparities covering the sparse `disparities` with `margin` pixels."""
+    if not len(disparities):
+        if fallback is None:
+            raise ValueError("Disparity range can't be inferred without matches in the region.")
+        return fallback
+    min_disparity = int(np.floor(np.min(disparities))) - margin
+    span = int(np.ceil(np.max(disparities))) + margin - min_disparity + 1
+    return min_disparity, int(np.ceil(span / 16) * 16)
+
+
+# pylint: disable=too-many-locals
+def reconstruct_rois(
+    image_left: np.ndarray,
+    image_right: np.ndarray,
+    rectifier: StereoRectifier,
+    rois: List[Roi],
+    points_left: np.ndarray,
+    points_right: np.ndarray,
+    disparity_margin: int = 16,
+    block_size: int = 13,
+) -> List[ReconstructionPatch]:
+    """
+    Compute disparity and 3D points inside the regions.
+
+    Parameters
+    ----------
+    image_left, image_right : np.ndarray
+        Grayscale source images, not rectified.
+    rectifier : StereoRectifier
+        Rectification of the pair.
+    rois : list[Roi]
+        Regions of the rectified left image, e.g. from `circle_rois` or `mask_rois`.
+    points_left, points_right : np.ndarray
+        (N, 2) sparse matches of the source images, e.g. the circles of `match_circles`. The disparity range of a region
+        is inferred from the matches inside it, or from all matches if there are none.
+    disparity_margin : int
+        Disparity range is extended by this number of pixels on both sides of the matches.
+    block_size : int
+        SGBM block size, the SGBM parameters are those of the notebooks.
+
+    Returns
+    -------
+    patches : list[ReconstructionPatch]
+        Disparity and 3D points of every region.
+
+    """
+    rectified_left = rectifier.rectify_points(points_left, "left")
+    rectified_right = rectifier.rectify_points(points_right, "right")
+    disparities = rectified_left[:, 0] - rectified_right[:, 0]
+    all_range = disparity_range(disparities, disparity_margin) if len(disparities) else None
+    # Rectified pair is in camera coordinates rotated by R1: X_rectified = R1 @ X_left
+    rectified_to_left = rectifier.R1
+
+    patches = []
+    for roi in rois:
+        inside = (
+            (rectified_left[:, 0] >= roi.x)
+            & (rectified_left[:, 0] < roi.x + roi.width)
+            & (rectified_left[:, 1] >= roi.y)
+            & (rectified_left[:, 1] < roi.y + roi.height)
+        )
+        min_disparity, num_disparities = disparity_range(disparities[inside], disparity_margin, fallback=all_range)
+
+        # Both windows share the columns, so the disparity of the windows is the disparity of the rectified images;
+        # they are extended so every pixel of the region sees all its candidates, and by half a block on every side
+        half_block = block_size // 2
+        x0 = roi.x - max(min_disparity + num_disparities - 1, 0) - half_block
+        x1 = roi.x + roi.width + max(-min_disparity, 0) + half_block
+        y0, y1 = roi.y - half_block, roi.y + roi.height + half_block
+        window_left = rectifier.rectify_window(image_left, "left", x0, y0, x1 - x0, y1 - y0)
+        window_right = rectifier.rectify_window(image_right, "right", x0, y0, x1 - x0, y1 - y0)
+
+        stereo = cv2.StereoSGBM_create(
+            minDisparity=min_disparity,
+            numDisparities=num_disparities,
+            blockSize=block_size,
+            P1=8 * block_size**2,
+            P2=32 * block_size**2,
+            disp12MaxDiff=3,
+            uniquenessRatio=10,
+            speckleWindowSize=100,
+            speckleRange=25,
+            preFilterCap=50,
+        )
+        disparity = stereo.compute(window_left, window_right).astype(np.float32) / 16.0
+        disparity = disparity[roi.y - y0 : roi.y - y0 + roi.height, roi.x - x0 : roi.x - x0 + roi.width]
+        disparity[disparity < min_disparity] = np.nan
+
+        points = cv2.reprojectImageTo3D(
+            np.nan_to_num(disparity, nan=min_disparity - 1), rectifier.window_q(roi.x, roi.y)
+        )
+        points = points @ rectified_to_left
+        points[np.isnan(disparity)] = np.nan
+        patches.append(ReconstructionPatch(roi, disparity, points, min_disparity, num_disparities))
+    return patches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruct 3D points around the circles or inside a mask.")
+    parser.add_argument("--left-image-path", type=str, required=True, help="")
+    parser.add_argument("--right-image-path", type=str, required=True, help="")
+    parser.add_argument("--calibration-file", type=str, required=True, help="Calibration JSON file of the pair.")
+    parser.add_argument(
+        "--mask-path",
+        type=str,
+        default=None,
+        help="Mask of the left image, regions are its components instead of circles.",
+    )
+    parser.add_argument("--radius", type=int, default=120, help="Half size of the regions around circles in pixels.")
+    parser.add_argument("--padding", type=int, default=16, help="Padding of the mask regions in pixels.")
+    parser.add_argument("--disparity-margin", type=int, default=16, help="Margin of the disparity range in pixels.")
+    parser.add_argument("--block-size", type=int, default=13, help="SGBM block size.")
+    parser.add_argument(
+        "--output-file", type=str, default="reconstruction.npz", help="Path to the NPZ file with the patches."
+    )
+    args = parser.parse_args()
+
+    image_left = cv2.imread(args.left_image_path, cv2.IMREAD_GRAYSCALE)
+    image_right = cv2.imread(args.right_image_path, cv2.IMREAD_GRAYSCALE)
+    rectifier = StereoRectifier(load_calibration_params(args.calibration_file), image_left.shape[::-1])
+
+    circles = match_circles(image_left=image_left, image_right=image_right)
+    if args.mask_path is not None:
+        rois = mask_rois(rectifier, cv2.imread(args.mask_path, cv2.IMREAD_GRAYSCALE), padding=args.padding)
+    else:
+        rois = circle_rois(rectifier, circles, radius=args.radius)
+    rois = merge_rois(rois)
+
+    start = time.perf_counter()
+    patches = reconstruct_rois(
+        image_left,
+        image_right,
+        rectifier,
+        rois,
+        points_left=np.array([(left.x, left.y) for left, _ in circles]).reshape(-1, 2),
+        points_right=np.array([(right.x, right.y) for _, right in circles]).reshape(-1, 2),
+        disparity_margin=args.disparity_margin,
+        block_size=args.block_size,
+    )
+    elapsed = time.perf_counter() - start
+
+    area = sum(patch.roi.width * patch.roi.height for patch in patches)
+    print(f"{len(patches)} regions, {area / image_left.size:.1%} of the frame, reconstructed in {elapsed:.2f} s")
+    arrays = {}
+    for patch in patches:
+        valid = np.isfinite(patch.disparity)
+        print(
+            f"{patch.roi.label}: {patch.roi.width}x{patch.roi.height} at ({patch.roi.x}, {patch.roi.y}), "
+            f"disparities {patch.min_disparity}..{patch.min_disparity + patch.num_disparities - 1}, "
+            f"{valid.mean():.0%} valid"
+        )
+        arrays[f"{patch.roi.label}_roi"] = np.array(patch.roi[:4])
+        arrays[f"{patch.roi.label}_disparity"] = patch.disparity
+        arrays[f"{patch.roi.label}_points"] = patch.points
+    np.savez_compressed(args.output_file, **arrays)
+    print(f"Patches saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
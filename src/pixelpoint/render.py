@@ -1,69 +1,392 @@
 import argparse
 import subprocess
 import sys
+import threading
+import time
 from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
 
 import bpy
 import numpy as np
 
-
-# pylint: disable=too-many-locals
-def render_paired_images(
-    object_path: Path,
-    output_dir: Path,
-    object_scale: float = 5.0,
-    distance_between_cameras: float = 412.0,  # Updated distance between cameras
-    distance_from_object: float = 639.0,  # Updated distance from center to the object
-    focal_length: float = 80.0,  # Updated focal length of the camera
-    resolution_x: int = 5120,  # Updated picture resolution width
-    resolution_y: int = 4096,  # Updated picture resolution height
-):
+# Blender runs this file as a script, so the package is imported from the source tree
+sys.path.insert(0, Path(__file__).resolve().parents[1].as_posix())
+# pylint: disable=wrong-import-position
+from pixelpoint.artefact_writer import ArtefactWriter
+from pixelpoint.artefact_writer import write_artefact
+from pixelpoint.render_settings import RENDER_ENGINES
+from pixelpoint.render_settings import WORKBENCH_AA_SAMPLES
+from pixelpoint.render_settings import RenderSettings
+from pixelpoint.render_settings import add_render_settings_arguments
+from pixelpoint.render_settings import render_settings_argv
+from pixelpoint.render_settings import render_settings_from_args
+
+
+class SceneParams(NamedTuple):
+    object_path: Path  # .stl file of the object
+    object_scale: float = 5.0  # scale of the object size
+    distance_between_cameras: float = 412.0
+    distance_from_object: float = 639.0  # distance from the center between the cameras to the object
+    focal_length: float = 80.0  # lens focal length in millimeters
+    resolution_x: int = 5120
+    resolution_y: int = 4096
+    render_settings: Optional[RenderSettings] = None  # e.g. from `RENDER_PRESETS`, Blender defaults if None
+    multiview: bool = False  # render both images in one call with a stereoscopic multiview camera
+    depth_format: Optional[str] = None  # format of the exported ground truth maps, None disables the export
+
+
+class RenderScene(NamedTuple):
+    obj: "bpy.types.Object"  # imported object
+    camera_right: Optional["bpy.types.Object"] = None
+    camera_left: Optional["bpy.types.Object"] = None
+    camera_stereo: Optional["bpy.types.Object"] = None  # multiview camera rendering both images at once
+    depth_format: Optional[str] = None  # format of the exported ground truth maps, None disables the export
+
+
+DEPTH_FORMATS = ("npy", "exr")
+
+
+def apply_render_settings(settings: Optional[RenderSettings]):
+    """Apply render settings to the current scene, None keeps the Blender defaults."""
+    if settings is None:
+        return
+
+    scene = bpy.context.scene
+    scene.render.engine = RENDER_ENGINES[settings.engine]
+    scene.render.resolution_percentage = settings.resolution_percentage
+    scene.render.image_settings.compression = settings.compression
+
+    if settings.engine == "eevee":
+        scene.eevee.taa_render_samples = settings.samples
+    elif settings.engine == "cycles":
+        scene.cycles.device = "CPU"
+        scene.cycles.samples = settings.samples
+        scene.cycles.use_denoising = settings.denoise
+        scene.cycles.use_auto_tile = True
+        scene.cycles.tile_size = settings.tile_size
+    else:
+        # Workbench supports only fixed anti-aliasing sample counts
+        supported = [samples for samples in WORKBENCH_AA_SAMPLES if samples <= settings.samples]
+        scene.display.render_aa = str(supported[-1]) if supported else "OFF"
+
+
+def render_paired_images(scene_params: SceneParams, output_dir: Path, writer: Optional[ArtefactWriter] = None):
     """
     Render object and save paired images.
 
     Parameters
     ----------
-    object_path : str
-        Path to .stl file for rendering.
+    scene_params : SceneParams
+        Object, cameras and render settings of the scene. With `depth_format` the ground truth of the pair (see
+        `export_ground_truth`) is exported with depth and disparity maps in this format from `DEPTH_FORMATS`: float16
+        "npy" or float32 "exr".
     output_dir : str
         Path to save directory for rendered images.
-    object_scale : float
-        Scale object size.
-    distance_between_cameras : float
-        Distance between cameras to create paired images.
-    distance_from_object : float
-        Distance from the center between the cameras to the object.
-    focal_length: float
-        Lens focal length in millimeters.
-    resolution_x: int
-        Width of the picture resolution.
-    resolution_y: int
-        Height of the picture resolution.
+    writer: ArtefactWriter
+        Writer of the ground truth files in the background, they are written before the function returns if None.
 
     """
-    output_dir.mkdir(exist_ok=True, parents=True)
+    scene = setup_scene(scene_params)
+    render_scene_pair(scene, output_dir=output_dir, rotation=random_object_rotation(), writer=writer)
 
-    _setup_object(object_path=object_path, object_scale=object_scale)
 
-    camera1_object, camera2_object = _setup_cameras_position(
-        distance_from_object=distance_from_object,
-        distance_between_cameras=distance_between_cameras,
-        focal_length=focal_length,
-    )
+def setup_scene(scene_params: SceneParams) -> RenderScene:
+    """
+    Build the scene with the object, two cameras and lights.
+
+    The scene is independent of the rendered pair, so it can be built once and reused for all pairs with
+    `render_scene_pair`, which only updates the randomized object rotation.
+
+    """
+    if scene_params.depth_format is not None and scene_params.depth_format not in DEPTH_FORMATS:
+        raise ValueError(f"Unknown depth format {scene_params.depth_format}, use one of {DEPTH_FORMATS}")
+    if scene_params.depth_format is not None and scene_params.multiview:
+        raise ValueError("Ground truth export is supported only for the two-camera rendering, not for multiview")
+
+    obj = _setup_object(object_path=Path(scene_params.object_path), object_scale=scene_params.object_scale)
+
+    if scene_params.multiview:
+        verify_multiview_geometry(scene_params.distance_from_object, scene_params.distance_between_cameras)
+        camera_stereo = _setup_multiview_camera(
+            distance_from_object=scene_params.distance_from_object,
+            distance_between_cameras=scene_params.distance_between_cameras,
+            focal_length=scene_params.focal_length,
+        )
+    else:
+        camera1_object, camera2_object = _setup_cameras_position(
+            distance_from_object=scene_params.distance_from_object,
+            distance_between_cameras=scene_params.distance_between_cameras,
+            focal_length=scene_params.focal_length,
+        )
 
     _setup_light()
 
     # Set render resolution
-    bpy.context.scene.render.resolution_x = resolution_x
-    bpy.context.scene.render.resolution_y = resolution_y
+    bpy.context.scene.render.resolution_x = scene_params.resolution_x
+    bpy.context.scene.render.resolution_y = scene_params.resolution_y
     bpy.context.scene.render.resolution_percentage = 100
+    apply_render_settings(scene_params.render_settings)
+
+    if scene_params.multiview:
+        return RenderScene(obj=obj, camera_stereo=camera_stereo)
+
+    if scene_params.depth_format is not None:
+        _setup_depth_output()
+    return RenderScene(
+        obj=obj, camera_right=camera1_object, camera_left=camera2_object, depth_format=scene_params.depth_format
+    )
+
+
+def random_object_rotation(rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Random object rotation in degrees around the vertical axis, drawn from `rng` or the global numpy generator."""
+    random_rotation = np.random.randint(0, 360) if rng is None else rng.integers(0, 360)
+    return np.array([90, 0, 90 + random_rotation])
+
+
+def render_scene_pair(
+    scene: RenderScene, output_dir: Path, rotation: np.ndarray, writer: Optional[ArtefactWriter] = None
+):
+    """
+    Rotate the object of an already built scene and render a pair of images.
+
+    Parameters
+    ----------
+    scene : RenderScene
+        Scene built by `setup_scene`.
+    output_dir : Path
+        Path to save directory for rendered images.
+    rotation : np.ndarray
+        Object rotation as XYZ Euler angles in degrees.
+    writer : ArtefactWriter
+        Writer of the ground truth files, so the next pair is rendered while they are written. Images are always
+        written by Blender itself.
+
+    """
+    output_dir.mkdir(exist_ok=True, parents=True)
+    scene.obj.rotation_euler = np.deg2rad(rotation).tolist()
+
+    if scene.camera_stereo is not None:
+        # Both views are written by one render call as image_left.png and image_right.png
+        bpy.context.scene.camera = scene.camera_stereo
+        bpy.context.scene.render.filepath = (output_dir / "image").as_posix()
+        bpy.ops.render.render(write_still=True)
+        return
 
     # Render images and save
     image_sides = ["right", "left"]
-    for side, camera_object in zip(image_sides, [camera1_object, camera2_object]):
+    depths = {}
+    for side, camera_object in zip(image_sides, [scene.camera_right, scene.camera_left]):
         bpy.context.scene.camera = camera_object
         bpy.context.scene.render.filepath = (output_dir / f"image_{side}.png").as_posix()
         bpy.ops.render.render(write_still=True)
+        if scene.depth_format is not None:
+            depths[side] = _read_depth(camera_object)
+
+    if scene.depth_format is not None:
+        export_ground_truth(scene, output_dir, rotation, depths, writer=writer)
+
+
+def camera_intrinsics(
+    focal_length: float,
+    sensor_width: float,
+    sensor_height: float,
+    resolution_x: int,
+    resolution_y: int,
+    sensor_fit: str = "AUTO",
+) -> np.ndarray:
+    """
+    Camera matrix of a Blender camera without lens shift in the OpenCV convention.
+
+    Pixel centers have integer coordinates as in OpenCV, so the principal point of a centered sensor is
+    ((W - 1) / 2, (H - 1) / 2). `resolution_x` and `resolution_y` are the rendered resolution, i.e. after the
+    resolution percentage is applied.
+
+    """
+    if sensor_fit == "VERTICAL" or (sensor_fit == "AUTO" and resolution_y > resolution_x):
+        sensor_size = sensor_height if sensor_fit == "VERTICAL" else sensor_width
+        focal_length_px = focal_length / sensor_size * resolution_y
+    else:
+        focal_length_px = focal_length / sensor_width * resolution_x
+    return np.array(
+        [
+            [focal_length_px, 0, (resolution_x - 1) / 2],
+            [0, focal_length_px, (resolution_y - 1) / 2],
+            [0, 0, 1],
+        ]
+    )
+
+
+def world_to_camera(matrix_world: np.ndarray):
+    """
+    Rotation and translation from world to camera coordinates in the OpenCV convention.
+
+    Blender cameras look along their -Z axis with Y up, OpenCV cameras look along Z with Y down, so the camera axes
+    Y and Z are flipped.
+
+    """
+    matrix_world = np.asarray(matrix_world, dtype=np.float64)
+    rotation = np.diag([1.0, -1.0, -1.0]) @ matrix_world[:3, :3].T
+    translation = -rotation @ matrix_world[:3, 3]
+    return rotation, translation
+
+
+def stereo_calibration_params(CM: np.ndarray, pose_left, pose_right) -> Dict[str, np.ndarray]:
+    """
+    Exact stereo calibration of two rendered cameras in the schema of `save_calibration_params`.
+
+    Parameters
+    ----------
+    CM : np.ndarray
+        Camera matrix of both cameras.
+    pose_left, pose_right : tuple
+        World to camera (R, t) of the left and the right camera from `world_to_camera`.
+
+    Returns
+    -------
+    params : dict
+        "CM", "dist", "R", "T", "E" and "F" as returned by `cv.stereoCalibrate` for the left (first) and the right
+        (second) camera: X_right = R @ X_left + T and x_right^T F x_left = 0.
+
+    """
+    rotation_left, translation_left = pose_left
+    rotation_right, translation_right = pose_right
+    R = rotation_right @ rotation_left.T
+    T = translation_right - R @ translation_left
+    T_x = np.array([[0, -T[2], T[1]], [T[2], 0, -T[0]], [-T[1], T[0], 0]])
+    E = T_x @ R
+    CM_inv = np.linalg.inv(CM)
+    F = CM_inv.T @ E @ CM_inv
+    return {"CM": CM, "dist": np.zeros((1, 5)), "R": R, "T": T, "E": E, "F": F}
+
+
+def depth_to_disparity(depth_left: np.ndarray, CM: np.ndarray, R: np.ndarray, T: np.ndarray) -> np.ndarray:
+    """
+    Ground truth disparity of the left image from its depth map.
+
+    Every pixel of the left image is back-projected with its depth, projected into the right image and the disparity
+    is x_left - x_right. The rendered cameras converge at the object, so this is the disparity of the original, not
+    rectified, images. Pixels without depth (background) get NaN.
+
+    Parameters
+    ----------
+    depth_left : np.ndarray
+        Depth along the optical axis of the left camera of shape (H, W), inf for the background.
+    CM, R, T : np.ndarray
+        Calibration from `stereo_calibration_params`.
+
+    """
+    height, width = depth_left.shape
+    u, v = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+    rays = np.stack([u, v, np.ones_like(u)], axis=-1) @ np.linalg.inv(CM).T
+    with np.errstate(invalid="ignore"):
+        points_right = (rays * depth_left[..., None].astype(np.float64)) @ R.T + T
+        projected = points_right @ CM.T
+        disparity = u - projected[..., 0] / projected[..., 2]
+    disparity[~np.isfinite(depth_left)] = np.nan
+    return disparity.astype(np.float32)
+
+
+def export_ground_truth(
+    scene: RenderScene,
+    output_dir: Path,
+    rotation: np.ndarray,
+    depths: Dict[str, np.ndarray],
+    writer: Optional[ArtefactWriter] = None,
+):
+    """
+    Save the ground truth of a rendered pair next to its images.
+
+    Files:
+
+    - `depth_left` and `depth_right`: depth along the optical axis of every pixel in scene units, inf for the
+      background;
+    - `disparity_left`: disparity of the left image from `depth_to_disparity`;
+    - `calibration.json`: exact calibration of the cameras in the schema of `save_calibration_params`;
+    - `pose.json`: object rotation and world matrix and world to camera transforms (OpenCV convention) of both
+      cameras.
+
+    Maps are float16 `.npy` or float32 single channel `.exr` files depending on `scene.depth_format`. With `writer`
+    the `.npy` maps and JSON files are written in the background; `.exr` maps are saved by Blender, which is not
+    thread-safe, so they are always written at once.
+
+    """
+    render = bpy.context.scene.render
+    CM = camera_intrinsics(
+        focal_length=scene.camera_left.data.lens,
+        sensor_width=scene.camera_left.data.sensor_width,
+        sensor_height=scene.camera_left.data.sensor_height,
+        resolution_x=render.resolution_x * render.resolution_percentage // 100,
+        resolution_y=render.resolution_y * render.resolution_percentage // 100,
+        sensor_fit=scene.camera_left.data.sensor_fit,
+    )
+    pose_left = world_to_camera(scene.camera_left.matrix_world)
+    pose_right = world_to_camera(scene.camera_right.matrix_world)
+    params = stereo_calibration_params(CM, pose_left, pose_right)
+
+    for side, depth in depths.items():
+        _save_float_map(output_dir / f"depth_{side}", depth, scene.depth_format, writer)
+    disparity = depth_to_disparity(depths["left"], params["CM"], params["R"], params["T"])
+    _save_float_map(output_dir / "disparity_left", disparity, scene.depth_format, writer)
+
+    write_artefact(output_dir / "calibration.json", {key: value.tolist() for key, value in params.items()}, writer)
+
+    bpy.context.view_layer.update()
+    pose = {
+        "object": {
+            "rotation_euler_deg": np.asarray(rotation).tolist(),
+            "matrix_world": np.array(scene.obj.matrix_world).tolist(),
+        },
+        "cameras": {
+            side: {"R": camera_pose[0].tolist(), "t": camera_pose[1].tolist()}
+            for side, camera_pose in (("left", pose_left), ("right", pose_right))
+        },
+    }
+    write_artefact(output_dir / "pose.json", pose, writer)
+
+
+def _setup_depth_output():
+    # The depth pass goes to the compositor viewer, the rendered image still goes to the composite output
+    bpy.context.view_layer.use_pass_z = True
+    bpy.context.scene.use_nodes = True
+    tree = bpy.context.scene.node_tree
+    tree.nodes.clear()
+    render_layers = tree.nodes.new("CompositorNodeRLayers")
+    composite = tree.nodes.new("CompositorNodeComposite")
+    viewer = tree.nodes.new("CompositorNodeViewer")
+    viewer.use_alpha = False
+    tree.links.new(render_layers.outputs["Image"], composite.inputs["Image"])
+    tree.links.new(render_layers.outputs["Depth"], viewer.inputs["Image"])
+
+
+def _read_depth(camera_object: "bpy.types.Object") -> np.ndarray:
+    viewer_image = bpy.data.images["Viewer Node"]
+    width, height = viewer_image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    viewer_image.pixels.foreach_get(pixels)
+    # Blender images start at the bottom row
+    depth = pixels.reshape(height, width, 4)[::-1, :, 0].copy()
+    # Background gets the far clipping distance (Eevee) or a huge value (Cycles)
+    depth[depth >= camera_object.data.clip_end] = np.inf
+    return depth
+
+
+def _save_float_map(path_stem: Path, values: np.ndarray, depth_format: str, writer: Optional[ArtefactWriter] = None):
+    if depth_format == "npy":
+        write_artefact(path_stem.with_suffix(".npy"), values.astype(np.float16), writer)
+        return
+
+    height, width = values.shape
+    image = bpy.data.images.new(path_stem.name, width=width, height=height, float_buffer=True, is_data=True)
+    pixels = np.ones((height, width, 4), dtype=np.float32)
+    pixels[..., :3] = values[::-1, :, None]
+    image.pixels.foreach_set(pixels.ravel())
+    image.filepath_raw = path_stem.with_suffix(".exr").as_posix()
+    image.file_format = "OPEN_EXR"
+    image.save()
+    bpy.data.images.remove(image)
 
 
 def _setup_object(object_path: Path, object_scale: float):
@@ -77,9 +400,6 @@ def _setup_object(object_path: Path, object_scale: float):
     obj = bpy.context.selected_objects[0]  # Assuming only one object is imported
     bpy.ops.object.origin_set(type="ORIGIN_GEOMETRY", center="BOUNDS")
 
-    random_rotation = np.random.randint(0, 360)
-    rotation = np.array([90, 0, 90 + random_rotation])
-    obj.rotation_euler = np.deg2rad(rotation).tolist()
     obj.location = (0, 0, 0)
     obj.scale = (np.array([1, 1, 1]) * object_scale).tolist()
 
@@ -90,6 +410,115 @@ def _setup_object(object_path: Path, object_scale: float):
     principled_bsdf.inputs["Base Color"].default_value = (0.8, 0.8, 0.8, 1)  # Light gray
     obj.data.materials.append(mat)
 
+    return obj
+
+
+def stereo_camera_poses(distance_from_object: float, distance_between_cameras: float):
+    """
+    Poses of the right and the left camera of the rig, both cameras are aimed at the object in the origin.
+
+    Returns
+    -------
+    poses : tuple
+        (location, rotation) of the right and the left camera, rotation as XYZ Euler angles in degrees.
+
+    """
+    distance_from_center = distance_between_cameras / 2
+    camera_angle = np.rad2deg(np.arctan(distance_from_object / distance_from_center))
+    right_pose = (np.array([distance_from_object, distance_from_center, 0]), np.array([90, 0, 180 - camera_angle]))
+    left_pose = (np.array([distance_from_object, -distance_from_center, 0]), np.array([90, 0, camera_angle]))
+    return right_pose, left_pose
+
+
+def euler_to_matrix(rotation: np.ndarray) -> np.ndarray:
+    """Rotation matrix of XYZ Euler angles in degrees, the Blender default rotation mode."""
+    x, y, z = np.deg2rad(rotation)
+    rotation_x = np.array([[1, 0, 0], [0, np.cos(x), -np.sin(x)], [0, np.sin(x), np.cos(x)]])
+    rotation_y = np.array([[np.cos(y), 0, np.sin(y)], [0, 1, 0], [-np.sin(y), 0, np.cos(y)]])
+    rotation_z = np.array([[np.cos(z), -np.sin(z), 0], [np.sin(z), np.cos(z), 0], [0, 0, 1]])
+    return rotation_z @ rotation_y @ rotation_x
+
+
+def multiview_camera_pose(distance_from_object: float):
+    """Location and XYZ Euler rotation in degrees of the multiview camera between the rig cameras."""
+    return np.array([distance_from_object, 0, 0]), np.array([90, 0, 90])
+
+
+def multiview_eye_poses(distance_from_object: float, distance_between_cameras: float):
+    """
+    Poses of the right and the left view of the multiview camera as Blender computes them.
+
+    With the "TOE" convergence mode and the "CENTER" pivot every view is shifted by half of the interocular distance
+    along the camera X axis and rotated around the camera Y axis, so the views converge at the convergence distance.
+
+    Returns
+    -------
+    poses : tuple
+        (location, rotation matrix) of the right and the left view.
+
+    """
+    location, rotation = multiview_camera_pose(distance_from_object)
+    camera_matrix = euler_to_matrix(rotation)
+    half_interocular = distance_between_cameras / 2
+    angle = np.arctan(half_interocular / distance_from_object)
+
+    poses = []
+    for side in (1, -1):  # right, left
+        eye_angle = side * angle
+        eye_rotation = np.array(
+            [[np.cos(eye_angle), 0, np.sin(eye_angle)], [0, 1, 0], [-np.sin(eye_angle), 0, np.cos(eye_angle)]]
+        )
+        eye_location = location + camera_matrix @ np.array([side * half_interocular, 0, 0])
+        poses.append((eye_location, camera_matrix @ eye_rotation))
+    return tuple(poses)
+
+
+def verify_multiview_geometry(distance_from_object: float, distance_between_cameras: float, atol: float = 1e-6):
+    """
+    Check that the multiview views have the same poses as the two cameras of `_setup_cameras_position`.
+
+    Returns the maximal relative deviation of locations and rotation matrix elements, raises ValueError if it exceeds
+    `atol`.
+
+    """
+    camera_poses = stereo_camera_poses(distance_from_object, distance_between_cameras)
+    eye_poses = multiview_eye_poses(distance_from_object, distance_between_cameras)
+
+    deviation = 0.0
+    for (camera_location, camera_rotation), (eye_location, eye_matrix) in zip(camera_poses, eye_poses):
+        location_deviation = np.abs(camera_location - eye_location).max() / max(distance_from_object, 1.0)
+        rotation_deviation = np.abs(euler_to_matrix(camera_rotation) - eye_matrix).max()
+        deviation = max(deviation, location_deviation, rotation_deviation)
+
+    if deviation > atol:
+        raise ValueError(f"Multiview camera geometry differs from the stereo rig by {deviation}")
+    return deviation
+
+
+def _setup_multiview_camera(distance_from_object: float, distance_between_cameras: float, focal_length: float):
+    camera_data = bpy.data.cameras.new(name="StereoCamera")
+    camera_data.lens = focal_length
+    camera_data.stereo.convergence_mode = "TOE"
+    camera_data.stereo.pivot = "CENTER"
+    camera_data.stereo.interocular_distance = distance_between_cameras
+    camera_data.stereo.convergence_distance = distance_from_object
+    camera_object = bpy.data.objects.new("StereoCamera", camera_data)
+    bpy.context.scene.collection.objects.link(camera_object)
+
+    location, rotation = multiview_camera_pose(distance_from_object)
+    camera_object.location = location.tolist()
+    camera_object.rotation_euler = np.deg2rad(rotation).tolist()
+
+    # Left and right views are saved as separate files with the names of the two-camera mode
+    render = bpy.context.scene.render
+    render.use_multiview = True
+    render.views_format = "STEREO_3D"
+    render.views["left"].file_suffix = "_left"
+    render.views["right"].file_suffix = "_right"
+    render.image_settings.views_format = "INDIVIDUAL"
+
+    return camera_object
+
 
 def _setup_cameras_position(distance_from_object: float, distance_between_cameras: float, focal_length: float):
     # Set up two cameras
@@ -104,15 +533,14 @@ def _setup_cameras_position(distance_from_object: float, distance_between_camera
     bpy.context.scene.collection.objects.link(camera1_object)
     bpy.context.scene.collection.objects.link(camera2_object)
 
-    # Position the cameras
-    distance_from_center = distance_between_cameras / 2
-    camera1_object.location = (distance_from_object, distance_from_center, 0)
-    camera2_object.location = (distance_from_object, -distance_from_center, 0)
-
-    # Rotation the cameras
-    camera_angle = np.rad2deg(np.arctan(distance_from_object / distance_from_center))
-    camera1_object.rotation_euler = np.deg2rad([90, 0, 180 - camera_angle]).tolist()
-    camera2_object.rotation_euler = np.deg2rad([90, 0, camera_angle]).tolist()
+    # Position and rotate the cameras
+    (camera1_location, camera1_rotation), (camera2_location, camera2_rotation) = stereo_camera_poses(
+        distance_from_object, distance_between_cameras
+    )
+    camera1_object.location = camera1_location.tolist()
+    camera2_object.location = camera2_location.tolist()
+    camera1_object.rotation_euler = np.deg2rad(camera1_rotation).tolist()
+    camera2_object.rotation_euler = np.deg2rad(camera2_rotation).tolist()
 
     return camera1_object, camera2_object
 
@@ -140,36 +568,73 @@ def _setup_light():
     bpy.context.scene.world.color = (0.05, 0.05, 0.05)  # Dark gray
 
 
+PROGRESS_PREFIX = "PIXELPOINT_PAIR_DONE"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def pair_rng(seed: int, pair_index: int) -> np.random.Generator:
+    """Random generator of one pair, it depends only on the global seed and the pair index."""
+    return np.random.default_rng(np.random.SeedSequence([seed, pair_index]))
+
+
+def is_pair_complete(pair_dir: Path, depth_format: Optional[str] = None) -> bool:
+    """
+    Check that both images of a pair exist and are complete PNG files, e.g. not truncated by a killed worker.
+
+    With `depth_format` the ground truth files of the pair must exist too.
+
+    """
+    if depth_format is not None:
+        ground_truth_files = ["calibration.json", "pose.json"] + [
+            f"{name}.{depth_format}" for name in ("depth_left", "depth_right", "disparity_left")
+        ]
+        if not all((pair_dir / file_name).is_file() for file_name in ground_truth_files):
+            return False
+
+    for side in ("right", "left"):
+        image_path = pair_dir / f"image_{side}.png"
+        if not image_path.is_file() or image_path.stat().st_size < len(PNG_SIGNATURE) + 12:
+            return False
+        with open(image_path, "rb") as f:
+            signature = f.read(len(PNG_SIGNATURE))
+            f.seek(-12, 2)
+            last_chunk = f.read()
+        if signature != PNG_SIGNATURE or last_chunk[4:8] != b"IEND":
+            return False
+    return True
+
+
 def blender_render(
-    object_path: str,
+    scene_params: SceneParams,
     output_dir: str,
-    object_scale: float,
-    distance_between_cameras: float,
-    distance_from_object: float,
-    focal_length: float,
-    resolution_x: int,
-    resolution_y: int,
     num_pairs: int,
+    reuse_scene: bool = True,
+    seed: int = 42,
+    pair_indices: Optional[List[int]] = None,
 ):
-    np.random.seed(42)
     Path(output_dir).mkdir(exist_ok=True, parents=True)
-
-    for i in range(num_pairs):
-        render_paired_images(
-            object_path=Path(object_path),
-            output_dir=Path(output_dir) / f"pair_{i}",
-            object_scale=object_scale,
-            distance_between_cameras=distance_between_cameras,
-            distance_from_object=distance_from_object,
-            focal_length=focal_length,
-            resolution_x=resolution_x,
-            resolution_y=resolution_y,
-        )
-
-
-def main():
-    parser = argparse.ArgumentParser(description="Render paired images using Blender.")
-    parser.add_argument("--blender-path", type=str, required=True, help="Path to the Blender program.")
+    pair_indices = range(num_pairs) if pair_indices is None else pair_indices
+
+    # The mesh is imported once, only the object rotation changes between pairs
+    scene = setup_scene(scene_params) if reuse_scene else None
+    # Ground truth of a pair is written while the next pair is rendered
+    with ArtefactWriter(max_queue=16) as writer:
+        for i in pair_indices:
+            pair_dir = Path(output_dir) / f"pair_{i}"
+            start = time.perf_counter()
+            if not is_pair_complete(pair_dir, scene_params.depth_format):
+                if not reuse_scene:
+                    scene = setup_scene(scene_params)
+                rotation = random_object_rotation(pair_rng(seed, i))
+                render_scene_pair(scene, output_dir=pair_dir, rotation=rotation, writer=writer)
+
+            # Progress line parsed by render-cli to aggregate the progress of all workers
+            print(f"{PROGRESS_PREFIX} {i} {time.perf_counter() - start:.3f}", flush=True)
+    if writer.metrics()["failed"]:
+        raise RuntimeError(f"Ground truth is not written: {writer.metrics()['last_error']}")
+
+
+def add_scene_arguments(parser: argparse.ArgumentParser):
     parser.add_argument("--object-path", type=str, required=True, help="Path to the .stl file.")
     parser.add_argument("--output-dir", type=str, required=True, help="Directory to save the rendered images.")
     parser.add_argument("--object-scale", type=float, default=5.0, help="Scale object in size.")
@@ -184,39 +649,174 @@ def main():
     parser.add_argument("--resolution-x", type=int, default=5120, help="Width of the picture resolution.")
     parser.add_argument("--resolution-y", type=int, default=4096, help="Height of the picture resolution.")
     parser.add_argument("--num-pairs", type=int, default=10, help="Number of image pairs to render.")
-    args = parser.parse_args()
+    parser.add_argument(
+        "--no-scene-reuse",
+        action="store_true",
+        help="Rebuild the scene and re-import the object for every pair instead of only updating its rotation.",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Global seed, every pair derives its own seed from it.")
+    parser.add_argument(
+        "--multiview", action="store_true", help="Render both images of a pair in one stereoscopic multiview render."
+    )
+    parser.add_argument(
+        "--ground-truth",
+        action="store_true",
+        help="Save depth and disparity maps, exact camera calibration and object pose of every pair.",
+    )
+    parser.add_argument(
+        "--depth-format",
+        type=str,
+        default="npy",
+        choices=DEPTH_FORMATS,
+        help="Format of the ground truth maps: float16 npy or float32 exr (default: npy).",
+    )
+
+
+def scene_params_from_args(args: argparse.Namespace) -> SceneParams:
+    return SceneParams(
+        object_path=Path(args.object_path),
+        object_scale=args.object_scale,
+        distance_between_cameras=args.distance_between_cameras,
+        distance_from_object=args.distance_from_object,
+        focal_length=args.focal_length,
+        resolution_x=args.resolution_x,
+        resolution_y=args.resolution_y,
+        render_settings=render_settings_from_args(args),
+        multiview=args.multiview,
+        depth_format=args.depth_format if args.ground_truth else None,
+    )
 
-    # Call Blender with the specified script and arguments
-    blender_command = [
-        args.blender_path,
-        "--background",
-        "--python",
-        (Path(__file__).parent / "render.py").as_posix(),
-        "--",
+
+def _scene_argv(args: argparse.Namespace) -> List[str]:
+    argv = [
+        "--object-path",
         args.object_path,
+        "--output-dir",
         args.output_dir,
+        "--object-scale",
         str(args.object_scale),
+        "--distance-between-cameras",
         str(args.distance_between_cameras),
+        "--distance-from-object",
         str(args.distance_from_object),
+        "--focal-length",
         str(args.focal_length),
+        "--resolution-x",
         str(args.resolution_x),
+        "--resolution-y",
         str(args.resolution_y),
+        "--num-pairs",
         str(args.num_pairs),
+        "--seed",
+        str(args.seed),
     ]
-    subprocess.run(blender_command, check=True)
+    if args.no_scene_reuse:
+        argv.append("--no-scene-reuse")
+    if args.multiview:
+        argv.append("--multiview")
+    if args.ground_truth:
+        argv.extend(["--ground-truth", "--depth-format", args.depth_format])
+    return argv
+
+
+def _follow_worker(process: subprocess.Popen, log_path: Path, on_pair_done):
+    # Blender output goes to the worker log, progress lines are reported to the parent
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        for line in process.stdout:
+            log_file.write(line)
+            if line.startswith(PROGRESS_PREFIX):
+                _, pair_index, seconds = line.split()
+                on_pair_done(int(pair_index), float(seconds))
+    process.wait()
+
+
+def run_render_workers(blender_path: str, args: argparse.Namespace, workers: int) -> Dict[int, float]:
+    """
+    Render the pending pairs in `workers` background Blender processes.
+
+    Returns the render time in seconds of every rendered pair.
+
+    Pairs whose images are already complete are skipped, so an interrupted run can be resumed. The pending pair
+    indices are sharded round-robin between the workers; every pair uses a seed derived from the global seed and its
+    index, so the output does not depend on the number of workers.
+
+    """
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
+    depth_format = args.depth_format if args.ground_truth else None
+    pending = [i for i in range(args.num_pairs) if not is_pair_complete(output_dir / f"pair_{i}", depth_format)]
+    print(f"Pairs to render: {len(pending)}/{args.num_pairs}, {args.num_pairs - len(pending)} already rendered")
+    if not pending:
+        return {}
+
+    shards = [shard for shard in (pending[k::workers] for k in range(workers)) if shard]
+    pair_seconds = {}
+    lock = threading.Lock()
+
+    def on_pair_done(pair_index, seconds):
+        with lock:
+            pair_seconds[pair_index] = seconds
+            print(f"Rendered {len(pair_seconds)}/{len(pending)} pairs", flush=True)
+
+    processes, threads = [], []
+    for k, shard in enumerate(shards):
+        blender_command = [
+            blender_path,
+            "--background",
+            "--python",
+            (Path(__file__).parent / "render.py").as_posix(),
+            "--",
+            *_scene_argv(args),
+            *render_settings_argv(render_settings_from_args(args)),
+            "--pair-indices",
+            ",".join(map(str, shard)),
+        ]
+        process = subprocess.Popen(
+            blender_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
+        )
+        thread = threading.Thread(
+            target=_follow_worker, args=(process, output_dir / f"render_worker_{k}.log", on_pair_done), daemon=True
+        )
+        thread.start()
+        processes.append(process)
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    for k, process in enumerate(processes):
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, f"Blender render worker {k}")
+    return pair_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render paired images using Blender.")
+    parser.add_argument("--blender-path", type=str, required=True, help="Path to the Blender program.")
+    add_scene_arguments(parser)
+    add_render_settings_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1, help="Number of parallel background Blender processes.")
+    args = parser.parse_args()
+
+    run_render_workers(args.blender_path, args, workers=args.workers)
 
 
 if __name__ == "__main__":
-    argv = sys.argv[sys.argv.index("--") + 1 :]
+    blender_parser = argparse.ArgumentParser(description="Render paired images inside Blender.")
+    add_scene_arguments(blender_parser)
+    add_render_settings_arguments(blender_parser)
+    blender_parser.add_argument(
+        "--pair-indices", type=str, default=None, help="Comma separated pair indices to render (default: all)."
+    )
+    blender_args = blender_parser.parse_args(sys.argv[sys.argv.index("--") + 1 :])
 
     blender_render(
-        object_path=argv[0],
-        output_dir=argv[1],
-        object_scale=float(argv[2]),
-        distance_between_cameras=float(argv[3]),
-        distance_from_object=float(argv[4]),
-        focal_length=float(argv[5]),
-        resolution_x=int(argv[6]),
-        resolution_y=int(argv[7]),
-        num_pairs=int(argv[8]),
+        scene_params_from_args(blender_args),
+        output_dir=blender_args.output_dir,
+        num_pairs=blender_args.num_pairs,
+        reuse_scene=not blender_args.no_scene_reuse,
+        seed=blender_args.seed,
+        pair_indices=(
+            None if blender_args.pair_indices is None else list(map(int, blender_args.pair_indices.split(",")))
+        ),
     )
@@ -0,0 +1,104 @@
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from pixelpoint.render import add_scene_arguments
+from pixelpoint.render import run_render_workers
+from pixelpoint.render_settings import RENDER_PRESETS
+from pixelpoint.render_settings import add_render_settings_arguments
+from pixelpoint.render_settings import render_settings_argv
+
+
+def benchmark_render_presets(blender_path, scene_args, presets, output_dir=None):
+    """
+    Render the same pairs with every preset and measure the render time.
+
+    Parameters
+    ----------
+    blender_path : str
+        Path to the Blender program.
+    scene_args : argparse.Namespace
+        Scene arguments of `render-cli`, `num_pairs` pairs are rendered for every preset.
+    presets : list[str]
+        Names of presets from `RENDER_PRESETS`.
+    output_dir : Path, optional
+        Directory to keep the rendered images in, a temporary directory is removed after the benchmark otherwise.
+        Preset subdirectories must be empty: `render-cli` would skip the pairs rendered before and not time them.
+
+    Returns
+    -------
+    report : dict
+        Seconds per pair (without Blender startup and scene setup), total wall time and settings of every preset.
+
+    """
+    if output_dir is not None:
+        for preset in presets:
+            preset_dir = Path(output_dir) / preset
+            if preset_dir.is_dir() and any(preset_dir.iterdir()):
+                raise ValueError(f"Output directory of preset {preset} is not empty: {preset_dir}, remove it first.")
+
+    benchmark_dir = Path(output_dir) if output_dir is not None else Path(tempfile.mkdtemp(prefix="render_benchmark_"))
+    parser = argparse.ArgumentParser()
+    add_render_settings_arguments(parser)
+
+    report = {}
+    try:
+        for preset in presets:
+            preset_args = argparse.Namespace(**vars(scene_args))
+            preset_args.output_dir = (benchmark_dir / preset).as_posix()
+            vars(preset_args).update(vars(parser.parse_args(render_settings_argv(RENDER_PRESETS[preset]))))
+
+            start = time.perf_counter()
+            pair_seconds = run_render_workers(blender_path, preset_args, workers=1)
+            wall_time = time.perf_counter() - start
+
+            report[preset] = {
+                "seconds_per_pair": sum(pair_seconds.values()) / max(len(pair_seconds), 1),
+                "wall_time_s": wall_time,
+                "pairs": len(pair_seconds),
+                "settings": RENDER_PRESETS[preset]._asdict(),
+            }
+            print(f"{preset}: {report[preset]['seconds_per_pair']:.2f} s/pair, wall time {wall_time:.1f} s")
+    finally:
+        if output_dir is None:
+            shutil.rmtree(benchmark_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark render presets on the same scene.")
+    parser.add_argument("--blender-path", type=str, required=True, help="Path to the Blender program.")
+    parser.add_argument("--object-path", type=str, required=True, help="Path to the .stl file.")
+    parser.add_argument("--num-pairs", type=int, default=3, help="Number of pairs to render with every preset.")
+    parser.add_argument(
+        "--presets", type=str, nargs="+", default=list(RENDER_PRESETS), choices=list(RENDER_PRESETS), help="Presets."
+    )
+    parser.add_argument(
+        "--output-dir", type=str, default=None, help="Directory to keep the rendered images (default: removed)."
+    )
+    parser.add_argument(
+        "--output-file",
+        type=Path,
+        default=Path("render_benchmark.json"),
+        help="Path to the JSON report (default: render_benchmark.json).",
+    )
+    args = parser.parse_args()
+
+    # The default scene of render-cli, only the output directory differs between presets
+    scene_parser = argparse.ArgumentParser()
+    add_scene_arguments(scene_parser)
+    scene_args = scene_parser.parse_args(
+        ["--object-path", args.object_path, "--output-dir", "", "--num-pairs", str(args.num_pairs)]
+    )
+    report = benchmark_render_presets(args.blender_path, scene_args, args.presets, output_dir=args.output_dir)
+
+    with open(args.output_file, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Benchmark report saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+"""
+Background render jobs for the web app.
+
+Jobs are spooled as JSON files in a directory, so the web process only writes files and never imports `bpy`. Long-lived
+render workers (Blender processes or Python processes with the `bpy` module) claim jobs by an atomic rename, keep the
+scene of the last job and render jobs in slices of a few pairs. A job that is not finished after a slice goes back to
+the end of the queue, so one huge job can't starve the others.
+
+Spool layout:
+
+- `queue/<enqueue time>_<job id>.json`: jobs waiting for a worker, in FIFO order of the file names;
+- `running/<job id>.json`: jobs claimed by a worker, with its pid and host; the file is rewritten after every pair, so
+  its change time is the heartbeat of the worker;
+- `status/<job id>.json`: state and progress of every job;
+- `cancel/<job id>`: cancellation requests checked by the workers after every pair;
+- `stop/<pool id>`: asks the workers of one pool to exit;
+- `pool.lock`: held by the only pool of the spool that runs workers, e.g. of one of the web app worker processes.
+
+"""
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+FINAL_JOB_STATES = ("done", "failed", "cancelled")
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+def _write_json(path: Path, data: dict):
+    # Readers never see a partially written file
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: Path) -> Optional[dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class RenderQueue:
+    """
+    File spool of render jobs shared by the web app and the render workers.
+
+    Parameters
+    ----------
+    spool_dir : Path
+        Directory of the spool, it is created if needed.
+    max_pairs_per_job : int
+        Maximal number of pairs of one job, larger jobs are rejected.
+    max_queued_jobs : int
+        Maximal number of unfinished jobs, new jobs are rejected with `RenderQueueFull` above it.
+    slice_pairs : int
+        Number of pairs a worker renders before the job goes back to the end of the queue.
+    stale_after : float
+        Seconds without a heartbeat after which a claimed job of a worker on another host, or of an unknown worker,
+        is considered abandoned. Jobs of workers on this host are abandoned as soon as the worker process is gone.
+
+    """
+
+    def __init__(
+        self,
+        spool_dir,
+        max_pairs_per_job: int = 1000,
+        max_queued_jobs: int = 100,
+        slice_pairs: int = 10,
+        stale_after: float = 600.0,
+    ):
+        self.spool_dir = Path(spool_dir)
+        self.max_pairs_per_job = max_pairs_per_job
+        self.max_queued_jobs = max_queued_jobs
+        self.slice_pairs = slice_pairs
+        self.stale_after = stale_after
+
+        self.queue_dir = self.spool_dir / "queue"
+        self.running_dir = self.spool_dir / "running"
+        self.status_dir = self.spool_dir / "status"
+        self.cancel_dir = self.spool_dir / "cancel"
+        self.stop_dir = self.spool_dir / "stop"
+        if self.stop_dir.is_file():
+            self.stop_dir.unlink()  # the stop file of the spools before the per-pool stop files
+        for directory in (self.queue_dir, self.running_dir, self.status_dir, self.cancel_dir, self.stop_dir):
+            directory.mkdir(exist_ok=True, parents=True)
+
+    def submit(
+        self,
+        object_path,
+        output_dir,
+        num_pairs: int,
+        render_preset: Optional[str] = None,
+        seed: Optional[int] = None,
+        time_limit: Optional[float] = None,
+    ) -> str:
+        """
+        Add a job rendering `num_pairs` pairs of an object to `output_dir/<job id>` to the queue and return its id.
+
+        Every pair uses a seed derived from the job seed (random if None) and the pair index, so the output doesn't
+        depend on how the job is sliced between workers. A job that renders longer than `time_limit` seconds fails.
+
+        """
+        if not 1 <= num_pairs <= self.max_pairs_per_job:
+            raise ValueError(f"Number of pairs must be in [1, {self.max_pairs_per_job}], got {num_pairs}.")
+        if self.num_unfinished_jobs() >= self.max_queued_jobs:
+            raise RenderQueueFull(f"The render queue is full ({self.max_queued_jobs} jobs), try again later.")
+
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "job_id": job_id,
+            "object_path": Path(object_path).as_posix(),
+            "output_dir": (Path(output_dir) / job_id).as_posix(),
+            "num_pairs": num_pairs,
+            "render_preset": render_preset,
+            "seed": seed if seed is not None else int.from_bytes(os.urandom(4), "little"),
+            "time_limit": time_limit,
+            "next_pair": 0,
+            "render_time": 0.0,
+        }
+        self._set_status(job, "queued")
+        self._enqueue(job)
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        return _read_json(self.status_dir / f"{job_id}.json")
+
+    def jobs(self) -> List[dict]:
+        statuses = (_read_json(path) for path in self.status_dir.glob("*.json"))
+        return sorted((status for status in statuses if status is not None), key=lambda status: status["created"])
+
+    def num_unfinished_jobs(self) -> int:
+        return len(list(self.queue_dir.glob("*.json"))) + len(list(self.running_dir.glob("*.json")))
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job, a queued job is cancelled at once and a running one after its current pair."""
+        status = self.status(job_id)
+        if status is None or status["state"] in FINAL_JOB_STATES:
+            return False
+
+        for queue_path in self.queue_dir.glob(f"*_{job_id}.json"):
+            # The rename fails if a worker has claimed the job in the meantime
+            cancelled_path = self.cancel_dir / f".{job_id}.cancelled"
+            try:
+                os.rename(queue_path, cancelled_path)
+            except FileNotFoundError:
+                break
+            job = _read_json(cancelled_path)
+            cancelled_path.unlink()
+            self._set_status(job, "cancelled")
+            return True
+
+        (self.cancel_dir / job_id).touch()
+        return True
+
+    def is_cancelled(self, job_id: str) -> bool:
+        return (self.cancel_dir / job_id).exists()
+
+    def claim(self, worker_id: str) -> Optional[dict]:
+        """Take the oldest queued job for `worker_id`, None if the queue is empty."""
+        for queue_path in sorted(self.queue_dir.glob("*.json")):
+            job_id = queue_path.stem.split("_", 1)[1]
+            running_path = self.running_dir / f"{job_id}.json"
+            try:
+                os.rename(queue_path, running_path)
+            except FileNotFoundError:
+                continue  # claimed by another worker or cancelled
+            job = _read_json(running_path)
+            job["worker"] = worker_id
+            job["worker_pid"] = os.getpid()
+            job["worker_host"] = socket.gethostname()
+            _write_json(running_path, job)
+            return job
+        return None
+
+    def update(self, job: dict, state: str, error: Optional[str] = None):
+        """Save the progress of a claimed job, a finished job is released and an unfinished one is requeued."""
+        if state not in JOB_STATES:
+            raise ValueError(f"Unknown job state {state}, use one of {JOB_STATES}")
+        self._set_status(job, state, error=error)
+        running_path = self.running_dir / f"{job['job_id']}.json"
+        if state == "running":
+            # The progress is saved with the claim, so a recovered job continues after the last rendered pair
+            _write_json(running_path, job)
+            return
+
+        if state == "queued":
+            self._enqueue(job)
+        running_path.unlink(missing_ok=True)
+        if state in FINAL_JOB_STATES:
+            (self.cancel_dir / job["job_id"]).unlink(missing_ok=True)
+
+    def recover(self) -> int:
+        """Requeue jobs claimed by workers that are gone, e.g. after a crash of a worker, and return their number."""
+        recovered = 0
+        for running_path in self.running_dir.glob("*.json"):
+            job = _read_json(running_path)
+            if job is not None and not self._worker_alive(job, running_path):
+                self.update(job, "queued")
+                recovered += 1
+        return recovered
+
+    def _worker_alive(self, job: dict, running_path: Path) -> bool:
+        if job.get("worker_host") == socket.gethostname() and job.get("worker_pid") is not None:
+            try:
+                os.kill(job["worker_pid"], 0)
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                return True
+            return True
+        # A worker of another host, or a claim without the worker yet: the change time of the file is the heartbeat,
+        # the rename of the claim and every rewrite update it
+        try:
+            heartbeat = running_path.stat().st_ctime
+        except FileNotFoundError:
+            return True
+        return time.time() - heartbeat < self.stale_after
+
+    def _enqueue(self, job: dict):
+        _write_json(self.queue_dir / f"{time.time_ns():020d}_{job['job_id']}.json", job)
+
+    def _set_status(self, job: dict, state: str, error: Optional[str] = None):
+        status_path = self.status_dir / f"{job['job_id']}.json"
+        previous = _read_json(status_path) or {}
+        _write_json(
+            status_path,
+            {
+                "job_id": job["job_id"],
+                "state": state,
+                "num_pairs": job["num_pairs"],
+                "pairs_done": job["next_pair"],
+                "output_dir": job["output_dir"],
+                "render_time": job["render_time"],
+                "worker": job.get("worker"),
+                "error": error,
+                "created": previous.get("created", time.time()),
+                "updated": time.time(),
+            },
+        )
+
+
+class RenderWorkerPool:
+    """
+    Long-lived render worker processes of a `RenderQueue`.
+
+    Parameters
+    ----------
+    queue : RenderQueue
+        Queue to take the jobs from.
+    workers : int
+        Number of worker processes.
+    blender_path : str, optional
+        Path to the Blender program. Workers run the `bpy` module in the current Python interpreter if None.
+
+    """
+
+    def __init__(self, queue: RenderQueue, workers: int = 1, blender_path: Optional[str] = None):
+        self.queue = queue
+        self.workers = workers
+        self.blender_path = blender_path
+        self.processes: Dict[int, subprocess.Popen] = {}
+        self.pool_id = uuid.uuid4().hex[:12]
+        self.stop_path = queue.stop_dir / self.pool_id
+        self._lock_fd: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_fd is not None
+
+    def start(self) -> bool:
+        """
+        Start the missing or exited workers if this pool is the leader of the spool, and return whether it is.
+
+        Only one pool of a spool runs workers, e.g. when every web app worker process has a pool: the first one takes
+        the lock of the spool, the others take it over when the leader exits. Jobs of workers that are gone go back to
+        the queue. Concurrent calls, e.g. from the threadpool of the web app, are serialized.
+
+        """
+        with self._lock:
+            if not self._acquire_leadership():
+                return False
+            self.stop_path.unlink(missing_ok=True)
+            self.queue.recover()
+
+            for k in range(self.workers):
+                process = self.processes.get(k)
+                if process is not None and process.poll() is None:
+                    continue
+                worker_argv = ["--spool-dir", self.queue.spool_dir.as_posix(), "--worker-id", f"{self.pool_id}-{k}"]
+                worker_argv += ["--slice-pairs", str(self.queue.slice_pairs), "--stop-file", self.stop_path.as_posix()]
+                script = Path(__file__).as_posix()
+                if self.blender_path is not None:
+                    command = [self.blender_path, "--background", "--python", script, "--", *worker_argv]
+                else:
+                    command = [sys.executable, script, *worker_argv]
+                with open(self.queue.spool_dir / f"render_worker_{k}.log", "a", encoding="utf-8") as log_file:
+                    # The worker outlives this call, it's waited for in `stop`
+                    # pylint: disable-next=consider-using-with
+                    self.processes[k] = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+            return True
+
+    def stop(self, timeout: float = 10.0):
+        """Ask the workers of this pool to exit after their current pair, kill the ones that don't and step down."""
+        with self._lock:
+            if self.processes:
+                self.stop_path.touch()
+                deadline = time.monotonic() + timeout
+                for process in self.processes.values():
+                    try:
+                        process.wait(timeout=max(deadline - time.monotonic(), 0))
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                        process.wait()
+                self.processes = {}
+                self.stop_path.unlink(missing_ok=True)
+            # Jobs of the stopped workers are requeued by the next leader
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def _acquire_leadership(self) -> bool:
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(self.queue.spool_dir / "pool.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+        self._lock_fd = fd
+        return True
+
+    def alive(self) -> int:
+        return sum(process.poll() is None for process in self.processes.values())
+
+
+def run_worker(spool_dir, worker_id: str, stop_file, slice_pairs: int = 10, poll_interval: float = 0.5):
+    """
+    Render the jobs of the queue until `stop_file` of the pool appears.
+
+    The scene of the last job is kept, so consecutive slices of the same object and preset don't import the object
+    again.
+
+    """
+    # pylint: disable=import-outside-toplevel
+    from pixelpoint.render import SceneParams
+    from pixelpoint.render import pair_rng
+    from pixelpoint.render import random_object_rotation
+    from pixelpoint.render import render_scene_pair
+    from pixelpoint.render import setup_scene
+    from pixelpoint.render_settings import resolve_render_settings
+
+    queue = RenderQueue(spool_dir, slice_pairs=slice_pairs)
+    stop_file = Path(stop_file)
+    scene, scene_key = None, None
+    while not stop_file.exists():
+        job = queue.claim(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            key = (job["object_path"], job["render_preset"])
+            if key != scene_key:
+                scene_key = None
+                scene_params = SceneParams(
+                    object_path=Path(job["object_path"]), render_settings=resolve_render_settings(job["render_preset"])
+                )
+                scene = setup_scene(scene_params)
+                scene_key = key
+
+            state, error = "queued", None
+            slice_end = min(job["next_pair"] + queue.slice_pairs, job["num_pairs"])
+            for i in range(job["next_pair"], slice_end):
+                if queue.is_cancelled(job["job_id"]) or stop_file.exists():
+                    break
+                start = time.perf_counter()
+                rotation = random_object_rotation(pair_rng(job["seed"], i))
+                render_scene_pair(scene, output_dir=Path(job["output_dir"]) / f"pair_{i}", rotation=rotation)
+                job["next_pair"] = i + 1
+                job["render_time"] += time.perf_counter() - start
+                queue.update(job, "running")
+                if job["time_limit"] is not None and job["render_time"] > job["time_limit"]:
+                    state, error = "failed", f"Time limit of {job['time_limit']} s is exceeded."
+                    break
+
+            if queue.is_cancelled(job["job_id"]):
+                state = "cancelled"
+            elif state != "failed" and job["next_pair"] == job["num_pairs"]:
+                state = "done"
+            queue.update(job, state, error=error)
+        except Exception as exc:  # pylint: disable=broad-except
+            scene_key = None
+            queue.update(job, "failed", error=f"{type(exc).__name__}: {exc}")
+            print(f"Job {job['job_id']} failed: {exc}", flush=True)
+
+
+if __name__ == "__main__":
+    # Blender passes the script arguments after "--", the Python interpreter passes them as they are
+    worker_args = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else sys.argv[1:]
+    sys.path.insert(0, Path(__file__).resolve().parents[1].as_posix())
+
+    worker_parser = argparse.ArgumentParser(description="Render worker of the render job queue.")
+    worker_parser.add_argument("--spool-dir", type=str, required=True, help="Directory of the render job queue.")
+    worker_parser.add_argument("--worker-id", type=str, required=True, help="Name of the worker in the job status.")
+    worker_parser.add_argument("--slice-pairs", type=int, default=10, help="Pairs rendered before a job is requeued.")
+    worker_parser.add_argument("--stop-file", type=str, required=True, help="The worker exits when this file exists.")
+    parsed_args = worker_parser.parse_args(worker_args)
+    run_worker(parsed_args.spool_dir, parsed_args.worker_id, parsed_args.stop_file, slice_pairs=parsed_args.slice_pairs)
@@ -0,0 +1,97 @@
+import argparse
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+"""
+Render settings shared by the Blender scripts and the processes that launch them.
+
+This module doesn't import `bpy`, so the web app and the command line tools can validate and pass the settings to
+Blender processes without Blender in their own environment.
+
+"""
+
+RENDER_ENGINES = {"eevee": "BLENDER_EEVEE", "cycles": "CYCLES", "workbench": "BLENDER_WORKBENCH"}
+WORKBENCH_AA_SAMPLES = (5, 8, 11, 16, 32)
+
+
+class RenderSettings(NamedTuple):
+    engine: str = "eevee"  # key of RENDER_ENGINES, Cycles renders on CPU
+    samples: int = 64  # render samples of Eevee/Cycles, anti-aliasing samples of Workbench
+    resolution_percentage: int = 100  # percentage of the camera resolution
+    compression: int = 15  # PNG compression in percent, 0 is the fastest to write
+    tile_size: int = 2048  # Cycles tile size in pixels
+    denoise: bool = False  # Cycles denoising
+
+
+RENDER_PRESETS = {
+    "preview": RenderSettings(engine="workbench", samples=1, resolution_percentage=25, compression=0),
+    "train": RenderSettings(engine="eevee", samples=16, resolution_percentage=50, compression=15),
+    "final": RenderSettings(engine="cycles", samples=128, resolution_percentage=100, compression=15, denoise=True),
+}
+
+
+def resolve_render_settings(preset: Optional[str] = None, **overrides) -> Optional[RenderSettings]:
+    """
+    Build render settings from a named preset and explicit options.
+
+    Options that are None are taken from the preset, or from `RenderSettings` defaults without a preset. Returns
+    None when neither a preset nor an option is given, so Blender keeps its own default settings.
+
+    """
+    overrides = {name: value for name, value in overrides.items() if value is not None}
+    if preset is None and not overrides:
+        return None
+    if preset is not None and preset not in RENDER_PRESETS:
+        raise ValueError(f"Unknown render preset {preset}, use one of {list(RENDER_PRESETS)}")
+    if overrides.get("engine", "eevee") not in RENDER_ENGINES:
+        raise ValueError(f"Unknown render engine {overrides['engine']}, use one of {list(RENDER_ENGINES)}")
+
+    settings = RENDER_PRESETS[preset] if preset is not None else RenderSettings()
+    return settings._replace(**overrides)
+
+
+def add_render_settings_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--preset",
+        type=str,
+        default=None,
+        choices=list(RENDER_PRESETS),
+        help="Render preset, explicit options below override it. Blender defaults are used without preset and options.",
+    )
+    parser.add_argument("--engine", type=str, default=None, choices=list(RENDER_ENGINES), help="Render engine.")
+    parser.add_argument("--samples", type=int, default=None, help="Number of render samples.")
+    parser.add_argument(
+        "--resolution-percentage", type=int, default=None, help="Percentage of the resolution to render at."
+    )
+    parser.add_argument("--compression", type=int, default=None, help="PNG compression in percent (0-100).")
+    parser.add_argument("--tile-size", type=int, default=None, help="Cycles tile size in pixels.")
+    parser.add_argument(
+        "--denoise", action=argparse.BooleanOptionalAction, default=None, help="Enable Cycles denoising."
+    )
+
+
+def render_settings_from_args(args: argparse.Namespace) -> Optional[RenderSettings]:
+    return resolve_render_settings(
+        args.preset,
+        engine=args.engine,
+        samples=args.samples,
+        resolution_percentage=args.resolution_percentage,
+        compression=args.compression,
+        tile_size=args.tile_size,
+        denoise=args.denoise,
+    )
+
+
+def render_settings_argv(settings: Optional[RenderSettings]) -> List[str]:
+    """Command line options that reproduce `settings` in a Blender process."""
+    if settings is None:
+        return []
+    argv = []
+    for name, value in settings._asdict().items():
+        option = "--" + name.replace("_", "-")
+        if isinstance(value, bool):
+            argv.append(option if value else f"--no-{name}")
+        else:
+            argv.extend([option, str(value)])
+    return argv
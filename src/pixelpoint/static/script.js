@@ -101,6 +101,10 @@ document.getElementById('upload-model-btn').addEventListener('click', async func
     const formData = new FormData();
     formData.append('images_count', imagesCount);
     formData.append('model_file', modelFile.files[0]);
+    const renderPreset = document.getElementById('render_preset').value;
+    if (renderPreset) {
+        formData.append('render_preset', renderPreset);
+    }
 
     try {
         const response = await fetch('/upload_model/', {
@@ -111,6 +115,7 @@ document.getElementById('upload-model-btn').addEventListener('click', async func
         if (response.ok) {
             document.getElementById('images_count_display').innerText = result.images_count;
             document.getElementById('action_result').innerText = result.result;
+            followProgress(result.progress_url);
         } else {
             alert(result.error);
         }
@@ -119,6 +124,51 @@ document.getElementById('upload-model-btn').addEventListener('click', async func
     }
 });
 
+// Прогресс долгих операций: сервер присылает события этапов (Server-Sent Events) с длительностью каждого этапа
+function followProgress(progressUrl) {
+    const actionResult = document.getElementById('action_result');
+    const source = new EventSource(progressUrl);
+
+    source.onmessage = function(message) {
+        const event = JSON.parse(message.data);
+        let text = `${event.stage} (${event.duration.toFixed(2)} s, total ${event.elapsed.toFixed(2)} s)`;
+        if (event.stage === 'pair_rendered') {
+            text = `pair ${event.pairs_done}/${event.num_pairs} rendered (${event.duration.toFixed(2)} s)`;
+        }
+        if (event.result) {
+            text += `: ${event.result}`;
+        }
+        if (event.error) {
+            text += `: ${event.error}`;
+        }
+        actionResult.innerText = text;
+        if (event.images) {
+            showResultImages(event.images);
+        }
+
+        if (['done', 'error', 'cancelled'].includes(event.stage)) {
+            source.close();
+        }
+    };
+}
+
+// Превью результатов: полноразмерный PNG кодируется сервером только при переходе по ссылке
+function showResultImages(images) {
+    const container = document.getElementById('result_images');
+    container.innerHTML = '';
+    for (const image of images) {
+        const link = document.createElement('a');
+        link.href = image.url;
+        link.target = '_blank';
+        const preview = document.createElement('img');
+        preview.src = image.preview_url;
+        preview.alt = image.name;
+        preview.style.maxWidth = '48%';
+        link.appendChild(preview);
+        container.appendChild(link);
+    }
+}
+
 // Логика кнопки "Upload and Process"
 document.getElementById('upload-and-process-btn').addEventListener('click', async function() {
     const image1Input = document.getElementById('image1');
@@ -141,6 +191,7 @@ document.getElementById('upload-and-process-btn').addEventListener('click', asyn
         const result = await response.json();
         if (response.ok) {
             document.getElementById('action_result').innerText = result.result;
+            followProgress(result.progress_url);
         } else {
             alert(result.error);
         }
@@ -0,0 +1,108 @@
+from functools import lru_cache
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+@lru_cache(maxsize=32)
+def _marker_stencil(radius: int, thickness: int) -> np.ndarray:
+    # Offsets of the pixels of a disk (thickness < 0) or a ring, drawn once by cv2.circle, so the markers have exactly
+    # the shape of cv2.circle
+    half_size = radius + max(thickness, 1) + 1
+    mask = np.zeros((2 * half_size + 1, 2 * half_size + 1), dtype=np.uint8)
+    cv2.circle(mask, (half_size, half_size), radius, 1, thickness=thickness)
+    return np.argwhere(mask) - half_size
+
+
+def match_colors(num_colors: int, seed=None) -> np.ndarray:
+    """Random bright colors of shape (num_colors, 3), the i-th color is a shade of channel i % 3."""
+    rng = np.random.default_rng(seed)
+    colors = np.zeros((num_colors, 3), dtype=np.uint8)
+    colors[np.arange(num_colors), np.arange(num_colors) % 3] = rng.integers(128, 255, num_colors)
+    return colors
+
+
+def draw_markers(
+    image: np.ndarray,
+    points: np.ndarray,
+    colors=(0, 0, 255),
+    radius: int = 2,
+    thickness: int = -1,
+    scale: float = 1.0,
+) -> np.ndarray:
+    """
+    Draw circle markers at all points in one vectorized pass.
+
+    A stencil of marker pixel offsets is built once, added to all rounded points and written into the image with a
+    single fancy-indexing assignment, so the cost does not depend on a Python loop over the points.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        Grayscale or BGR image, it is not modified.
+    points : np.ndarray
+        Marker centers (x, y) of shape (N, 2) in the coordinates of `image`.
+    colors : tuple or np.ndarray
+        One BGR color for all markers or colors of shape (N, 3).
+    radius : int
+        Marker radius in pixels of `image`.
+    thickness : int
+        Ring thickness in pixels of `image`, a negative value draws filled disks as in `cv2.circle`.
+    scale : float
+        Scale of the output image, e.g. 0.25 renders a preview without drawing at full resolution first.
+
+    Returns
+    -------
+    canvas : np.ndarray
+        BGR image with the markers of shape (round(H * scale), round(W * scale), 3).
+
+    """
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    canvas = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image.copy()
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return canvas
+
+    stencil = _marker_stencil(max(round(radius * scale), 1), round(thickness * scale) if thickness >= 0 else -1)
+    stencil = stencil.astype(np.int32)
+    centers = np.round(points[:, ::-1] * scale).astype(np.int32)
+    rows = centers[:, None, 0] + stencil[None, :, 0]
+    columns = centers[:, None, 1] + stencil[None, :, 1]
+
+    height, width = canvas.shape[:2]
+    inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+    flat_indices = (rows * width + columns)[inside]
+    owners = np.broadcast_to(np.arange(len(points), dtype=np.int32)[:, None], rows.shape)[inside]
+
+    # BGR pixels are viewed as single 3-byte items, so every marker pixel is written with one index
+    pixel_dtype = np.dtype((np.void, 3))
+    colors = np.ascontiguousarray(np.broadcast_to(np.asarray(colors, dtype=np.uint8), (len(points), 3)))
+    canvas.reshape(-1, 3).view(pixel_dtype).reshape(-1)[flat_indices] = colors.view(pixel_dtype).reshape(-1)[owners]
+    return canvas
+
+
+def save_image(path, image: np.ndarray):
+    """Write a BGR image with OpenCV, without matplotlib, creating the parent directory if needed."""
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    if not cv2.imwrite(path.as_posix(), image):
+        raise ValueError(f"Image can not be written to {path}")
+
+
+def show_images(images, titles=None):
+    """Show BGR images side by side in a matplotlib window for interactive use."""
+    # Imported here, so batch runs that only save images don't load a GUI backend
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    plt.figure(figsize=(6 * len(images), 6))
+    for i, image in enumerate(images):
+        plt.subplot(1, len(images), i + 1)
+        plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        plt.axis("off")
+        if titles is not None:
+            plt.title(titles[i])
+    plt.tight_layout()
+    plt.show()